@@ -0,0 +1,209 @@
+"""
+Analysis of levels that is worth keeping: the solution, the dead squares and the difficulty
+metrics. Levels that did not change are looked up instead of solved again, by validate.py and
+when the game loads a level.
+
+The cache is content-addressed: the key is the hash of the level string (without the line endings
+and empty lines around it, which parse_level ignores too) and of ANALYSIS_VERSION. A changed level
+gets a new key and is analyzed again, the entry of the old one is simply not used anymore.
+
+The solver runs with a weighted heuristic (SOLVER_WEIGHT), so the solution and the metrics taken
+from it (moves, pushes, switches) are of a short solution, not necessarily of the shortest one.
+The weight is part of the key and of the entry, an analysis with weight 1 is an optimal one.
+
+Two append-only files, both memory-mapped when opened:
+- analysis.dat: a header and the entries as JSON one after the other,
+- analysis.idx: a header and a record (key, offset, length) per entry, later records win.
+An entry is written before its index record, so a crash never leaves a record without its entry.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from dataclasses import asdict, dataclass
+
+from bitboard import Board
+from deadlock import DeadlockAnalyzer
+from simulation import Action
+from solver import parse_moves, solve, verify
+
+# a change of the solver or the deadlock rules must change this, the old entries are no longer found
+ANALYSIS_VERSION: int = 2
+FORMAT_VERSION: int = 1  # of the files, other files are started over
+HEADER = struct.Struct("<4sI")  # magic, format version
+INDEX = struct.Struct("<16sQI")  # key, offset, length
+KEY_SIZE: int = 16
+DATA_MAGIC: bytes = b"MZAD"
+INDEX_MAGIC: bytes = b"MZAI"
+# the statuses that do not depend on the time and memory limits
+FINAL_STATUSES: frozenset[str] = frozenset({"solved", "unsolvable"})
+SOLVER_WEIGHT: float = 5.0  # heuristic weight of the solver, 1 finds the shortest solutions but is slow
+# shared with the decoded images and sounds of main.py, None disables the cache
+CACHE_DIR: str | None = None if sys.platform == "emscripten" else os.path.join(
+    os.path.expanduser("~"), ".cache", "maztek-spirit-warrior")
+
+
+@dataclass(slots=True)
+class Analysis:
+    # "solved", "unsolvable", "memory limit", "time limit" or "invalid solution"
+    status: str
+    solution: str = ""  # see solver.format_moves, the shortest only with weight 1
+    seconds: float = 0.0  # solve time
+    width: int = 0
+    dead: int = 0  # bitboard of the dead squares, see deadlock.py
+    # difficulty metrics, of the solution above
+    moves: int = 0
+    pushes: int = 0
+    switches: int = 0
+    expanded: int = 0  # nodes the solver expanded
+    weight: float = SOLVER_WEIGHT  # heuristic weight of the solver
+
+    @property
+    def solved(self) -> bool:
+        return self.status == "solved"
+
+    @property
+    def dead_squares(self) -> int:
+        return self.dead.bit_count()
+
+    @property
+    def actions(self) -> list[Action]:
+        return parse_moves(self.solution)
+
+
+def level_key(level: str, weight: float = SOLVER_WEIGHT) -> bytes:
+    normalized = level.replace("\r\n", "\n").strip("\n")
+    return hashlib.sha1(f"{ANALYSIS_VERSION}\n{weight:g}\n{normalized}".encode()).digest()[:KEY_SIZE]
+
+
+def analyze(
+        level: str,
+        time_limit: float = 30.0,
+        memory_limit_mb: float = 256.0,
+        weight: float = SOLVER_WEIGHT,
+) -> Analysis:
+    """
+    Solve the level and check the solution in the simulation, the level must be valid. The solution
+    is the shortest only with weight 1.
+    """
+    board = Board.from_level(level)[0]
+    result = solve(level, memory_limit_mb=memory_limit_mb, time_limit=time_limit, weight=weight)
+    analysis = Analysis(
+        status=result.status,
+        seconds=round(result.elapsed, 3),
+        width=board.width,
+        dead=DeadlockAnalyzer(board).dead,
+        expanded=result.expanded,
+        weight=weight,
+    )
+    if result.solved:
+        if not verify(level, result.moves):
+            analysis.status = "invalid solution"
+            return analysis
+        analysis.solution = result.solution
+        analysis.moves = len(result.moves)
+        analysis.pushes = result.pushes
+        analysis.switches = result.moves.count(Action.SWITCH)
+    return analysis
+
+
+class AnalysisCache:
+    def __init__(self, directory: str | None, read_only: bool = False) -> None:
+        """read_only: only look up, bad or stale files are ignored and left to the writer to remove"""
+        self.directory = directory
+        self.read_only = read_only
+        self.index: dict[bytes, tuple[int, int]] = {}  # offset and length in the data file
+        self.data: mmap.mmap | None = None
+        self.added: dict[bytes, Analysis] = {}  # written after the files were mapped
+        self.stale = False  # files of another format, the next entry starts them over
+        if directory is not None:
+            self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _map(self, name: str, magic: bytes) -> mmap.mmap | None:
+        try:
+            with open(self._path(name), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None  # missing or empty
+        if len(mapped) < HEADER.size or HEADER.unpack_from(mapped) != (magic, FORMAT_VERSION):
+            mapped.close()
+            self.stale = True
+            return None
+        return mapped
+
+    def _load(self) -> None:
+        self.data = self._map("analysis.dat", DATA_MAGIC)
+        index = self._map("analysis.idx", INDEX_MAGIC)
+        # records without their data would point into the entries written next
+        self.stale |= (self.data is None) != (index is None)
+        if self.stale:
+            for mapped in (self.data, index):
+                if mapped is not None:
+                    mapped.close()
+            self.data = index = None
+            # a reader leaves them alone, a writer may be between writing the two files right now
+            if not self.read_only:
+                for name in ("analysis.dat", "analysis.idx"):
+                    try:
+                        os.remove(self._path(name))
+                    except OSError:
+                        pass
+        if self.data is None or index is None:
+            return
+        size = len(self.data)
+        # a record cut short by a crash is left out
+        records = (len(index) - HEADER.size) // INDEX.size
+        view = memoryview(index)[HEADER.size:HEADER.size + records * INDEX.size]
+        for key, offset, length in INDEX.iter_unpack(view):
+            if offset + length <= size:
+                self.index[key] = (offset, length)
+        view.release()
+        index.close()
+
+    def __len__(self) -> int:
+        return len(self.index.keys() | self.added.keys())
+
+    def get(self, level: str, weight: float = SOLVER_WEIGHT) -> Analysis | None:
+        """The analysis of the level by the solver with this heuristic weight"""
+        key = level_key(level, weight)
+        analysis = self.added.get(key)
+        if analysis is not None or key not in self.index:
+            return analysis
+        offset, length = self.index[key]
+        try:
+            return Analysis(**json.loads(self.data[offset:offset + length]))
+        except (ValueError, TypeError):
+            return None  # written by another version of the code
+
+    def put(self, level: str, analysis: Analysis) -> None:
+        """Append the analysis, only if it does not depend on the limits of the solver"""
+        if self.directory is None or self.read_only or analysis.status not in FINAL_STATUSES:
+            return
+        key = level_key(level, analysis.weight)
+        entry = json.dumps(asdict(analysis), separators=(",", ":")).encode()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path("analysis.dat"), "ab") as data:
+                if data.tell() == 0:
+                    data.write(HEADER.pack(DATA_MAGIC, FORMAT_VERSION))
+                offset = data.tell()
+                data.write(entry)
+            with open(self._path("analysis.idx"), "ab") as index:
+                if index.tell() == 0:
+                    index.write(HEADER.pack(INDEX_MAGIC, FORMAT_VERSION))
+                index.write(INDEX.pack(key, offset, len(entry)))
+        except OSError:
+            return
+        self.added[key] = analysis
+
+    def close(self) -> None:
+        if self.data is not None:
+            self.data.close()
+            self.data = None
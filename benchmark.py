@@ -0,0 +1,263 @@
+"""
+Headless benchmark: runs the real Game with SDL's dummy video and audio drivers and scripted
+input for a number of frames on every level of levels.all_levels and on generated stress levels
+with thousands of crystals and walls.
+
+For every level it reports the frames per second, the memory allocated per frame and the peak
+RSS. The clock does not wait, so the frame rate is how fast the game could run. Every level runs
+in its own process, so the peak RSS is that of the level alone.
+
+The results are written as JSON. With --compare the run is checked against an earlier result and
+fails when the median frame rate of a level dropped by more than the threshold.
+
+usage: python benchmark.py [--frames 600] [--out baseline.json] [--compare baseline.json --threshold 0.15]
+"""
+from __future__ import annotations
+
+import os
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+
+import pygame
+from pygame.math import Vector2
+
+import main as game
+from levels import all_levels
+
+try:
+    import resource
+except ImportError:
+    resource = None  # windows
+
+DIRECTIONS: list[Vector2] = [Vector2(0, -1), Vector2(0, 1), Vector2(-1, 0), Vector2(1, 0), Vector2(0, 0)]
+
+
+@dataclass(slots=True)
+class StressMap:
+    name: str
+    width: int
+    height: int
+    crystals: int
+    walls: float  # share of the inner tiles
+    seed: int = 0
+
+
+STRESS_MAPS: list[StressMap] = [
+    StressMap("stress_crystals", 80, 80, 3000, 0.1),
+    StressMap("stress_walls", 120, 120, 1000, 0.4),
+]
+
+
+@dataclass(slots=True)
+class Result:
+    name: str
+    frames: int
+    fps: float
+    frame_ms_p50: float
+    frame_ms_p99: float
+    # from a second run with tracemalloc, it makes the frames slower
+    alloc_kb_per_frame: float  # peak of the memory allocated during a frame
+    blocks_per_frame: float  # growth of the allocated memory blocks, leaks show up here
+    gc_collections: int  # during the timed run, loading included
+    peak_rss_mb: float
+
+
+def stress_level(stress: StressMap) -> str:
+    """A level surrounded by walls with random walls, crystals, goals and masks inside"""
+    rng = random.Random(stress.seed)
+    inner = [(x, y) for y in range(1, stress.height - 1) for x in range(1, stress.width - 1)]
+    rng.shuffle(inner)
+    player = inner.pop()
+    # the goals are not under the crystals, so the level is never solved
+    tiles = {pos: "#" for pos in inner[:int(len(inner) * stress.walls)]}
+    free = inner[len(tiles):]
+    tiles |= {pos: "$" for pos in free[:stress.crystals]}
+    tiles |= {pos: "." for pos in free[stress.crystals:stress.crystals + stress.crystals // 10]}
+    x, y = player
+    # the masks right next to the player, so the scripted input pushes and breaks crystals
+    for pos, mask in zip(((x + 1, y), (x - 1, y), (x, y + 1)), "PBI"):
+        if 0 < pos[0] < stress.width - 1 and 0 < pos[1] < stress.height - 1:
+            tiles[pos] = mask
+    tiles[player] = "@"
+
+    rows = []
+    for y in range(stress.height):
+        if y in (0, stress.height - 1):
+            rows.append("#" * stress.width)
+        else:
+            rows.append("#" + "".join(tiles.get((x, y), " ") for x in range(1, stress.width - 1)) + "#")
+    return "\n" + "\n".join(rows) + "\n"
+
+
+# ============================
+# Scripted game
+# ============================
+
+class BenchmarkClock:
+    """A clock that does not wait, it measures the frames instead"""
+
+    def __init__(self, allocations: bool) -> None:
+        self.allocations = allocations
+        self.last = 0.0
+        self.blocks = 0
+        self.start_memory = 0
+        self.skip = False  # the next frame waits for something else than the game, e.g. the win pause
+        self.frame_times: list[float] = []
+        self.alloc_peaks: list[int] = []
+        self.block_growth: list[int] = []
+
+    def tick(self, framerate: int = 0) -> int:
+        now = time.perf_counter()
+        if self.last and not self.skip:
+            self.frame_times.append(now - self.last)
+        self.skip = False
+        if self.allocations:
+            if self.last:
+                self.alloc_peaks.append(tracemalloc.get_traced_memory()[1] - self.start_memory)
+                self.block_growth.append(sys.getallocatedblocks() - self.blocks)
+            tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+            self.blocks = sys.getallocatedblocks()
+        self.last = time.perf_counter()
+        # a fixed time step, every run plays the same
+        return 1000 // game.FPS
+
+    def get_fps(self) -> float:
+        return game.FPS
+
+
+class ScriptedGame(game.Game):
+    """The Game with the input of a seeded random walk instead of the keyboard"""
+
+    def __init__(self, level: str, frames: int, allocations: bool, seed: int = 0) -> None:
+        super().__init__(level_pack=[level])
+        self.clock = BenchmarkClock(allocations)
+        self.frames = frames
+        self.frame = 0
+        self.rng = random.Random(seed)
+        self.direction = DIRECTIONS[0]
+
+    def input_direction(self) -> Vector2:
+        self.frame += 1
+        if self.frame % 30 == 0:
+            self.direction = self.rng.choice(DIRECTIONS)
+        if self.frame % 97 == 0:
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE))
+        if self.frame == self.frames:
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+        return self.direction
+
+    def draw_you_won(self) -> None:
+        super().draw_you_won()
+        self.clock.skip = True
+
+
+def run_game(level: str, frames: int, allocations: bool) -> BenchmarkClock:
+    scripted = ScriptedGame(level, frames, allocations)
+    asyncio.run(scripted.run())
+    return scripted.clock
+
+
+def benchmark(args: tuple[str, str, int]) -> Result:
+    """Runs in a fresh process: first the timed run, then one with tracemalloc"""
+    name, level, frames = args
+    collections = sum(stats["collections"] for stats in gc.get_stats())
+    timed = run_game(level, frames, allocations=False)
+    collections = sum(stats["collections"] for stats in gc.get_stats()) - collections
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else 0.0
+
+    tracemalloc.start()
+    traced = run_game(level, min(frames, 300), allocations=True)
+    tracemalloc.stop()
+
+    times = sorted(timed.frame_times)
+    return Result(
+        name=name,
+        frames=len(times),
+        fps=round(len(times) / sum(times), 1) if times else 0.0,
+        frame_ms_p50=round(times[len(times) // 2] * 1000, 3) if times else 0.0,
+        frame_ms_p99=round(times[min(len(times) - 1, int(len(times) * 0.99))] * 1000, 3) if times else 0.0,
+        alloc_kb_per_frame=round(sum(traced.alloc_peaks) / max(1, len(traced.alloc_peaks)) / 1024, 1),
+        blocks_per_frame=round(sum(traced.block_growth) / max(1, len(traced.block_growth)), 1),
+        gc_collections=collections,
+        peak_rss_mb=round(peak_rss, 1),
+    )
+
+
+# ============================
+# Command line
+# ============================
+
+def compare(results: list[Result], baseline: dict, threshold: float) -> list[str]:
+    """
+    The levels that got slower than the baseline by more than the threshold. The median frame time
+    is compared, it is less noisy than the average frame rate.
+    """
+    before = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = before.get(r.name)
+        if old is None or not old["frame_ms_p50"] or not r.frame_ms_p50:
+            continue
+        old_fps, new_fps = 1000 / old["frame_ms_p50"], 1000 / r.frame_ms_p50
+        change = new_fps / old_fps - 1
+        print(f"{r.name:24} {old_fps:8.1f} -> {new_fps:8.1f} fps ({change:+.1%})", file=sys.stderr)
+        if change < -threshold:
+            regressions.append(f"{r.name}: {old_fps:.1f} -> {new_fps:.1f} fps ({change:+.1%})")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless frame rate benchmark over all levels and stress levels")
+    parser.add_argument("--frames", type=int, default=600, help="frames per level")
+    parser.add_argument("--no-stress", action="store_true", help="only the levels of levels.py")
+    parser.add_argument("--out", default=None, help="write the results to this file instead of printing them")
+    parser.add_argument("--compare", default=None, help="results of an earlier run, fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed frame rate drop, 0.15 = 15%%")
+    args = parser.parse_args(argv)
+
+    jobs = [(f"level_{i}", level, args.frames) for i, level in enumerate(all_levels)]
+    if not args.no_stress:
+        jobs += [(stress.name, stress_level(stress), args.frames) for stress in STRESS_MAPS]
+
+    # one level after the other, so they do not compete for the CPU, each in a fresh process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(benchmark, jobs, chunksize=1)
+
+    summary = {
+        "frames": args.frames,
+        "python": sys.version.split()[0],
+        "pygame": pygame.version.ver,
+        "results": [asdict(r) for r in results],
+    }
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"regression {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
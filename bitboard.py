@@ -0,0 +1,306 @@
+"""
+Compact level state for search: walls, goals and crystals are Python ints used as bitboards over
+the row-major tile index (bit y * width + x), the player is a single tile index.
+
+Board holds the parts of a level that never change, BitState the parts that do. A BitState is a
+handful of ints, so millions of them can be hashed and stored. The rules are the same as in
+simulation.py.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from typing import Any
+
+from simulation import PUSHES, Action, EventKind, LevelData, Power, parse_level
+
+MASK_LETTERS: dict[Power, str] = {Power.PUSH: "P", Power.BREAK: "B", Power.IGNORE: "I"}
+
+
+def bits(indices) -> int:
+    result = 0
+    for i in indices:
+        result |= 1 << i
+    return result
+
+
+def indices(bitboard: int) -> list[int]:
+    """The set bits, lowest first"""
+    result = []
+    while bitboard:
+        low = bitboard & -bitboard
+        result.append(low.bit_length() - 1)
+        bitboard ^= low
+    return result
+
+
+@dataclass(frozen=True, slots=True)
+class BitState:
+    boxes: int
+    masks: int
+    player: int
+    abilities: int = 1 << Power.NONE.value  # bit set of Power values
+    current: int = Power.NONE.value
+
+
+@dataclass(frozen=True, slots=True)
+class Board:
+    width: int
+    height: int
+    walls: int
+    goals: int
+    floors: int
+    mask_powers: dict[int, Power]
+    texts: tuple[tuple[tuple[int, int], str], ...] = ()
+    # every tile of the board, and every tile except those of the first / last column
+    everything: int = 0
+    not_first_column: int = 0
+    not_last_column: int = 0
+
+    @classmethod
+    def create(
+            cls,
+            width: int,
+            height: int,
+            walls: int,
+            goals: int,
+            floors: int,
+            mask_powers: dict[int, Power],
+            texts: tuple[tuple[tuple[int, int], str], ...] = (),
+    ) -> Board:
+        everything = (1 << width * height) - 1
+        first_column = bits(y * width for y in range(height))
+        last_column = first_column << width - 1
+        return cls(width, height, walls, goals, floors, mask_powers, texts,
+                   everything, everything & ~first_column, everything & ~last_column)
+
+    @classmethod
+    def from_level(cls, level: Any) -> tuple[Board, BitState]:
+        """A level string, a LevelData or a Level of main.py"""
+        if isinstance(level, str):
+            level = parse_level(level)
+        if isinstance(level, LevelData):
+            width, height = level.width, level.height
+            walls, goals, floors, boxes = level.walls, level.goals, level.floors, level.boxes
+            masks = level.masks
+            texts = level.texts
+            player = level.player
+        else:
+            width, height = level.width, level.height
+            walls, goals, floors, boxes = ({(p.x, p.y) for p in tiles} for tiles in
+                                           (level.walls, level.goals, level.floors, level.boxes))
+            masks = {(m.pos.x, m.pos.y): m.power for m in level.masks}
+            texts = [((t.pos.x, t.pos.y), t.text) for t in level.text]
+            player = (level.player.x, level.player.y) if level.player is not None else None
+        if player is None:
+            raise ValueError("level has no player")
+
+        board = cls.create(
+            width, height,
+            bits(y * width + x for x, y in walls),
+            bits(y * width + x for x, y in goals),
+            bits(y * width + x for x, y in floors),
+            {y * width + x: power for (x, y), power in masks.items()},
+            tuple(texts),
+        )
+        state = BitState(
+            boxes=bits(y * width + x for x, y in boxes),
+            masks=bits(board.mask_powers),
+            player=player[1] * width + player[0],
+        )
+        return board, state
+
+    # ----------------------------
+
+    def index(self, x: int, y: int) -> int:
+        return y * self.width + x
+
+    def target(self, i: int, action: Action, push: bool = False) -> int:
+        """
+        The tile the player goes to from i with the action, or with push the tile a crystal on i
+        goes to. -1 for walls and outside.
+        """
+        dx, dy = action.push if push else action.step
+        x, y = i % self.width + dx, i // self.width + dy
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        j = y * self.width + x
+        return -1 if self.walls >> j & 1 else j
+
+    def shift(self, bitboard: int, action: Action, push: bool = False) -> int:
+        """
+        Move every bit one tile in the direction of the step of the action, or with push in the
+        direction a crystal goes. Bits leaving the board are dropped.
+        """
+        return self.offset(bitboard, *(action.push if push else action.step))
+
+    def offset(self, bitboard: int, dx: int, dy: int) -> int:
+        """Move every bit by dx, dy (-1, 0 or 1), bits leaving the board are dropped"""
+        if dx < 0:
+            bitboard = bitboard >> 1 & self.not_last_column
+        elif dx > 0:
+            bitboard = bitboard << 1 & self.not_first_column
+        if dy < 0:
+            bitboard >>= self.width
+        elif dy > 0:
+            bitboard = bitboard << self.width & self.everything
+        return bitboard
+
+    def around(self, bitboard: int) -> int:
+        """The tiles next to the bits, diagonal neighbours included"""
+        row = bitboard | bitboard >> 1 & self.not_last_column | bitboard << 1 & self.not_first_column
+        return (row | row >> self.width | row << self.width & self.everything) & ~bitboard
+
+    def push_sources(self, into: int, player: int | None = None) -> int:
+        """
+        The tiles a crystal can be pushed from onto a tile of into, along an axis or diagonally,
+        with the player on a tile of player before it. None: the player stands on the crystal, with
+        free pushes.
+        """
+        sources = 0
+        for action in PUSHES:
+            dx, dy = action.push
+            tiles = self.offset(into, -dx, -dy)
+            if player is not None:
+                tiles &= self.shift(player, action)
+            sources |= tiles
+        return sources
+
+    def reachable(self, state: BitState, ignore: bool = False) -> int:
+        """Flood fill of the tiles the player walks to without pushing, breaking or picking up anything"""
+        free = self.everything & ~self.walls & ~state.masks
+        if not ignore:
+            free &= ~state.boxes
+        region = 1 << state.player
+        while True:
+            grown = region | (
+                    region >> self.width | region << self.width
+                    | (region >> 1 & self.not_last_column) | (region << 1 & self.not_first_column)
+            ) & free
+            if grown == region:
+                return region
+            region = grown
+
+    def is_solved(self, state: BitState) -> bool:
+        return self.goals & ~state.boxes == 0
+
+    @property
+    def free_pushes(self) -> bool:
+        """With both push and ignore the player can stand on a crystal and push it without room behind"""
+        return {Power.PUSH, Power.IGNORE} <= set(self.mask_powers.values())
+
+    def live_squares(self) -> int:
+        """
+        The tiles a crystal can be pushed to a goal from, whatever the other crystals do. Crystals on
+        the other tiles, the dead squares, never reach a goal.
+        """
+        space = self.everything & ~self.walls
+        # with free pushes the player stands on the crystal, otherwise before it
+        player = None if self.free_pushes else space
+        live = self.goals
+        while True:
+            grown = live | self.push_sources(live, player) & space
+            if grown == live:
+                return live
+            live = grown
+
+    # ----------------------------
+
+    def move(self, state: BitState, action: Action) -> BitState | None:
+        """Walk one tile, picking up a mask there, None if a wall or a crystal is in the way"""
+        t = self.target(state.player, action)
+        if t < 0 or (state.boxes >> t & 1 and state.current != Power.IGNORE.value):
+            return None
+        if state.masks >> t & 1:
+            power = self.mask_powers[t].value
+            return BitState(state.boxes, state.masks & ~(1 << t), t, state.abilities | 1 << power, power)
+        return replace(state, player=t)
+
+    def push(self, state: BitState, action: Action) -> BitState | None:
+        """
+        Push the crystal under the player or in front of it one tile in the direction of the push of
+        the action, the player follows unless it pushed the crystal it stands on. None if there is
+        nothing to push or no room where it goes.
+        """
+        t = self.target(state.player, action)
+        if t < 0:
+            return None
+        box = state.player if state.boxes >> state.player & 1 else t
+        if not state.boxes >> box & 1:
+            return None
+        behind = self.target(box, action, push=True)
+        if behind < 0 or state.boxes >> behind & 1:
+            return None
+        boxes = state.boxes & ~(1 << box) | 1 << behind
+        if box == state.player:
+            return replace(state, boxes=boxes)
+        return self.move(replace(state, boxes=boxes), action)
+
+    def break_box(self, state: BitState, action: Action) -> BitState | None:
+        """Shatter the crystal under the player or in front of it, the player stays"""
+        t = self.target(state.player, action)
+        if t < 0:
+            return None
+        box = state.player if state.boxes >> state.player & 1 else t
+        if not state.boxes >> box & 1:
+            return None
+        return replace(state, boxes=state.boxes & ~(1 << box))
+
+    def switch(self, state: BitState) -> BitState:
+        for i in range(state.current + 1, state.current + 5):
+            if state.abilities >> i % 4 & 1:
+                return replace(state, current=i % 4)
+        return state
+
+    def step(self, state: BitState, action: Action) -> tuple[BitState, EventKind]:
+        """Apply one action like GameState.step, returns the new state and the main event"""
+        if action == Action.SWITCH:
+            return self.switch(state), EventKind.SWITCH
+        if self.target(state.player, action) < 0:
+            return state, EventKind.BLOCKED
+
+        current = state.current
+        crystal = state.boxes >> state.player & 1 or state.boxes >> self.target(state.player, action) & 1
+        if crystal and current != Power.IGNORE.value:
+            if current == Power.BREAK.value:
+                return self.break_box(state, action), EventKind.BREAK
+            pushed = self.push(state, action) if current == Power.PUSH.value else None
+            return (pushed, EventKind.PUSH) if pushed is not None else (state, EventKind.BLOCKED)
+
+        moved = self.move(state, action)
+        if moved.current != current or moved.abilities != state.abilities:
+            return moved, EventKind.PICKUP
+        return moved, EventKind.MOVE
+
+    # ----------------------------
+
+    def to_string(self, state: BitState) -> str:
+        """The state in the level format of levels.py"""
+        texts = {y: f"_{x}_{text}" for (x, y), text in self.texts}
+        rows = []
+        for y in range(self.height):
+            row = []
+            for x in range(self.width):
+                i = y * self.width + x
+                goal = self.goals >> i & 1
+                if self.walls >> i & 1:
+                    ch = "#"
+                elif i == state.player:
+                    ch = "+" if goal else "@"
+                elif state.boxes >> i & 1:
+                    ch = "*" if goal else "$"
+                elif goal:
+                    ch = "."
+                elif state.masks >> i & 1:
+                    ch = MASK_LETTERS[self.mask_powers[i]]
+                elif self.floors >> i & 1:
+                    ch = " "
+                else:
+                    ch = "-"  # not part of the level, like the end of a short row
+                row.append(ch)
+            rows.append("".join(row).rstrip("-").replace("-", " ") + texts.get(y, ""))
+        return "\n" + "\n".join(rows) + "\n"
+
+    def to_level(self, state: BitState):
+        """A Level of main.py, this needs pygame"""
+        from main import Level
+        return Level(self.to_string(state))
@@ -0,0 +1,114 @@
+"""
+Build step for the images: every sprite is scaled down to the largest size the game draws it
+with and all of them are packed into one texture atlas with a JSON index, the background is
+stored as JPEG. The full size images are in art/, outside of assets/, so the builds leave them out.
+main.py loads the results when they exist and falls back to the full size images.
+
+Run it again after changing an image or one of the sizes below.
+
+usage: python build_assets.py
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+from typing import Callable
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from main import (
+    ATLAS_IMAGE, ATLAS_INDEX, BACKGROUND_JPEG, SCREEN_SIZE, SOURCE_IMAGES, TILE_SIZE, fit_size, resource_path,
+)
+
+Size = tuple[int, int]
+
+
+def tile(image: pygame.Surface) -> Size:
+    return TILE_SIZE, TILE_SIZE
+
+
+def mask(image: pygame.Surface) -> Size:
+    # largest in the HUD slots (70 - 12), on the level they are TILE_SIZE - 30
+    return fit_size(image, 58, 58)
+
+
+def hero(image: pygame.Surface) -> Size:
+    # see Player.sprite
+    size = int(TILE_SIZE * 0.3)
+    fit_w, fit_h = fit_size(image, size, size)
+    return 4 * fit_w, 4 * fit_h
+
+
+SPRITES: dict[str, Callable[[pygame.Surface], Size]] = {
+    "floor": tile,
+    "floor_glow": tile,
+    "crystal_normal": tile,
+    "crystal_glow": tile,
+    "shatter1": tile,
+    "shatter2": tile,
+    "shatter3": tile,
+    "push_mask": mask,
+    "break_mask": mask,
+    "ignore_mask": mask,
+    "hero_down": hero,
+    "hero_up": hero,
+    "hero_left": hero,
+    "hero_right": hero,
+}
+
+ATLAS_WIDTH: int = 512
+PADDING: int = 1
+
+
+def pack(sizes: dict[str, Size]) -> tuple[dict[str, pygame.Rect], Size]:
+    """Shelf packing, the highest sprites first"""
+    rects = {}
+    x = y = shelf_height = 0
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        if x + w > ATLAS_WIDTH:
+            x, y, shelf_height = 0, y + shelf_height + PADDING, 0
+        rects[name] = pygame.Rect(x, y, w, h)
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+    return rects, (ATLAS_WIDTH, y + shelf_height)
+
+
+def main() -> int:
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    sprites = {}
+    for name, size in SPRITES.items():
+        image = pygame.image.load(resource_path(f"{SOURCE_IMAGES}/{name}.png")).convert_alpha()
+        sprites[name] = pygame.transform.smoothscale(image, size(image))
+
+    rects, atlas_size = pack({name: sprite.get_size() for name, sprite in sprites.items()})
+    atlas = pygame.Surface(atlas_size, pygame.SRCALPHA)
+    for name, rect in rects.items():
+        atlas.blit(sprites[name], rect)
+
+    os.makedirs(os.path.dirname(resource_path(ATLAS_INDEX)), exist_ok=True)
+    pygame.image.save(atlas, resource_path(ATLAS_IMAGE))
+    index = {
+        "image": os.path.basename(ATLAS_IMAGE),
+        "size": list(atlas_size),
+        "sprites": {name: [rect.x, rect.y, rect.w, rect.h] for name, rect in sorted(rects.items())},
+    }
+    with open(resource_path(ATLAS_INDEX), "w") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+
+    background = pygame.image.load(resource_path(f"{SOURCE_IMAGES}/background.png")).convert()
+    if background.get_size() != SCREEN_SIZE:
+        background = pygame.transform.smoothscale(background, SCREEN_SIZE)
+    pygame.image.save(background, resource_path(BACKGROUND_JPEG))
+
+    for path in (ATLAS_IMAGE, ATLAS_INDEX, BACKGROUND_JPEG):
+        print(f"{path}: {os.path.getsize(resource_path(path)) // 1024} KB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Deadlocks: states of a level from which it can no longer be solved, so the game can tell the
+player to undo as soon as it happens instead of when they notice it.
+
+The dead squares are computed once per level: the tiles a crystal can never be pushed from to a
+goal, whatever the other crystals do, with pushes along the axes and diagonally (see
+simulation.py). After every push, break or pickup the state is checked for
+- too few live crystals: crystals on dead squares or frozen (they can never move again) are not
+  live, there must be a live crystal for every goal,
+- corrals: parts of the level the player can not reach and never will, because no crystal on
+  their border can be pushed; a goal without a crystal there stays without one.
+
+The masks of a level never disappear, so which abilities the player can get is known when the
+level loads. With BREAK a crystal that blocks another one can be broken, so only the walls hold
+crystals in place. With IGNORE the player walks through the crystals and reaches everything.
+
+Everything errs on the side of the player: a state that is flagged is never solvable, but not
+every unsolvable state is flagged.
+"""
+from __future__ import annotations
+
+from dataclasses import replace
+from enum import Enum
+
+from bitboard import BitState, Board, indices
+from simulation import Power
+
+
+class Deadlock(Enum):
+    """Why a state can not be solved, the value is the message for the player"""
+    NO_PUSH = "The crystals can not be moved"
+    DEAD_CRYSTALS = "Not enough crystals can reach a goal"
+    CORRAL = "A goal can no longer be reached"
+
+
+class DeadlockAnalyzer:
+    def __init__(self, board: Board, dead: int | None = None) -> None:
+        """dead: the dead squares if they are known, e.g. from the analysis cache"""
+        self.board = board
+        powers = set(board.mask_powers.values())
+        self.can_push = Power.PUSH in powers
+        self.can_break = Power.BREAK in powers
+        self.can_ignore = Power.IGNORE in powers
+        self.free_pushes = board.free_pushes
+        self.space = board.everything & ~board.walls
+        if dead is None:
+            # the dead squares of the solver, without push ability only the goals are live
+            dead = self.space & ~(board.live_squares() if self.can_push else board.goals)
+        self.dead = dead
+        self.goal_count = board.goals.bit_count()
+        # crystals that can never move again and corrals the player never gets into, kept up to
+        # date push by push
+        self.frozen = 0
+        self.locked = 0
+        self.reach = 0  # the tiles the player reached at the last search for corrals
+
+    def grow(self, region: int, within: int, until: int = 0) -> int:
+        """
+        Flood fill of region over the tiles of within, diagonal neighbours included: a crystal is
+        pushed diagonally as well. It stops early when it reaches a tile of until.
+        """
+        board = self.board
+        while not region & until:
+            grown = region | board.around(region) & within
+            if grown == region:
+                break
+            region = grown
+        return region
+
+    def freeze(self, candidates: int) -> int:
+        """
+        The candidates that can never move: the largest part of them in which every crystal is held
+        by walls, by the crystals frozen before or by other crystals of the part. None of them can
+        be the first to move.
+        """
+        board = self.board
+        frozen = candidates
+        while frozen:
+            # the tiles a crystal can move to or the player can stand on, a crystal in the way can be broken
+            room = self.space if self.can_break else self.space & ~(frozen | self.frozen)
+            # the crystal needs room where it goes and the player before it, or with free pushes
+            # the player stands on it
+            movable = board.push_sources(room, None if self.free_pushes else room)
+            if not frozen & movable:
+                break
+            frozen &= ~movable
+        return frozen
+
+    def reset(self, state: BitState) -> None:
+        """Find the frozen crystals and the corrals of a state from scratch, after a restart or an undo"""
+        self.frozen = 0
+        self.frozen = self.freeze(state.boxes)
+        self.locked = self.corrals(state, self.board.goals | state.boxes)
+
+    # ----------------------------
+
+    def corrals(self, state: BitState, seeds: int) -> int:
+        """
+        The corrals of the seeds the player never gets into. A corral is everything the player can
+        not reach that is connected over crystals, diagonally too, as a crystal can be pushed into
+        it over a corner. It only opens when a crystal on its border is
+        pushed, other pushes can not make a crystal on the border movable. A corral the push cut off
+        or one whose border it blocked has the pushed crystal on its border. A push that lets the
+        player into a part of an open corral splits it, the parts left are next to the tiles the
+        player gets to now, they are seeds too.
+        """
+        board = self.board
+        if not self.can_push or self.can_ignore or self.can_break:
+            return 0
+        reach = board.reachable(replace(state, masks=0))
+        entered = reach & ~self.reach
+        self.reach = reach
+        outside = self.space & ~reach
+        seeds |= board.around(entered) & state.boxes
+        free = self.space & ~state.boxes
+        # the crystals the player can push now: the player before them and room where they go
+        pushable = board.push_sources(free, reach) & state.boxes
+        locked = seen = 0
+        for seed in indices(seeds & outside):
+            if seen >> seed & 1:
+                continue
+            corral = self.grow(1 << seed, outside, until=pushable)
+            seen |= corral
+            if not corral & pushable:
+                locked |= corral
+        return locked
+
+    def check(self, state: BitState, pushed: int | None = None) -> Deadlock | None:
+        """
+        Whether the state is a deadlock. pushed is the tile of the crystal the last push moved, the
+        frozen crystals and the corrals of the state before the push stay as they are.
+        """
+        board = self.board
+        boxes = state.boxes
+        missing = board.goals & ~boxes
+        if not missing:
+            return None
+        if not self.can_push:
+            return Deadlock.NO_PUSH
+        self.frozen &= boxes  # the broken ones
+        if pushed is not None:
+            # only the crystals touching the pushed one can be frozen by it, a crystal that moved
+            # away from others was not holding them
+            self.frozen |= self.freeze(self.grow(1 << pushed, boxes & ~self.frozen))
+            # a push only closes the corral of the pushed crystal and those next to the tiles it lets
+            # the player get to, see corrals
+            self.locked |= self.corrals(state, 1 << pushed)
+
+        if self.locked & missing:
+            return Deadlock.CORRAL
+        live = boxes & (board.goals | ~(self.dead | self.frozen | self.locked))
+        if live.bit_count() < self.goal_count:
+            return Deadlock.DEAD_CRYSTALS
+        return None
@@ -0,0 +1,263 @@
+"""
+Level generator for the level format of levels.py.
+
+A candidate is a random room carved out of walls. Its crystals start on the goals and are pulled
+away from them (pushes played backwards), a breadth first search over the pulls finds the state
+that needs the most pushes to solve, that becomes the start of the level. The number of pushes is
+the difficulty score; the pulls go along the axes only, a diagonal push (see simulation.py) can
+make a level shorter than that. Extra crystals and the masks are scattered afterwards and every candidate
+is checked with the solver, so only solvable levels are kept.
+
+Candidates are generated and checked in a multiprocessing pool.
+
+usage: python generator.py --crystals 4 --goals 3 --masks PB --count 5
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from solver import format_moves, solve, verify
+
+DIRECTIONS: tuple[tuple[int, int], ...] = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+
+@dataclass(slots=True)
+class Settings:
+    width: int = 9
+    height: int = 8
+    crystals: int = 3
+    goals: int = 3
+    masks: str = "P"
+    # share of the inner tiles that are carved out as floor
+    floor_ratio: float = 0.6
+    # limits of the reverse search and the solver check for one candidate
+    max_states: int = 3000
+    solve_time: float = 2.0
+    solve_memory: float = 64.0
+
+
+@dataclass(slots=True)
+class Candidate:
+    seed: int
+    level: str
+    # minimal number of pushes along the axes without masks, found by the reverse search
+    difficulty: int
+    moves: str = ""
+    pushes: int = 0
+    reverse_states: int = 0
+    solve_time: float = 0.0
+
+
+@dataclass(slots=True)
+class Room:
+    width: int
+    height: int
+    floors: set[tuple[int, int]] = field(default_factory=set)
+
+    def neighbours(self, pos: tuple[int, int]) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+        x, y = pos
+        return [((dx, dy), (x + dx, y + dy)) for dx, dy in DIRECTIONS if (x + dx, y + dy) in self.floors]
+
+    def region(self, start: tuple[int, int], boxes: frozenset[tuple[int, int]]) -> set[tuple[int, int]]:
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            for _, j in self.neighbours(queue.popleft()):
+                if j not in seen and j not in boxes:
+                    seen.add(j)
+                    queue.append(j)
+        return seen
+
+
+# ============================
+# Generation
+# ============================
+
+def carve_room(rng: random.Random, settings: Settings) -> Room:
+    """Random walk through the inner tiles until enough of them are floor"""
+    room = Room(settings.width, settings.height)
+    inner = (settings.width - 2) * (settings.height - 2)
+    target = max(settings.crystals + settings.goals + len(settings.masks) + 2, int(inner * settings.floor_ratio))
+    target = min(target, inner)  # a small room is all floor
+    x, y = rng.randrange(1, settings.width - 1), rng.randrange(1, settings.height - 1)
+    room.floors.add((x, y))
+    while len(room.floors) < target:
+        dx, dy = rng.choice(DIRECTIONS)
+        # walk straight for a while, that gives corridors instead of noise
+        for _ in range(rng.randint(1, 3)):
+            if not (1 <= x + dx < settings.width - 1 and 1 <= y + dy < settings.height - 1):
+                break
+            x, y = x + dx, y + dy
+            room.floors.add((x, y))
+    return room
+
+
+def reverse_search(
+        room: Room,
+        goals: frozenset[tuple[int, int]],
+        max_states: int,
+) -> tuple[frozenset[tuple[int, int]], tuple[int, int], int, int]:
+    """
+    Pull the crystals away from the goals breadth first, starting with every player region of the
+    solved state. Returns the crystals and player of the farthest state, its depth in pushes and
+    the number of states searched.
+    """
+    start_states = []
+    seen: set[tuple[frozenset[tuple[int, int]], tuple[int, int]]] = set()
+    for pos in sorted(room.floors - goals):
+        region = room.region(pos, goals)
+        key = (goals, min(region))
+        if key not in seen:
+            seen.add(key)
+            start_states.append((goals, pos, region, 0))
+
+    queue = deque(start_states)
+    best = start_states[0] if start_states else (goals, next(iter(room.floors)), set(), 0)
+    while queue and len(seen) < max_states:
+        boxes, player, region, depth = queue.popleft()
+        if depth > best[3]:
+            best = (boxes, player, region, depth)
+        for p in region:
+            for (dx, dy), b in room.neighbours(p):
+                # the player stands at p next to crystal b and steps back, pulling it along
+                back = (p[0] - dx, p[1] - dy)
+                if b not in boxes or back not in room.floors or back in boxes:
+                    continue
+                moved = boxes - {b} | {p}
+                new_region = room.region(back, moved)
+                key = (moved, min(new_region))
+                if key not in seen:
+                    seen.add(key)
+                    queue.append((moved, back, new_region, depth + 1))
+    return best[0], best[1], best[3], len(seen)
+
+
+def format_level(
+        room: Room,
+        goals: frozenset[tuple[int, int]],
+        boxes: frozenset[tuple[int, int]],
+        masks: dict[tuple[int, int], str],
+        player: tuple[int, int],
+) -> str:
+    # cut off the rows and columns that are only walls, keeping one wall around the floor
+    left, right = min(x for x, _ in room.floors) - 1, max(x for x, _ in room.floors) + 1
+    top, bottom = min(y for _, y in room.floors) - 1, max(y for _, y in room.floors) + 1
+    rows = []
+    for y in range(top, bottom + 1):
+        row = []
+        for x in range(left, right + 1):
+            pos = (x, y)
+            if pos not in room.floors:
+                ch = "#"
+            elif pos == player:
+                ch = "+" if pos in goals else "@"
+            elif pos in boxes:
+                ch = "*" if pos in goals else "$"
+            elif pos in goals:
+                ch = "."
+            else:
+                ch = masks.get(pos, " ")
+            row.append(ch)
+        rows.append("".join(row))
+    return "\n" + "\n".join(rows) + "\n"
+
+
+def generate(seed: int, settings: Settings) -> Candidate | None:
+    """One candidate level, None if it is trivial or not solvable within the limits"""
+    rng = random.Random(seed)
+    room = carve_room(rng, settings)
+    floors = sorted(room.floors)
+    # a tile for every crystal (the goals are among them), every mask and the player
+    if len(floors) < settings.crystals + len(settings.masks) + 1:
+        return None
+    goals = frozenset(rng.sample(floors, settings.goals))
+
+    boxes, player, difficulty, states = reverse_search(room, goals, settings.max_states)
+    if difficulty == 0:
+        return None
+
+    # the extra crystals and the masks go on free tiles, the push mask where the player can walk
+    free = [pos for pos in floors if pos not in boxes and pos not in goals and pos != player]
+    rng.shuffle(free)
+    extra = settings.crystals - settings.goals
+    if len(free) < extra + len(settings.masks):
+        return None
+    boxes = boxes | set(free[:extra])
+    free = free[extra:]
+    reachable = room.region(player, boxes)
+    masks: dict[tuple[int, int], str] = {}
+    for mask in settings.masks:
+        choices = [pos for pos in free if pos not in masks and (mask != "P" or pos in reachable)]
+        if not choices:
+            return None
+        masks[rng.choice(choices)] = mask
+
+    level = format_level(room, goals, boxes, masks, player)
+    result = solve(level, memory_limit_mb=settings.solve_memory, time_limit=settings.solve_time)
+    if not result.solved or not verify(level, result.moves):
+        return None
+    return Candidate(seed, level, difficulty, format_moves(result.moves), result.pushes, states, result.elapsed)
+
+
+def _generate(args: tuple[int, Settings]) -> Candidate | None:
+    return generate(*args)
+
+
+# ============================
+# Command line
+# ============================
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate solvable levels in the format of levels.py")
+    parser.add_argument("--width", type=int, default=9)
+    parser.add_argument("--height", type=int, default=8)
+    parser.add_argument("--crystals", type=int, default=3)
+    parser.add_argument("--goals", type=int, default=3)
+    parser.add_argument("--masks", default="P", help="masks to place, e.g. PBI")
+    parser.add_argument("--count", type=int, default=5, help="number of levels to output, the hardest ones")
+    parser.add_argument("--candidates", type=int, default=1000, help="number of candidates to screen")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default=None, help="write the levels to this file instead of printing them")
+    args = parser.parse_args(argv)
+
+    if args.goals > args.crystals:
+        parser.error("there must be at least as many crystals as goals")
+    if args.goals and "P" not in args.masks.upper():
+        parser.error("the crystals can only reach the goals with the push mask")
+    if (args.width - 2) * (args.height - 2) < args.crystals + len(args.masks) + 1:
+        parser.error("the room is too small for the crystals, the masks and the player")
+    settings = Settings(args.width, args.height, args.crystals, args.goals, args.masks.upper())
+
+    started = time.perf_counter()
+    candidates: list[Candidate] = []
+    jobs = ((args.seed + i, settings) for i in range(args.candidates))
+    with multiprocessing.Pool(args.workers) as pool:
+        for candidate in pool.imap_unordered(_generate, jobs, chunksize=16):
+            if candidate is not None:
+                candidates.append(candidate)
+    elapsed = time.perf_counter() - started
+    print(f"{len(candidates)} of {args.candidates} candidates solvable in {elapsed:.1f}s", file=sys.stderr)
+
+    candidates.sort(key=lambda c: (-c.difficulty, -c.pushes, c.seed))
+    lines = []
+    for c in candidates[:args.count]:
+        lines.append(f"# difficulty {c.difficulty}, solved with {c.pushes} pushes: {c.moves}")
+        lines.append(f'level_str_generated_{c.seed}: str = """{c.level}"""\n')
+    text = "\n".join(lines)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0 if candidates else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
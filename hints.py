@@ -0,0 +1,202 @@
+"""
+Hints for the game: the next action from the current state of a level, found by the solver in the
+background so the frame loop never waits for it. On the desktop the solver runs in a worker
+process, under pygbag (there are no processes in the browser) in an asyncio task that gives the
+control back to the frame loop every few milliseconds. Only the search for the latest state runs,
+a new request cancels the previous one.
+
+Like the states of the solver, the hints are cached by the region the player can walk in, not by
+the tile it stands on: from every tile of the region the next thing to do is the same, walking to
+the tile of the next push, break, pickup or switch and doing it. The hint is the first step of that
+walk. A solution gives the hint of every state along it, so following the hints needs only one
+search.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from bitboard import BitState, Board
+from simulation import MOVES, Action, EventKind, Power
+from solver import Solver
+
+HINT_TIME_LIMIT: float = 10.0  # seconds of search for one hint
+HINT_MEMORY_MB: float = 64.0
+SLICE_SECONDS: float = 0.004  # search time between two frames under pygbag
+SLICE_NODES: int = 16  # expanded nodes between two checks of the slice time or of a newer request
+MAX_HINTS: int = 4096  # cached states
+HINT_RETRIES: int = 2  # searches again after one failed with an error, a failure is not cached
+
+# level string, crystals, masks, abilities, current ability and the lowest tile of the player region
+HintKey = tuple[str, int, int, int, int, int]
+
+# in the worker process: the number of the latest request, a search for an older one gives up
+_latest = None
+
+
+@dataclass(frozen=True, slots=True)
+class Hint:
+    action: Action | None  # None: no solution from this state (or none found within the limits)
+
+
+@dataclass(frozen=True, slots=True)
+class Plan:
+    """What to do in a region: walk to the tile and do the action there"""
+    tile: int
+    action: Action | None
+
+
+def init_worker(latest) -> None:
+    global _latest
+    _latest = latest
+
+
+def solve_moves(level: str, state: BitState, request: int = 0) -> list[Action] | None:
+    search = Solver(level, memory_limit_mb=HINT_MEMORY_MB, time_limit=HINT_TIME_LIMIT, start=state).search(
+        pause_every=SLICE_NODES)
+    for result in search:
+        if result is not None:
+            return result.moves if result.solved else None
+        if _latest is not None and _latest.value != request:
+            return None  # nobody waits for this one any more
+    return None
+
+
+class HintEngine:
+    def __init__(self, processes: bool = sys.platform != "emscripten") -> None:
+        self.processes = processes
+        self.pool = None
+        self.latest = None  # the number of the latest request, shared with the worker process
+        self.requests = 0
+        self.cache: OrderedDict[HintKey, Plan] = OrderedDict()
+        # the running search with its key, start state, an AsyncResult of the pool or an asyncio Task
+        # and the number of searches for the state that failed before
+        self.running: tuple[HintKey, BitState, object, int] | None = None
+        self.boards: dict[str, Board] = {}
+
+    def board(self, level: str) -> Board:
+        board = self.boards.get(level)
+        if board is None:
+            board = self.boards[level] = Board.from_level(level)[0]
+        return board
+
+    def region(self, level: str, state: BitState) -> int:
+        """The tiles the player walks to with the current ability"""
+        return self.board(level).reachable(state, ignore=state.current == Power.IGNORE.value)
+
+    def key(self, level: str, state: BitState, region: int) -> HintKey:
+        return level, state.boxes, state.masks, state.abilities, state.current, (region & -region).bit_length() - 1
+
+    def lookup(self, level: str, state: BitState) -> Hint | None:
+        """The hint for a state, None while it is not known yet"""
+        region = self.region(level, state)
+        key = self.key(level, state, region)
+        plan = self.cache.get(key)
+        if plan is None:
+            return None
+        self.cache.move_to_end(key)
+        if plan.action is None or plan.tile == state.player:
+            return Hint(plan.action)
+        return Hint(self.first_step(self.board(level), state.player, plan.tile, region))
+
+    def first_step(self, board: Board, start: int, target: int, region: int) -> Action | None:
+        """The first step of a shortest walk from start to target within the region"""
+        seen = frontier = 1 << target
+        while frontier:
+            # the layers of tiles grow from the target, the first one next to start is the closest
+            for action in MOVES:
+                if board.shift(1 << start, action) & frontier:
+                    return action
+            grown = seen | (
+                    board.shift(frontier, Action.UP) | board.shift(frontier, Action.DOWN)
+                    | board.shift(frontier, Action.LEFT) | board.shift(frontier, Action.RIGHT)
+            ) & region
+            frontier = grown & ~seen
+            seen = grown
+        return None
+
+    def request(self, level: str, state: BitState) -> None:
+        key = self.key(level, state, self.region(level, state))
+        if key in self.cache or (self.running is not None and self.running[0] == key):
+            return
+        self.cancel()
+        self.start(key, state)
+
+    def start(self, key: HintKey, state: BitState, failures: int = 0) -> None:
+        """Search from the state in the background"""
+        level = key[0]
+        if self.processes:
+            if self.pool is None:
+                # spawn, a forked copy of the game would share its window and sound
+                context = multiprocessing.get_context("spawn")
+                self.latest = context.Value("q", 0, lock=False)
+                self.pool = context.Pool(1, initializer=init_worker, initargs=(self.latest,))
+            # the search of an older request sees the new number and gives up
+            self.requests += 1
+            self.latest.value = self.requests
+            self.running = key, state, self.pool.apply_async(solve_moves, (level, state, self.requests)), failures
+        else:
+            self.running = key, state, asyncio.ensure_future(self.solve_sliced(level, state)), failures
+
+    def cancel(self) -> None:
+        """Stop waiting for the running search, it is superseded"""
+        if self.running is not None and not self.processes:
+            self.running[2].cancel()
+        self.running = None
+
+    def poll(self) -> bool:
+        """Collect the finished search, True if there are new hints"""
+        if self.running is None:
+            return False
+        key, state, search, failures = self.running
+        if self.processes and search.ready():
+            failed = not search.successful()
+        elif not self.processes and search.done():
+            failed = search.cancelled() or search.exception() is not None
+        else:
+            return False
+        self.running = None
+        if failed:
+            # an error in the search says nothing about the state, it is not stored as unsolvable
+            if failures < HINT_RETRIES:
+                self.start(key, state, failures + 1)
+            return False
+        self.store(key[0], state, search.get() if self.processes else search.result())
+        return True
+
+    def store(self, level: str, state: BitState, moves: list[Action] | None) -> None:
+        board = self.board(level)
+        if moves is None:
+            self.cache[self.key(level, state, self.region(level, state))] = Plan(state.player, None)
+        else:
+            # the walks in between do not change the region, every push, break, pickup or switch
+            # of the solution is the plan of the region it starts from
+            for action in moves:
+                after, event = board.step(state, action)
+                if event != EventKind.MOVE:
+                    self.cache[self.key(level, state, self.region(level, state))] = Plan(state.player, action)
+                state = after
+        while len(self.cache) > MAX_HINTS:
+            self.cache.popitem(last=False)
+
+    async def solve_sliced(self, level: str, state: BitState) -> list[Action] | None:
+        search = Solver(level, memory_limit_mb=HINT_MEMORY_MB, time_limit=HINT_TIME_LIMIT, start=state).search(
+            pause_every=SLICE_NODES)
+        started = time.perf_counter()
+        for result in search:
+            if result is not None:
+                return result.moves if result.solved else None
+            if time.perf_counter() - started > SLICE_SECONDS:
+                await asyncio.sleep(0)
+                started = time.perf_counter()
+        return None
+
+    def close(self) -> None:
+        self.cancel()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -1,10 +1,21 @@
 from __future__ import annotations
 
+import hashlib
+import io
+import json
+import copy
 import math
+import mmap
+import multiprocessing
+import struct
+import threading
 import time
-from dataclasses import dataclass
-from enum import Enum
-from typing import Iterable, List
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import Any, Callable, Iterator
 
 import pygame
 from pygame.math import Vector2
@@ -16,6 +27,13 @@ except ImportError:
     import levels
     all_levels = levels.all_levels
 
+from analysis import CACHE_DIR as ANALYSIS_CACHE_DIR, AnalysisCache
+from bitboard import BitState, Board, bits
+from deadlock import Deadlock, DeadlockAnalyzer
+from hints import Hint, HintEngine
+from replay import Command, Direction, InputRecorder, InputReplay
+from simulation import Action, Event, EventKind, Power, next_ability, parse_level
+
 import os
 import sys
 
@@ -36,6 +54,184 @@ def resource_path(relative_path):
     path = os.path.join(base_path, relative_path)
     return path.replace("\\", "/")
 
+
+# made by build_assets.py
+# the full size images, build_assets.py makes the ones in assets/build from them, they are not shipped
+SOURCE_IMAGES: str = "art"
+ATLAS_IMAGE: str = "assets/build/atlas.png"
+ATLAS_INDEX: str = "assets/build/atlas.json"
+BACKGROUND_JPEG: str = "assets/build/background.jpg"
+
+
+SPRITE_NAMES: list[str] = [
+    "floor", "floor_glow", "crystal_normal", "crystal_glow",
+    "break_mask", "ignore_mask", "push_mask",
+    "hero_down", "hero_up", "hero_left", "hero_right",
+    "shatter1", "shatter2", "shatter3",
+]
+SOUND_FILES: dict[str, str] = {
+    "break": "assets/sound/break1.ogg",
+    "push": "assets/sound/push.ogg",
+    "mask0": "assets/sound/noMask.ogg",
+    "mask1": "assets/sound/greenMask.ogg",
+    "mask2": "assets/sound/redMask.ogg",
+    "mask3": "assets/sound/greyMask.ogg",
+}
+MUSIC_FILES: list[str] = [
+    "assets/music/main.ogg",
+    "assets/music/push.ogg",
+    "assets/music/break.ogg",
+    "assets/music/ignore.ogg",
+]
+
+
+def sprite_files(names: list[str]) -> list[str]:
+    """The atlas, or the full size images when build_assets.py was not run"""
+    if os.path.exists(resource_path(ATLAS_INDEX)):
+        return [ATLAS_IMAGE]
+    return [f"{SOURCE_IMAGES}/{name}.png" for name in names]
+
+
+def cut_sprites(names: list[str], decoded: dict[str, pygame.Surface]) -> dict[str, pygame.Surface]:
+    """The sprites from the decoded sprite_files, from the atlas they come already scaled to the drawn size"""
+    if ATLAS_IMAGE not in decoded:
+        return {name: decoded[f"{SOURCE_IMAGES}/{name}.png"] for name in names}
+
+    with open(resource_path(ATLAS_INDEX)) as f:
+        index = json.load(f)
+    atlas = decoded[ATLAS_IMAGE].convert_alpha()
+    return {name: atlas.subsurface(pygame.Rect(index["sprites"][name])) for name in names}
+
+
+def background_file() -> str:
+    return BACKGROUND_JPEG if os.path.exists(resource_path(BACKGROUND_JPEG)) else f"{SOURCE_IMAGES}/background.png"
+
+
+class DecodedCache:
+    """
+    Raw decoded pixels and PCM samples on disk, so warm starts skip the PNG and OGG decoding.
+
+    Entries are keyed by the hash of the source file (and for sounds by the mixer format) and
+    memory-mapped when loaded. Images are kept at their size in the file, build_assets.py already
+    scales them to the drawn size. Files that cannot be cached are decoded as usual.
+    """
+
+    def __init__(self, directory: str | None) -> None:
+        self.directory = directory
+
+    def _entry(self, path: str, suffix: str) -> tuple[bytes | None, str | None]:
+        """The source file and the path of its cache entry (None without a cache)"""
+        if self.directory is None:
+            return None, None
+        with open(resource_path(path), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()[:20]
+        return data, os.path.join(self.directory, f"{digest}-{suffix}")
+
+    def _map(self, entry: str) -> mmap.mmap | None:
+        try:
+            with open(entry, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, entry: str, chunks: list[bytes]) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written under another name first, so a crash never leaves half an entry
+            temporary = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temporary, entry)
+        except OSError:
+            pass
+
+    def image(self, path: str) -> pygame.Surface:
+        data, entry = self._entry(path, "rgba")
+        if entry is not None:
+            mapped = self._map(entry)
+            if mapped is not None:
+                width, height = struct.unpack_from("<II", mapped)
+                return pygame.image.frombuffer(memoryview(mapped)[8:], (width, height), "RGBA")
+
+        image = pygame.image.load(io.BytesIO(data), path) if data is not None else \
+            pygame.image.load(resource_path(path))
+        if entry is not None:
+            self._store(entry, [struct.pack("<II", *image.get_size()), pygame.image.tobytes(image, "RGBA")])
+        return image
+
+    def sound(self, path: str) -> pygame.mixer.Sound:
+        """The sound at path, the samples are stored in the format of the mixer"""
+        frequency, size, channels = pygame.mixer.get_init()
+        data, entry = self._entry(path, f"{frequency}-{size}-{channels}.pcm")
+        if entry is not None:
+            mapped = self._map(entry)
+            if mapped is not None:
+                return pygame.mixer.Sound(buffer=mapped)
+
+        sound = pygame.mixer.Sound(resource_path(path))
+        if entry is not None:
+            self._store(entry, [sound.get_raw()])
+        return sound
+
+    def samples(self, path: str) -> memoryview:
+        """The samples of the sound at path in the format of the mixer, without copying them"""
+        frequency, size, channels = pygame.mixer.get_init()
+        data, entry = self._entry(path, f"{frequency}-{size}-{channels}.pcm")
+        if entry is not None:
+            mapped = self._map(entry)
+            if mapped is not None:
+                return memoryview(mapped)
+
+        # a view of the decoded sound keeps it alive
+        samples = memoryview(pygame.mixer.Sound(resource_path(path))).cast("B")
+        if entry is not None:
+            self._store(entry, [samples])
+        return samples
+
+
+class AssetLoader:
+    """
+    Decodes files concurrently in a thread pool, under pygbag (no threads) one after another
+    with a frame in between. Counts the finished files over all calls of load for a progress bar.
+    """
+
+    def __init__(self, workers: int = 4) -> None:
+        self.workers = workers
+        self.done = 0
+        self.total = 0
+
+    async def load(
+            self,
+            jobs: dict[str, Callable[[], Any]],
+            progress: Callable[[float], None] | None = None,
+    ) -> dict[str, Any]:
+        """Run the loading functions, returns their results by name"""
+        self.total += len(jobs)
+        results = {}
+
+        def finished(name: str, value: Any) -> None:
+            results[name] = value
+            self.done += 1
+            if progress is not None:
+                progress(self.done / self.total)
+
+        if sys.platform == "emscripten":
+            for name, job in jobs.items():
+                finished(name, job())
+                await asyncio.sleep(0)  # let the browser show the progress
+            return results
+
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(self.workers) as executor:
+            async def run(name: str, job: Callable[[], Any]) -> tuple[str, Any]:
+                return name, await loop.run_in_executor(executor, job)
+
+            for task in asyncio.as_completed([run(name, job) for name, job in jobs.items()]):
+                finished(*await task)
+        return results
+
 # ============================
 # Config / Constants
 # ============================
@@ -43,6 +239,29 @@ def resource_path(relative_path):
 TILE_SIZE: int = 80
 SCREEN_SIZE: tuple[int, int] = (1360, 768)
 PLAYER_SPEED: float = 220.0  # pixels / second
+CHUNK_TILES: int = 8  # levels are stored (and their static layer baked) in square chunks of this many tiles
+MAX_LAYER_CHUNKS: int = 24  # baked static layer chunks kept in memory
+# decoded images and sounds are kept with the analyses for faster starts, None disables it
+DECODED_CACHE_DIR: str | None = ANALYSIS_CACHE_DIR
+MUSIC_CHANNELS: tuple[int, int] = (0, 1)  # the active music stem and its crossfade partner
+EFFECT_CHANNELS: tuple[int, ...] = (2, 3, 4, 5)
+# bytes of decoded music in memory, it must hold two stems: the active one and the next one
+MUSIC_MEMORY_BUDGET: int = 48 * 1024 * 1024
+MUSIC_SEGMENT: float = 2.0  # seconds of music queued at a time
+DIRTY_RECTS: bool = False  # redraw only the changed parts of the screen, also with --dirty-rects
+FPS: int = 60
+SIMULATION_STEP: float = 1 / 60  # seconds, the player and the crystals move in fixed steps of this length
+MAX_FRAME_TIME: float = 0.25  # a longer frame is cut, the game slows down instead of catching up
+IDLE_FPS: int = 10  # frame rate while nothing happens, e.g. while reading a tutorial card
+UNDO_LIMIT: int = 256  # pushes, breaks and pickups that can be undone
+IDLE_PULSE: bool = False  # keep the player pulsing at IDLE_FPS instead of pausing the rendering
+PROFILE_FRAMES: int = 600  # frames kept by the frame profiler, F3 shows its overlay
+PROFILE_OUT: str | None = None  # .csv or .json file the profiled frames are written to on exit, also with --profile-out
+
+# bits of the Level occupancy grid, the crystals are looked up in the BoxStore
+TILE_WALL: int = 1
+TILE_MASK: int = 2
+TILE_GOAL: int = 4
 
 Color = tuple[int, int, int]
 
@@ -73,6 +292,9 @@ move_sound = None
 
 mask_sounds = None
 
+sprites: SpriteCache | None = None
+panels: PanelCache | None = None
+
 # ============================
 # Grid Utilities
 # ============================
@@ -86,6 +308,122 @@ class GridPos:
         return Vector2(pygame.Rect(self.x * TILE_SIZE, self.y * TILE_SIZE, TILE_SIZE, TILE_SIZE).center)
 
 
+# ============================
+# Sprite Cache
+# ============================
+
+SpriteKey = tuple[pygame.Surface, tuple[int, int], int]
+
+
+def fit_size(image: pygame.Surface, width: int, height: int) -> tuple[int, int]:
+    """Largest size of image that fits into (width, height) while maintaining aspect ratio"""
+    img_w, img_h = image.get_size()
+    scale = min(width / img_w, height / img_h)
+    return int(img_w * scale), int(img_h * scale)
+
+
+class SpriteCache:
+    """
+    Least-recently-used cache of scaled and display-converted sprites.
+
+    Scaling the full size source images is expensive, so every draw path asks the cache
+    for a sprite of the size (and alpha) it needs instead of calling smoothscale each frame.
+    """
+
+    def __init__(self, max_entries: int = 128) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[SpriteKey, pygame.Surface] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, image: pygame.Surface, size: tuple[int, int], alpha: int = 255) -> pygame.Surface:
+        key = (image, size, alpha)
+        sprite = self._entries.get(key)
+        if sprite is not None:
+            self._entries.move_to_end(key)
+            return sprite
+
+        if image.get_size() == size:
+            sprite = image.convert_alpha()  # already scaled by build_assets.py
+        else:
+            sprite = pygame.transform.smoothscale(image, size).convert_alpha()
+        if alpha < 255:
+            sprite.set_alpha(alpha)
+
+        self._entries[key] = sprite
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return sprite
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# ============================
+# Text Cache
+# ============================
+
+_fonts: dict[int, pygame.font.Font] = {}
+
+
+def get_font(size: int) -> pygame.font.Font:
+    """The default font in a size, loaded once"""
+    font = _fonts.get(size)
+    if font is None:
+        font = _fonts[size] = pygame.font.Font(None, size)
+    return font
+
+
+PanelKey = tuple[str, int, Color, bool, int, int]
+
+
+class PanelCache:
+    """
+    Least-recently-used cache of rendered texts on rounded, semi-transparent panels,
+    keyed by (text, size, colour, antialias, padding, radius).
+    """
+
+    BG_COLOR: tuple[int, int, int, int] = (150, 150, 150, 180)  # semi-transparent gray (A=180)
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[PanelKey, pygame.Surface] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+            self,
+            text: str,
+            size: int,
+            color: Color,
+            antialias: bool = True,
+            padding: int = 20,
+            radius: int = 16,
+    ) -> pygame.Surface:
+        key = (text, size, color, antialias, padding, radius)
+        panel = self._entries.get(key)
+        if panel is not None:
+            self._entries.move_to_end(key)
+            return panel
+
+        rendered = get_font(size).render(text, antialias, color)
+        panel = pygame.Surface(
+            (rendered.get_width() + padding * 2, rendered.get_height() + padding * 2), pygame.SRCALPHA
+        )
+        pygame.draw.rect(panel, self.BG_COLOR, panel.get_rect(), border_radius=radius)
+        panel.blit(rendered, (padding, padding))
+
+        self._entries[key] = panel
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return panel
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
 # ============================
 # Level
 # ============================
@@ -105,37 +443,37 @@ level_str: str = """
 class LevelText:
     def __init__(self, pos: GridPos, text: str) -> None:
         self.pos = pos
-        font = pygame.font.Font(None, 40)
-        self.text = font.render(text, False, (20, 20, 20))
+        self.text = text
 
     def draw(self, surface: pygame.Surface, camera: Camera2D) -> None:
+        panel = panels.get(self.text, 40, (20, 20, 20), antialias=False)
 
-        # Center the text
+        # Center the panel on the tile
         rect = pygame.Rect(
             self.pos.x * TILE_SIZE,
             self.pos.y * TILE_SIZE,
             TILE_SIZE,
             TILE_SIZE,
         )
-        rect = self.text.get_rect(center=rect.center)
-        # rect = camera.apply_rect(rect)
+        camera.blit(surface, panel, panel.get_rect(center=rect.center).topleft)
 
-        # --- Create a temporary surface for the rounded rectangle ---
-        padding = 20  # space around the text
-        radius = 16  # corner radius
 
-        bg_surf = pygame.Surface(
-            (rect.width + padding * 2, rect.height + padding * 2), pygame.SRCALPHA
-        )
-        bg_color = (150, 150, 150, 180)  # semi-transparent gray (A=180)
-        pygame.draw.rect(bg_surf, bg_color, bg_surf.get_rect(), border_radius=radius)
 
-        # --- Blit the background and then the text ---
-        bg_rect = bg_surf.get_rect(center=rect.center)
-        camera.blit(surface, bg_surf, bg_rect.topleft)
-        camera.blit(surface, self.text, rect.topleft)
+ChunkKey = tuple[int, int]
+
+
+@dataclass(slots=True)
+class Chunk:
+    """The tiles and masks of one CHUNK_TILES x CHUNK_TILES part of a level"""
+    walls: set[GridPos] = field(default_factory=set)
+    goals: set[GridPos] = field(default_factory=set)
+    floors: set[GridPos] = field(default_factory=set)
+    masks: set[Mask] = field(default_factory=set)
 
 
+def chunk_key(pos: GridPos) -> ChunkKey:
+    return pos.x // CHUNK_TILES, pos.y // CHUNK_TILES
+
 
 class Level:
     def __init__(self, level: str) -> None:
@@ -146,110 +484,177 @@ class Level:
         self.masks: set[Mask] = set()
         self.text: set[LevelText] = set()
         self.player: GridPos | None = None
+        self.width: int = 0
+        self.height: int = 0
+        self.chunks: dict[ChunkKey, Chunk] = {}
+        self.layer: OrderedDict[ChunkKey, pygame.Surface] = OrderedDict()
+        self.grid: bytearray = bytearray()
+
+        data = parse_level(level)
+        self.walls = {GridPos(x, y) for x, y in data.walls}
+        self.goals = {GridPos(x, y) for x, y in data.goals}
+        self.floors = {GridPos(x, y) for x, y in data.floors}
+        self.boxes = {GridPos(x, y) for x, y in data.boxes}
+        self.masks = {Mask(GridPos(x, y), power) for (x, y), power in data.masks.items()}
+        self.text = {LevelText(GridPos(x, y), text) for (x, y), text in data.texts}
+        if data.player is not None:
+            self.player = GridPos(*data.player)
+        self.width = data.width
+        self.height = data.height
+
+        # dense occupancy grid, one byte of TILE_* bits per tile
+        self.grid = bytearray(self.width * self.height)
+        for tiles, bit in [(self.walls, TILE_WALL), (self.goals, TILE_GOAL)]:
+            for pos in tiles:
+                self.grid[pos.y * self.width + pos.x] |= bit
+        for mask in self.masks:
+            self.grid[mask.pos.y * self.width + mask.pos.x] |= TILE_MASK
+
+        for pos in self.walls:
+            self.chunk_at(pos).walls.add(pos)
+        for pos in self.goals:
+            self.chunk_at(pos).goals.add(pos)
+        for pos in self.floors:
+            self.chunk_at(pos).floors.add(pos)
+        for mask in self.masks:
+            self.chunk_at(mask.pos).masks.add(mask)
+
+        # small levels are baked right away, big ones while the camera moves around
+        if len(self.chunks) <= MAX_LAYER_CHUNKS:
+            for key in self.chunks:
+                self.layer_surface(key)
+
+    def clone(self) -> Level:
+        """
+        A copy to play, the level itself stays unchanged as a template. The walls, the texts and
+        the baked layer are shared, the crystals and the masks start as those of the template.
+        """
+        level = copy.copy(self)
+        level.grid = bytearray(self.grid)
+        level.masks = set(self.masks)
+        level.chunks = {key: Chunk(chunk.walls, chunk.goals, chunk.floors, chunk.masks & level.masks)
+                        for key, chunk in self.chunks.items()}
+        return level
 
-        rows = [row.rstrip("\n") for row in level.strip("\n").splitlines()]
-
-        for y, row in enumerate(rows):
-            row, text_x, text = (row.split("_", 2) + [None, None])[:3]
-            if text and text_x:
-                self.text.add(LevelText(GridPos(int(text_x), y), text))
-            for x, ch in enumerate(row):
-                pos = GridPos(x, y)
-
-                match ch:
-                    case "#":  # wall
-                        self.walls.add(pos)
-
-                    case ".":  # goal
-                        self.goals.add(pos)
-
-                    case "$":  # box
-                        self.boxes.add(pos)
-                        self.floors.add(pos)
-
-                    case "@":  # player
-                        self.player = pos
-                        self.floors.add(pos)
-
-                    case "*":  # box on goal
-                        self.boxes.add(pos)
-                        self.goals.add(pos)
+    def is_wall(self, pos: GridPos) -> bool:
+        return bool(self.flags(pos.x, pos.y) & TILE_WALL)
+
+    def is_solved(self, boxes: BoxStore) -> bool:
+        return boxes.covered_goals == len(self.goals)
+
+    def chunk_at(self, pos: GridPos) -> Chunk:
+        key = chunk_key(pos)
+        if key not in self.chunks:
+            self.chunks[key] = Chunk()
+        return self.chunks[key]
+
+    def chunks_in(self, tiles: pygame.Rect) -> Iterator[tuple[ChunkKey, Chunk]]:
+        """The existing chunks overlapping a rectangle given in grid coordinates"""
+        for cy in range(tiles.top // CHUNK_TILES, (tiles.bottom - 1) // CHUNK_TILES + 1):
+            for cx in range(tiles.left // CHUNK_TILES, (tiles.right - 1) // CHUNK_TILES + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is not None:
+                    yield (cx, cy), chunk
+
+    def remove_mask(self, mask: Mask) -> None:
+        self.masks.remove(mask)
+        self.chunk_at(mask.pos).masks.remove(mask)
+        self.clear_flag(mask.pos, TILE_MASK)
+
+    def add_mask(self, mask: Mask) -> None:
+        self.masks.add(mask)
+        self.chunk_at(mask.pos).masks.add(mask)
+        self.set_flag(mask.pos, TILE_MASK)
+
+    def mask_at(self, pos: GridPos) -> Mask | None:
+        for mask in self.chunk_at(pos).masks:
+            if mask.pos == pos:
+                return mask
+        return None
+
+    def flags(self, x: int, y: int) -> int:
+        """The TILE_* bits of a tile, tiles outside the level are empty"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.grid[y * self.width + x]
+        return 0
+
+    def set_flag(self, pos: GridPos, bit: int) -> None:
+        self.grid[pos.y * self.width + pos.x] |= bit
+
+    def clear_flag(self, pos: GridPos, bit: int) -> None:
+        self.grid[pos.y * self.width + pos.x] &= ~bit
+
+    def tiles_under(self, rect: pygame.Rect) -> Iterator[tuple[int, int]]:
+        """Grid coordinates of the tiles overlapping a world rectangle"""
+        for y in range(rect.top // TILE_SIZE, (rect.bottom - 1) // TILE_SIZE + 1):
+            for x in range(rect.left // TILE_SIZE, (rect.right - 1) // TILE_SIZE + 1):
+                yield x, y
+
+    def chunk_rect(self, key: ChunkKey) -> pygame.Rect:
+        """World rectangle covered by a chunk, clipped to the level size"""
+        chunk_pixels = CHUNK_TILES * TILE_SIZE
+        rect = pygame.Rect(key[0] * chunk_pixels, key[1] * chunk_pixels, chunk_pixels, chunk_pixels)
+        return rect.clip(pygame.Rect(0, 0, self.width * TILE_SIZE, self.height * TILE_SIZE))
+
+    def bake(self, key: ChunkKey) -> pygame.Surface:
+        """
+        Render the floor and goal tiles of a chunk into a static layer surface.
+        These tiles never change within a level, so they are drawn once instead of every frame.
+        """
+        chunk = self.chunks[key]
+        chunk_rect = self.chunk_rect(key)
+        layer = pygame.Surface(chunk_rect.size, pygame.SRCALPHA)
 
-                    case "+":  # player on goal
-                        self.player = pos
-                        self.goals.add(pos)
+        # Images scaled to fit the tile
+        floor_image = sprites.get(floor_normal, (TILE_SIZE, TILE_SIZE))
+        goal_image = sprites.get(floor_glow, (TILE_SIZE, TILE_SIZE))
 
-                    case "P":  # push mask
-                        self.floors.add(pos)
-                        self.masks.add(Mask(pos, Power.PUSH))
+        for tiles, image in [(chunk.floors, floor_image), (chunk.goals, goal_image)]:
+            for pos in tiles:
+                layer.blit(image, (pos.x * TILE_SIZE - chunk_rect.x, pos.y * TILE_SIZE - chunk_rect.y))
 
-                    case "B":  # break mask
-                        self.floors.add(pos)
-                        self.masks.add(Mask(pos, Power.BREAK))
+        return layer.convert_alpha()
 
-                    case "I":  # Ignore mask
-                        self.floors.add(pos)
-                        self.masks.add(Mask(pos, Power.IGNORE))
+    def layer_surface(self, key: ChunkKey) -> pygame.Surface:
+        """The baked static layer of a chunk, least recently used chunks are dropped"""
+        layer = self.layer.get(key)
+        if layer is not None:
+            self.layer.move_to_end(key)
+            return layer
 
-                    case " ":  # floor
-                        self.floors.add(pos)
+        layer = self.bake(key)
+        self.layer[key] = layer
+        if len(self.layer) > MAX_LAYER_CHUNKS:
+            self.layer.popitem(last=False)
+        return layer
 
-    def is_wall(self, pos: GridPos) -> bool:
-        return pos in self.walls
-
-    def is_solved(self, boxes: list[Box]) -> bool:
-        box_locations = set(b.grid_pos for b in boxes)
-        for g in self.goals:
-            if g not in box_locations:
-                return False
-        return True
+    def visible_masks(self, camera: Camera2D) -> Iterator[Mask]:
+        for _, chunk in self.chunks_in(camera.visible_tiles()):
+            yield from chunk.masks
 
     def draw(self, surface: pygame.Surface, camera: Camera2D) -> None:
-        for floor in self.floors:
-            rect = pygame.Rect(
-                floor.x * TILE_SIZE,
-                floor.y * TILE_SIZE,
-                TILE_SIZE,
-                TILE_SIZE,
-            )
-
-            # Scale the image to fit the tile
-            scaled_image = pygame.transform.smoothscale(floor_normal, (TILE_SIZE, TILE_SIZE))
-
-            # Draw the image
-            camera.blit(surface, scaled_image, rect.topleft)
-
-        for goal in self.goals:
-            rect = pygame.Rect(
-                goal.x * TILE_SIZE,
-                goal.y * TILE_SIZE,
-                TILE_SIZE,
-                TILE_SIZE,
-            )
-            # Scale the image to fit the tile
-            scaled_image = pygame.transform.smoothscale(floor_glow, (TILE_SIZE, TILE_SIZE))
-
-            # Draw the image
-            camera.blit(surface, scaled_image, rect.topleft)
+        view = camera.view_rect()
+        for key, chunk in self.chunks_in(camera.visible_tiles()):
+            if not chunk.floors and not chunk.goals:
+                continue
+            chunk_rect = self.chunk_rect(key)
+            visible = chunk_rect.clip(view)
+            if visible:
+                # blit only the part of the chunk that is on the screen
+                camera.blit(surface, self.layer_surface(key), visible.topleft, visible.move(-chunk_rect.x, -chunk_rect.y))
 
         for text in self.text:
             text.draw(surface, camera)
 
 
-class Power(Enum):
-    NONE = 0
-    PUSH = 1
-    BREAK = 2
-    IGNORE = 3
-
-    def get_image(self) -> pygame.Surface:
-        if self == Power.PUSH:
-            return push_mask
-        if self == Power.BREAK:
-            return break_mask
-        if self == Power.IGNORE:
-            return ignore_mask
-        raise ValueError(f"Power {self} not supported")
+def mask_image(power: Power) -> pygame.Surface:
+    if power == Power.PUSH:
+        return push_mask
+    if power == Power.BREAK:
+        return break_mask
+    if power == Power.IGNORE:
+        return ignore_mask
+    raise ValueError(f"Power {power} not supported")
 
 
 class Mask:
@@ -265,22 +670,10 @@ class Mask:
 
     def draw(self, surface: pygame.Surface, camera: Camera2D) -> None:
 
-        image = self.power.get_image()
-
-        img_w, img_h = image.get_size()
+        image = mask_image(self.power)
 
         # Scale while maintaining aspect ratio
-        scale = min(
-            self.rect.width / img_w,
-            self.rect.height / img_h
-        )
-
-        new_size = (
-            int(img_w * scale),
-            int(img_h * scale),
-        )
-
-        scaled_image = pygame.transform.smoothscale(image, new_size)
+        scaled_image = sprites.get(image, fit_size(image, self.rect.width, self.rect.height))
 
         # Center the image in the target rect
         image_rect = scaled_image.get_rect(center=self.rect.center)
@@ -307,10 +700,16 @@ class Box:
         # Sliding state
         self.target_pixel_pos = self.pixel_pos.copy()
         self.sliding = False
+        # position before the last simulation step and the one drawn between the two
+        self.previous_pixel_pos = self.pixel_pos.copy()
+        self.render_pos = self.pixel_pos.copy()
+
+        # Standing on a goal, maintained by the BoxStore
+        self.glows = False
 
     # --------------------------------------------------
 
-    def try_push(self, direction: Vector2, level: Level, boxes: Iterable["Box"]) -> bool:
+    def try_push(self, direction: Vector2, level: Level, boxes: BoxStore) -> bool:
         dx = int(direction.x)
         dy = int(direction.y)
         target = GridPos(self.grid_pos.x + dx, self.grid_pos.y + dy)
@@ -321,11 +720,11 @@ class Box:
         if self.sliding:
             return False
 
-        if any(b.grid_pos == target for b in boxes):
+        if target in boxes:
             return False
 
         # Logical move
-        self.grid_pos = target
+        boxes.move(self, target)
 
         # Visual slide target
         self.target_pixel_pos = pygame.Vector2(
@@ -333,7 +732,7 @@ class Box:
             target.y * TILE_SIZE,
         )
         self.sliding = True
-        push_sound.play()
+        self.previous_pixel_pos = self.pixel_pos.copy()
 
         return True
 
@@ -346,12 +745,14 @@ class Box:
         if not self.sliding:
             return
 
+        self.previous_pixel_pos = self.pixel_pos.copy()
         direction = self.target_pixel_pos - self.pixel_pos
         distance = direction.length()
 
         if distance < 0.01:  # small tolerance
             self.pixel_pos = self.target_pixel_pos
             self.sliding = False
+            self.render_pos = self.pixel_pos.copy()
             return
 
         # Move by step, but do not overshoot
@@ -359,56 +760,138 @@ class Box:
         if move_dist >= distance:
             self.pixel_pos = self.target_pixel_pos
             self.sliding = False
+            self.render_pos = self.pixel_pos.copy()
         else:
             direction.normalize_ip()
             self.pixel_pos += direction * move_dist
-    # --------------------------------------------------
 
-    def draw(self, surface: pygame.Surface, transparency: float, glows: bool, camera: Camera2D) -> None:
-        alpha = max(0, min(255, int(transparency * 255)))
+    def interpolate(self, alpha: float) -> None:
+        """Draw at alpha (0..1) of the way from the previous to the current simulation step"""
+        self.render_pos = self.previous_pixel_pos.lerp(self.pixel_pos, alpha)
+    # --------------------------------------------------
 
-        rect = pygame.Rect(
-            int(self.pixel_pos.x),
-            int(self.pixel_pos.y),
+    def bounds(self) -> pygame.Rect:
+        return pygame.Rect(
+            int(self.render_pos.x),
+            int(self.render_pos.y),
             TILE_SIZE,
             TILE_SIZE,
         )
 
-        image = crystal_glow if glows else crystal_normal
-        scaled_image = pygame.transform.smoothscale(image, rect.size)
+    def draw(self, surface: pygame.Surface, transparency: float, glows: bool, camera: Camera2D) -> None:
+        alpha = max(0, min(255, int(transparency * 255)))
 
-        if alpha < 255:
-            scaled_image = scaled_image.copy()
-            scaled_image.set_alpha(alpha)
+        rect = self.bounds()
+
+        image = crystal_glow if glows else crystal_normal
+        scaled_image = sprites.get(image, rect.size, alpha)
 
         camera.blit(surface, scaled_image, rect.topleft)
 
 
+class BoxStore:
+    """
+    The boxes of a level indexed by their grid position.
+    Keeps the occupancy grid, the glow of the boxes and the number of covered goals up to date.
+    """
+
+    def __init__(self, level: Level) -> None:
+        self.level = level
+        self.covered_goals = 0
+        self.sliding: set[Box] = set()
+        self._boxes: dict[GridPos, Box] = {}
+        for pos in level.boxes:
+            self._add(Box(pos))
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def __iter__(self) -> Iterator[Box]:
+        return iter(self._boxes.values())
+
+    def __contains__(self, pos: GridPos) -> bool:
+        return pos in self._boxes
+
+    def at(self, pos: GridPos) -> Box | None:
+        return self._boxes.get(pos)
+
+    def in_tiles(self, tiles: pygame.Rect) -> Iterator[Box]:
+        """The boxes inside a rectangle given in grid coordinates"""
+        if tiles.width * tiles.height > len(self._boxes):
+            yield from (b for b in self._boxes.values() if tiles.collidepoint(b.grid_pos.x, b.grid_pos.y))
+            return
+        for y in range(tiles.top, tiles.bottom):
+            for x in range(tiles.left, tiles.right):
+                box = self._boxes.get(GridPos(x, y))
+                if box is not None:
+                    yield box
+
+    def add(self, pos: GridPos) -> None:
+        """A crystal that stands still, e.g. one brought back by an undo"""
+        self._add(Box(pos))
+
+    def _add(self, box: Box) -> None:
+        self._boxes[box.grid_pos] = box
+        box.glows = bool(self.level.flags(box.grid_pos.x, box.grid_pos.y) & TILE_GOAL)
+        self.covered_goals += box.glows
+
+    def remove(self, box: Box) -> None:
+        del self._boxes[box.grid_pos]
+        self.sliding.discard(box)
+        self.covered_goals -= box.glows
+
+    def move(self, box: Box, target: GridPos) -> None:
+        self.remove(box)
+        box.grid_pos = target
+        self._add(box)
+        self.sliding.add(box)
+
+    def update(self, dt: float) -> None:
+        """Advance the sliding boxes, the others have nothing to do"""
+        for box in list(self.sliding):
+            box.update(dt)
+            if not box.sliding:
+                self.sliding.discard(box)
+
+    def interpolate(self, alpha: float) -> None:
+        for box in self.sliding:
+            box.interpolate(alpha)
+
+    def is_solved(self) -> bool:
+        return self.level.is_solved(self)
+
+
 class ShatterAnimation:
+    FRAME_TIME = 0.1  # seconds
+
     def __init__(self, pos: GridPos) -> None:
         self.pos: GridPos = pos
-        self.start = time.time()
+        self.elapsed = 0.0
         self.step = 0
 
-    def update(self) -> bool:
-        if (time.time() - self.start) < 0.1:
+    def update(self, dt: float) -> bool:
+        self.elapsed += dt
+        if self.elapsed < self.FRAME_TIME:
             return True
-        self.start = time.time()
+        self.elapsed = 0.0
         self.step += 1
         if self.step >= len(shatter):
             return False
         return True
 
-    def draw(self, surface: pygame.Surface, camera: Camera2D) -> None:
-        rect = pygame.Rect(
+    def bounds(self) -> pygame.Rect:
+        return pygame.Rect(
             self.pos.x * TILE_SIZE,
             self.pos.y * TILE_SIZE,
             TILE_SIZE,
             TILE_SIZE,
         )
 
+    def draw(self, surface: pygame.Surface, camera: Camera2D) -> None:
+        rect = self.bounds()
+
         image = shatter[self.step]
-        scaled_image = pygame.transform.smoothscale(image, rect.size)
+        scaled_image = sprites.get(image, rect.size)
 
         camera.blit(surface, scaled_image, rect.topleft)
 
@@ -418,32 +901,41 @@ class ShatterAnimation:
 # ============================
 
 class Player:
+    PULSE_AMPLITUDE = 7  # pixels
+    PULSE_SPEED = 1.5  # cycles per second
+
     def __init__(self, start_pos: Vector2) -> None:
         self.position: Vector2 = start_pos
+        # position before the last simulation step and the one drawn between the two
+        self.previous_position: Vector2 = start_pos
+        self.render_position: Vector2 = start_pos
         self.velocity: Vector2 = Vector2(0, 0)
         self.size: Vector2 = Vector2(TILE_SIZE * 0.3)
         self.abilities = {Power.NONE}
         self.current_ability = Power.NONE
         self.facing = None
-        self.shatters = list()
+        # what happened during update, for the game to play sounds and animations
+        self.events: list[Event] = []
 
     @property
     def rect(self) -> pygame.Rect:
         return pygame.Rect(self.position, self.size)
 
+    @property
+    def render_rect(self) -> pygame.Rect:
+        return pygame.Rect(self.render_position, self.size)
+
     def next_ability(self) -> None:
-        for i in range(self.current_ability.value + 1, self.current_ability.value + 5):
-            if Power(i % 4) in self.abilities:
-                self.current_ability = Power(i % 4)
-                return
+        self.current_ability = next_ability(self.abilities, self.current_ability)
 
     def update(
             self,
             dt: float,
             level: Level,
-            boxes: List[Box],
+            boxes: BoxStore,
             input_dir: Vector2,
     ) -> None:
+        self.previous_position = self.position
         if input_dir.length_squared() > 0:
             self.facing = input_dir
             self.velocity = input_dir.normalize() * PLAYER_SPEED
@@ -453,50 +945,49 @@ class Player:
         new_pos = self.position + self.velocity * dt
         future_rect = pygame.Rect(new_pos, self.size)
 
+        # Only the tiles under the future rect can collide
+        tiles = list(level.tiles_under(future_rect))
+
         # Wall collision (simple axis-aligned)
-        for wall in level.walls:
-            wall_rect = pygame.Rect(
-                wall.x * TILE_SIZE,
-                wall.y * TILE_SIZE,
-                TILE_SIZE,
-                TILE_SIZE,
-            )
-            if future_rect.colliderect(wall_rect):
+        for x, y in tiles:
+            if level.flags(x, y) & TILE_WALL:
                 return
 
-        if self.current_ability != Power.IGNORE:
+        center_x, center_y = future_rect.center
+        center = GridPos(center_x // TILE_SIZE, center_y // TILE_SIZE)
+        box = boxes.at(center)
+        if self.current_ability != Power.IGNORE and box is not None:
             # Box pushing logic (grid-aligned)
-            for box in boxes.copy():
-                box_rect = pygame.Rect(
-                    box.grid_pos.x * TILE_SIZE,
-                    box.grid_pos.y * TILE_SIZE,
-                    TILE_SIZE,
-                    TILE_SIZE,
-                )
-                if box_rect.collidepoint(future_rect.center):
-                    direction = Vector2(round(input_dir.x), round(input_dir.y))
-                    if self.current_ability == Power.BREAK:
-                        boxes.remove(box)
-                        break_sound.play()
-                        self.shatters.append(ShatterAnimation(box.grid_pos))
-                        return
-                    if self.current_ability != Power.PUSH:
-                        return
-                    if not box.try_push(direction, level, boxes):
-                        return
+            direction = Vector2(round(input_dir.x), round(input_dir.y))
+            if self.current_ability == Power.BREAK:
+                boxes.remove(box)
+                self.events.append(Event(EventKind.BREAK, (box.grid_pos.x, box.grid_pos.y)))
+                return
+            if self.current_ability != Power.PUSH:
+                return
+            source = (box.grid_pos.x, box.grid_pos.y)
+            if not box.try_push(direction, level, boxes):
+                return
+            self.events.append(Event(EventKind.PUSH, (box.grid_pos.x, box.grid_pos.y), source=source))
 
         # Mask pickup
-        for mask in level.masks.copy():
-            mask_rect = mask.rect
-            if future_rect.colliderect(mask_rect):
+        for x, y in tiles:
+            if not level.flags(x, y) & TILE_MASK:
+                continue
+            mask = level.mask_at(GridPos(x, y))
+            if future_rect.colliderect(mask.rect):
                 self.abilities.add(mask.power)
                 self.current_ability = mask.power
-                mask_sounds[mask.power.value].play()
-                level.masks.remove(mask)
+                self.events.append(Event(EventKind.PICKUP, (mask.pos.x, mask.pos.y), mask.power))
+                level.remove_mask(mask)
 
         self.position = new_pos
 
-    def draw(self, surface: pygame.Surface, time: int, camera: Camera2D) -> None:
+    def interpolate(self, alpha: float) -> None:
+        """Draw at alpha (0..1) of the way from the previous to the current simulation step"""
+        self.render_position = self.previous_position.lerp(self.position, alpha)
+
+    def sprite(self) -> pygame.Surface:
         # Target area inside the tile
         target_rect = self.rect
 
@@ -509,88 +1000,202 @@ class Player:
             if self.facing[1] < 0:
                 image = hero_up
 
-        img_w, img_h = image.get_size()
-
         # Scale while maintaining aspect ratio
-        scale = min(
-            target_rect.width / img_w,
-            target_rect.height / img_h
-        )
+        fit_w, fit_h = fit_size(image, target_rect.width, target_rect.height)
+        return sprites.get(image, (4 * fit_w, 4 * fit_h))
 
-        new_size = (
-            4*int(img_w * scale),
-            4*int(img_h * scale),
-        )
+    def bounds(self) -> pygame.Rect:
+        """The part of the world the player draws into, at any height of the pulse"""
+        rect = self.render_rect
+        image_rect = self.sprite().get_rect(center=rect.center)
+        image_rect.y -= 40 + self.PULSE_AMPLITUDE
+        image_rect.height += 2 * self.PULSE_AMPLITUDE
+        return image_rect.union(rect).inflate(2, 2)
 
-        scaled_image = pygame.transform.smoothscale(image, new_size)
+    def draw(self, surface: pygame.Surface, time: int, camera: Camera2D) -> None:
+        scaled_image = self.sprite()
 
         # Center the image in the target rect
-        image_rect = scaled_image.get_rect(center=target_rect.center)
-        # Pulse parameters
-        amplitude = 7  # pixels
-        speed = 1.5  # cycles per second
+        rect = self.render_rect
+        image_rect = scaled_image.get_rect(center=rect.center)
 
         # Vertical pulsing using sine wave
-        offset_y = amplitude * math.sin(2 * math.pi * speed * time)
+        offset_y = self.PULSE_AMPLITUDE * math.sin(2 * math.pi * self.PULSE_SPEED * time)
         image_rect.y -= 40 + offset_y
 
         #pygame.draw.rect(surface, (0,0,0), camera.apply_rect(self.rect))
-        pygame.draw.circle(surface, (0,0,0), camera.apply_rect(self.rect).center, self.rect.width // 2)
+        pygame.draw.circle(surface, (0,0,0), camera.apply_rect(rect).center, rect.width // 2)
         camera.blit(surface, scaled_image, image_rect)
 
-        for shatter in self.shatters.copy():
-            if shatter.update():
-                shatter.draw(surface, camera)
-            else:
-                self.shatters.remove(shatter)
 
+# ============================
+# Audio
+# ============================
 
-class MusicManager:
-    def __init__(self, volume=1.0, fade_ms=300):
-        files = [
-            resource_path("assets/music/main.ogg"),
-            resource_path("assets/music/push.ogg"),
-            resource_path("assets/music/break.ogg"),
-            resource_path("assets/music/ignore.ogg")
-        ]
+class SoundEffects:
+    """Plays the effects on their own reserved channels, so they never cut off the music"""
 
-        self.sounds = [pygame.mixer.Sound(f) for f in files]
-        self.channels = [pygame.mixer.Channel(i) for i in range(len(files))]
+    def __init__(self, channels: tuple[int, ...] = EFFECT_CHANNELS) -> None:
+        self.channels = [pygame.mixer.Channel(i) for i in channels]
+        self.oldest = 0
+
+    def play(self, sound: pygame.mixer.Sound) -> None:
+        for channel in self.channels:
+            if not channel.get_busy():
+                channel.play(sound)
+                return
+        # all busy: cut off the effect that started first
+        self.channels[self.oldest].play(sound)
+        self.oldest = (self.oldest + 1) % len(self.channels)
+
+
+class MusicManager:
+    """
+    One music stem per ability, all of the same length and in sync. A stem is played in segments
+    of MUSIC_SEGMENT seconds, cut from its decoded samples when they are queued, so starting it in
+    the middle copies one segment and not the whole stem. Only the active stem is mixed, plus the
+    previous one while crossfading.
+
+    The stems are loaded in the background by request, a switch to a stem that is not loaded yet
+    happens when it arrives. The loaded stems, the ones being loaded and the segments on the
+    channels stay under the memory budget, the least recently used stems are dropped for it.
+    """
+
+    def __init__(
+            self,
+            count: int,
+            request: Callable[[int], None],
+            loaded: dict[int, memoryview],
+            volume: float = 1.0,
+            fade_ms: int = 300,
+            budget: int = MUSIC_MEMORY_BUDGET,
+    ) -> None:
+        self.count = count
+        self.request = request  # starts loading a stem, the samples arrive in add
+        self.stems: OrderedDict[int, memoryview] = OrderedDict(loaded)
+        self.loading: set[int] = set()
+        # the active channel first, then the crossfade partner, with the stem and the byte offset
+        # of the next segment they play
+        self.channels = [pygame.mixer.Channel(i) for i in MUSIC_CHANNELS]
+        self.cursors: list[tuple[int, int] | None] = [None] * len(self.channels)
+
+        frequency, size, channels = pygame.mixer.get_init()
+        self.frame_bytes = channels * abs(size) // 8
+        self.second_bytes = frequency * self.frame_bytes
+        self.segment_bytes = int(MUSIC_SEGMENT * frequency) * self.frame_bytes
 
         self.volume = volume
         self.fade_ms = fade_ms
+        self.budget = budget
+        self.fading = 0.0  # seconds left of the crossfade
 
-        self.current = 0
+        self.current = self.wanted = 0
         self.start_time = pygame.time.get_ticks() / 1000.0
+        self.play(0, 0, 0.0)
+        self.channels[0].set_volume(self.volume)
+
+    # -------------------------------------
 
-        # Start ALL tracks at once, muted
-        for ch, snd in zip(self.channels, self.sounds):
-            ch.play(snd, loops=-1)
-            ch.set_volume(0.0)
+    def stem_bytes(self) -> int:
+        return self.stems[self.current].nbytes
+
+    def memory(self) -> int:
+        """The loaded stems, the ones being loaded and a playing and a queued segment per channel"""
+        loaded = sum(samples.nbytes for samples in self.stems.values())
+        return loaded + len(self.loading) * self.stem_bytes() + 2 * len(self.channels) * self.segment_bytes
+
+    def make_room(self, extra: int) -> bool:
+        """Drop the stems no channel plays, least recently used first, until extra bytes fit the budget"""
+        playing = {cursor[0] for cursor in self.cursors if cursor is not None}
+        while self.memory() + extra > self.budget:
+            unused = [i for i in self.stems if i not in playing]
+            if not unused:
+                return False
+            del self.stems[unused[0]]
+        return True
+
+    def load(self, index: int) -> None:
+        if index not in self.stems and index not in self.loading and self.make_room(self.stem_bytes()):
+            self.loading.add(index)
+            self.request(index)
+
+    def preload(self) -> None:
+        """Load the other stems while they fit the budget, without dropping any"""
+        for index in range(self.count):
+            if self.memory() + self.stem_bytes() <= self.budget:
+                self.load(index)
+
+    def add(self, index: int, samples: memoryview) -> None:
+        """A stem finished loading"""
+        self.loading.discard(index)
+        self.stems[index] = samples
+        if index == self.wanted:
+            self.switch_to(index)
 
-        # First track audible
-        self.channels[0].set_volume(self.volume)
     # -------------------------------------
 
-    def switch_to(self, index):
+    def position(self) -> float:
+        """Seconds into the stems"""
+        length = self.stem_bytes() / self.second_bytes
+        return (pygame.time.get_ticks() / 1000.0 - self.start_time) % length if length else 0.0
+
+    def segment(self, slot: int) -> pygame.mixer.Sound:
+        """The next segment of the channel, up to the next segment boundary"""
+        index, offset = self.cursors[slot]
+        samples = self.stems[index]
+        self.stems.move_to_end(index)
+        end = min((offset // self.segment_bytes + 1) * self.segment_bytes, samples.nbytes)
+        self.cursors[slot] = (index, end % samples.nbytes)
+        return pygame.mixer.Sound(buffer=samples[offset:end])
+
+    def play(self, slot: int, index: int, position: float) -> None:
+        """Start a stem at position on a channel, the stem follows in a loop"""
+        offset = int(position * self.second_bytes) // self.frame_bytes * self.frame_bytes
+        self.cursors[slot] = (index, offset % self.stems[index].nbytes)
+        self.channels[slot].play(self.segment(slot))
+
+    def switch_to(self, index: int) -> None:
+        self.wanted = index
         if index == self.current:
             return
+        if index not in self.stems:
+            self.load(index)
+            return
 
-        old = self.channels[self.current]
-        new = self.channels[index]
-
-        old.set_volume(0)
-        new.set_volume(self.volume)  # already playing → instant sync
-
+        position = self.position()
         self.current = index
+        # the new stem fades in on the partner channel, the old one becomes the partner
+        self.play(1, index, position)
+        self.channels[1].set_volume(0.0)
+        self.channels.reverse()
+        self.cursors.reverse()
+        self.fading = self.fade_ms / 1000.0
+        self.update(0.0)
 
-    # -------------------------------------
+    def update(self, dt: float) -> None:
+        active, partner = self.channels
+        if self.fading > 0:
+            self.fading = max(0.0, self.fading - dt)
+            progress = 1.0 - self.fading * 1000.0 / self.fade_ms
+            active.set_volume(self.volume * progress)
+            partner.set_volume(self.volume * (1.0 - progress))
+            if self.fading == 0:
+                partner.stop()
+                self.cursors[1] = None
+
+        # there is always one segment queued after the playing one
+        if not active.get_busy():
+            self.play(0, self.current, self.position())
+        for slot, channel in enumerate(self.channels):
+            if self.cursors[slot] is not None and channel.get_queue() is None:
+                channel.queue(self.segment(slot))
 
 class Camera2D:
     def __init__(self, width: int, height: int, smooth_speed: float = 5.0):
         self.width = width
         self.height = height
         self.pos = pygame.Vector2(0, 0)
+        self.target = pygame.Vector2(0, 0)
         self.smooth_speed = smooth_speed  # for smooth follow
 
     # ----------------------------
@@ -610,6 +1215,11 @@ class Camera2D:
             target_pos.y - self.height / 2
         )
         self.pos += (target - self.pos) * min(self.smooth_speed * dt, 1)
+        self.target = target
+
+    def settled(self) -> bool:
+        """Less than half a pixel away from the followed target"""
+        return (self.target - self.pos).length_squared() < 0.25
 
     # ----------------------------
 
@@ -619,6 +1229,19 @@ class Camera2D:
     def apply_rect(self, rect: pygame.Rect) -> pygame.Rect:
         return rect.move(-self.pos.x, -self.pos.y)
 
+    def view_rect(self) -> pygame.Rect:
+        """The part of the world (in pixels) that is visible on the screen"""
+        return pygame.Rect(math.ceil(self.pos.x), math.ceil(self.pos.y), self.width + 1, self.height + 1)
+
+    def visible_tiles(self, margin: int = 0) -> pygame.Rect:
+        """The tiles (in grid coordinates) that are at least partially on the screen, plus a margin around them"""
+        view = self.view_rect()
+        left = view.left // TILE_SIZE - margin
+        top = view.top // TILE_SIZE - margin
+        right = (view.right - 1) // TILE_SIZE + 1 + margin
+        bottom = (view.bottom - 1) // TILE_SIZE + 1 + margin
+        return pygame.Rect(left, top, right - left, bottom - top)
+
     # ----------------------------
     # NEW: blit wrapper
     # ----------------------------
@@ -642,10 +1265,164 @@ class Camera2D:
 # ============================
 WIN_EVENT = pygame.USEREVENT + 1
 
+def direction_of(vector: Vector2) -> Direction:
+    """The sign of both axes of an input direction"""
+    return (vector.x > 0) - (vector.x < 0), (vector.y > 0) - (vector.y < 0)
+
+
+def input_vector(direction: Direction) -> Vector2:
+    """The normalized input direction, the same for the keyboard, the touch input and recordings"""
+    vector = Vector2(direction)
+    return vector.normalize() if vector.length_squared() > 0 else vector
+
+
+def merge_rects(rects: list[pygame.Rect], bounds: pygame.Rect) -> list[pygame.Rect]:
+    """Clip the rects to bounds and join the overlapping ones"""
+    merged: list[pygame.Rect] = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if not rect.width or not rect.height:
+            continue
+        # joining can make a rect overlap ones that were separate before
+        i = rect.collidelist(merged)
+        while i >= 0:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+# ============================
+# Profiler
+# ============================
+
+PROFILE_PHASES: tuple[str, ...] = (
+    "events", "player", "boxes", "misc",  # update
+    "level", "box_draw", "mask_draw", "player_draw", "hud", "flip",  # drawing
+)
+
+
+class FrameProfiler:
+    """
+    Milliseconds spent in every phase of the last frames, in a ring buffer. mark(phase) adds the
+    time since the previous mark to the phase, a phase marked several times in one frame (draw_scene
+    with dirty rects) is summed up.
+    """
+
+    def __init__(self, phases: tuple[str, ...] = PROFILE_PHASES, frames: int = PROFILE_FRAMES) -> None:
+        self.phases = phases
+        self.slots = {phase: i for i, phase in enumerate(phases)}
+        self.frames = frames
+        # one column per phase and the whole frame, allocated once
+        self.samples = [array("d", bytes(8 * frames)) for _ in range(len(phases) + 1)]
+        self.current = [0.0] * len(phases)
+        self.count = 0  # frames recorded, the next one goes to count % frames
+        self.started = self.last = 0.0
+
+        self.visible = False
+        self.overlay: pygame.Surface | None = None
+        self.overlay_count = -1
+
+    def begin(self) -> None:
+        self.started = self.last = time.perf_counter()
+        for i in range(len(self.current)):
+            self.current[i] = 0.0
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.current[self.slots[phase]] += now - self.last
+        self.last = now
+
+    def end(self) -> None:
+        slot = self.count % self.frames
+        for column, seconds in zip(self.samples, self.current):
+            column[slot] = seconds * 1000.0
+        self.samples[-1][slot] = (self.last - self.started) * 1000.0
+        self.count += 1
+
+    # -------------------------------------
+
+    def columns(self) -> list[list[float]]:
+        """The recorded frames of every phase and the whole frame, oldest first"""
+        n = min(self.count, self.frames)
+        start = self.count % self.frames if self.count > self.frames else 0
+        return [list(column[start:n]) + list(column[:start]) if start else list(column[:n]) for column in self.samples]
+
+    def percentiles(self) -> dict[str, tuple[float, float, float]]:
+        """p50, p95 and p99 of every phase and the frame"""
+        result = {}
+        for phase, values in zip(self.phases + ("frame",), self.columns()):
+            values.sort()
+            if values:
+                result[phase] = tuple(values[min(len(values) - 1, int(len(values) * q))] for q in (0.5, 0.95, 0.99))
+        return result
+
+    def draw(self, screen: pygame.Surface) -> None:
+        # the numbers change twice a second, that is enough to read them
+        if self.overlay is None or self.count - self.overlay_count >= FPS // 2:
+            self.overlay = self.build_overlay()
+            self.overlay_count = self.count
+        screen.blit(self.overlay, self.bounds())
+
+    def bounds(self) -> pygame.Rect:
+        if self.overlay is None:
+            return pygame.Rect(10, 10, 0, 0)
+        return self.overlay.get_rect(topleft=(10, 10))
+
+    def build_overlay(self) -> pygame.Surface:
+        font = get_font(22)
+        rows = [("ms", "p50", "p95", "p99")]
+        rows += [(phase, *(f"{v:.2f}" for v in values)) for phase, values in self.percentiles().items()]
+        line = font.get_linesize()
+        overlay = pygame.Surface((330, line * len(rows) + 12), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, 170))
+        for y, row in enumerate(rows):
+            for x, text in zip((8, 140, 200, 260), row):
+                overlay.blit(font.render(text, True, (230, 230, 230)), (x, 6 + y * line))
+        return overlay
+
+    def dump(self, path: str) -> None:
+        """The recorded frames as CSV, one row per frame, or as JSON with the percentiles"""
+        names = self.phases + ("frame",)
+        frames = list(zip(*self.columns()))
+        with open(path, "w", newline="") as f:
+            if path.endswith(".json"):
+                json.dump({
+                    "phases": names,
+                    "percentiles": {phase: dict(zip(("p50", "p95", "p99"), values))
+                                    for phase, values in self.percentiles().items()},
+                    "frames": [[round(v, 4) for v in frame] for frame in frames],
+                }, f, indent=1)
+            else:
+                f.write(",".join(names) + "\n")
+                for frame in frames:
+                    f.write(",".join(f"{v:.4f}" for v in frame) + "\n")
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    """A push, break or pickup and the state of the player before it, to undo it"""
+    events: tuple[Event, ...]  # what changed the crystals and the masks, they are undone in reverse
+    abilities: frozenset[Power]
+    current: Power
+    player: tuple[float, float]
+
+
 class Game:
-    def __init__(self) -> None:
+    def __init__(
+            self,
+            dirty_rects: bool = DIRTY_RECTS,
+            profile_out: str | None = PROFILE_OUT,
+            level_pack: list[str] | None = None,
+            record: str | None = None,
+            replay: InputReplay | None = None,
+    ) -> None:
         pygame.init()
         pygame.mixer.init()
+        _fonts.clear()  # fonts of an earlier pygame.init are no longer valid
+        # the music and the effects have their own channels, Sound.play never takes them
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), 8))
+        pygame.mixer.set_reserved(len(MUSIC_CHANNELS) + len(EFFECT_CHANNELS))
         self.screen = pygame.display.set_mode(SCREEN_SIZE)
         pygame.display.set_caption("Maztek Spirit Warrior")
 
@@ -657,17 +1434,345 @@ class Game:
         self.level = None
         self.player = None
         self.boxes = None
+        self.shatters: list[ShatterAnimation] = []
+        self.levels = level_pack if level_pack is not None else all_levels
         self.level_index = 0
+        # every level is parsed once, restart and undo start from a clone
+        self.templates: dict[int, Level] = {}
+        self.template: Level | None = None
+        self.history: deque[Snapshot] = deque(maxlen=UNDO_LIMIT)
+        self.abilities: frozenset[Power] = frozenset()  # the abilities after the last pickup
+        # the crystals, masks and abilities for the solver and the deadlock checks, kept up to date
+        # push by push, the player and the current ability are filled in when it is used
+        self.state: BitState | None = None
+        # dead squares of every level, computed when it loads, and whether the current state is stuck
+        self.analyses = AnalysisCache(ANALYSIS_CACHE_DIR, read_only=True)  # written by validate.py
+        self.analyzers: dict[int, DeadlockAnalyzer] = {}
+        self.analyzer: DeadlockAnalyzer | None = None
+        self.deadlock: Deadlock | None = None
+
+        # H shows the next action of a solution from the current state, searched in the background
+        self.hint_engine = HintEngine()
+        self.hints_on = False
+        self.hint: Hint | None = None
+        self.hint_tile: GridPos | None = None
+        self.hint_request: tuple[str, BitState] | None = None
         self.hud_area = None
         self.reset_area = None
-
+        self.hud: pygame.Surface | None = None
+        self.hud_key: tuple[frozenset[Power], Power] | None = None
+
+        # dirty rectangle rendering: only the changed parts of the screen are redrawn
+        self.dirty_rects = dirty_rects
+        self.full_redraw = True
+        self.last_view: tuple[int, int] | None = None
+        self.previous_rects: list[pygame.Rect] = []
+        # seconds of the player pulse animation, it pauses while the game is idle
+        self.pulse_time = 0.0
+        # simulation time of the frames that is not simulated yet, less than one SIMULATION_STEP
+        self.accumulator = 0.0
+        self.profiler = FrameProfiler()
+        self.profile_out = profile_out
+
+        # the input of every simulation step is recorded to a file, or it comes from a recording
+        if replay is not None:
+            if abs(replay.step_time - SIMULATION_STEP) > 1e-6:
+                raise ValueError(f"the recording has steps of {replay.step_time}s, the game {SIMULATION_STEP}s")
+            self.level_index = replay.level_index
+        self.replay = replay
+        self.replay_steps = iter(replay) if replay is not None else None
+        self.record_path = record
+        self.recorder = InputRecorder(self.level_index, SIMULATION_STEP) if record else None
+
+        self.loader = AssetLoader()
+        self.effects = SoundEffects()
+        self.decoded = DecodedCache(DECODED_CACHE_DIR)
+        # the sounds and the music load in the background, the errors are raised in the frame loop
+        self.loading: list[asyncio.Future] = []
         self.initialized = False  # Flag to track setup
 
 
+    async def load_sounds(self) -> None:
+        global break_sound, push_sound, mask_sounds
+
+        # the first music stem is loaded with the effects, the others follow as far as they fit the
+        # memory budget, the rest when the player first switches to them
+        jobs = {name: partial(self.decoded.sound, path) for name, path in SOUND_FILES.items()}
+        music = all(os.path.exists(resource_path(path)) for path in MUSIC_FILES)
+        if music:
+            jobs[MUSIC_FILES[0]] = partial(self.decoded.samples, MUSIC_FILES[0])
+        loaded = await self.loader.load(jobs)
+
+        break_sound = loaded["break"]
+        push_sound = loaded["push"]
+        mask_sounds = [loaded[f"mask{i}"] for i in range(4)]
+        if not music:
+            return  # the stems are not in the repository, without them the game plays without music
+        self.music = MusicManager(len(MUSIC_FILES), self.request_stem, {0: loaded[MUSIC_FILES[0]]})
+        self.music.switch_to(self.player.current_ability.value)
+        self.music.preload()
+
+    def request_stem(self, index: int) -> None:
+        self.loading.append(asyncio.ensure_future(self.load_stem(index)))
+
+    async def load_stem(self, index: int) -> None:
+        path = MUSIC_FILES[index]
+        loaded = await self.loader.load({path: partial(self.decoded.samples, path)})
+        self.music.add(index, loaded[path])
+
+    def check_loading(self) -> None:
+        """Raise the error of a background load that failed, e.g. of a sound that could not be decoded"""
+        for future in [future for future in self.loading if future.done()]:
+            self.loading.remove(future)
+            future.result()
+
+    def draw_loading(self, progress: float) -> None:
+        self.screen.fill((20, 20, 20))
+        panel = panels.get("Loading...", 40, (20, 20, 20))
+        center = self.screen.get_rect().center
+        self.screen.blit(panel, panel.get_rect(center=center))
+
+        bar = pygame.Rect(0, 0, 400, 12)
+        bar.midtop = (center[0], center[1] + panel.get_height())
+        filled = pygame.Rect(bar.topleft, (int(bar.width * progress), bar.height))
+        pygame.draw.rect(self.screen, (60, 60, 60), bar, border_radius=6)
+        pygame.draw.rect(self.screen, (255, 215, 0), filled, border_radius=6)
+        pygame.display.flip()
+
     def restart_level(self) -> None:
-        self.level = Level(all_levels[self.level_index])
+        self.template = self.templates.get(self.level_index)
+        if self.template is None:
+            self.template = self.templates[self.level_index] = Level(self.levels[self.level_index])
+            self.analyzers[self.level_index] = self.load_analysis()
+        self.analyzer = self.analyzers[self.level_index]
+        self.level = self.template.clone()
         self.player = Player(self.level.player.to_world())
-        self.boxes: List[Box] = [Box(b) for b in self.level.boxes]
+        self.boxes = BoxStore(self.level)
+        self.shatters = []
+        self.history.clear()
+        self.abilities = frozenset(self.player.abilities)
+        self.state = self.build_state()
+        self.check_deadlock(reset=True)
+        self.full_redraw = True
+
+    def load_analysis(self) -> DeadlockAnalyzer:
+        """
+        The dead squares of the level that was just parsed, looked up in the analysis cache if the
+        level did not change. A cached solution gives the hints along it right away.
+        """
+        level = self.levels[self.level_index]
+        board, start = Board.from_level(self.template)
+        analysis = self.analyses.get(level)
+        if analysis is None or analysis.width != board.width:
+            return DeadlockAnalyzer(board)
+        if analysis.solved:
+            self.hint_engine.store(level, start, analysis.actions)
+        return DeadlockAnalyzer(board, analysis.dead)
+
+    def undo(self) -> None:
+        """Back to the moment before the last push, break or pickup, only the changed tiles are restored"""
+        if not self.history:
+            return
+        snapshot = self.history.pop()
+        width = self.level.width
+        state = self.state
+        for event in reversed(snapshot.events):
+            pos = GridPos(*event.pos)
+            bit = 1 << pos.y * width + pos.x
+            match event.kind:
+                case EventKind.PUSH:
+                    source = GridPos(*event.source)
+                    self.boxes.remove(self.boxes.at(pos))
+                    self.boxes.add(source)
+                    state = replace(state, boxes=state.boxes ^ (bit | 1 << source.y * width + source.x))
+                case EventKind.BREAK:
+                    self.boxes.add(pos)
+                    state = replace(state, boxes=state.boxes | bit)
+                case EventKind.PICKUP:
+                    self.level.add_mask(self.template.mask_at(pos))
+                    state = replace(state, masks=state.masks | bit)
+        self.abilities = snapshot.abilities
+        self.state = replace(state, abilities=bits(power.value for power in snapshot.abilities))
+        self.player = Player(Vector2(snapshot.player))
+        self.player.abilities = set(snapshot.abilities)
+        self.player.current_ability = snapshot.current
+        self.shatters = []
+        self.check_deadlock(reset=True)
+        self.full_redraw = True
+
+    def execute(self, command: Command) -> None:
+        if self.recorder is not None:
+            self.recorder.command(command)
+        self.hint_request = None
+        match command:
+            case Command.SWITCH:
+                self.player.next_ability()
+            case Command.RESTART:
+                self.restart_level()
+            case Command.UNDO:
+                self.undo()
+            case Command.NEXT_LEVEL:
+                self.level_index = (self.level_index + 1) % len(self.levels)
+                self.restart_level()
+
+    def simulate(self, input_dir: Vector2) -> None:
+        """One SIMULATION_STEP of the player and the crystals"""
+        if self.recorder is not None:
+            self.recorder.step(direction_of(input_dir))
+        player = self.player
+        position, current, events = player.position, player.current_ability, len(player.events)
+        player.update(SIMULATION_STEP, self.level, self.boxes, input_dir)
+        if len(player.events) > events:
+            step_events = tuple(player.events[events:])
+            # the abilities did not change since the last push, break or pickup
+            self.history.append(Snapshot(step_events, self.abilities, current, (position.x, position.y)))
+            self.abilities = frozenset(player.abilities)
+            self.hint_request = None
+            self.update_state(step_events)
+            # flagged in the step of the push, so in the same frame
+            pushes = [event.pos for event in step_events if event.kind == EventKind.PUSH]
+            self.check_deadlock(GridPos(*pushes[-1]) if pushes else None)
+        self.profiler.mark("player")
+        self.boxes.update(SIMULATION_STEP)
+        self.profiler.mark("boxes")
+
+    def player_tile(self) -> GridPos:
+        x, y = self.player.rect.center
+        return GridPos(x // TILE_SIZE, y // TILE_SIZE)
+
+    def build_state(self) -> BitState:
+        """The crystals, masks and abilities from scratch, after a restart"""
+        width = self.level.width
+        return BitState(
+            boxes=bits(box.grid_pos.y * width + box.grid_pos.x for box in self.boxes),
+            masks=bits(mask.pos.y * width + mask.pos.x for mask in self.level.masks),
+            player=0,
+            abilities=bits(power.value for power in self.player.abilities),
+        )
+
+    def update_state(self, events: tuple[Event, ...]) -> None:
+        """Apply the pushes, breaks and pickups of a simulation step to the state"""
+        width = self.level.width
+        state = self.state
+        for event in events:
+            x, y = event.pos
+            match event.kind:
+                case EventKind.PUSH:
+                    sx, sy = event.source
+                    state = replace(state, boxes=state.boxes ^ (1 << sy * width + sx | 1 << y * width + x))
+                case EventKind.BREAK:
+                    state = replace(state, boxes=state.boxes & ~(1 << y * width + x))
+                case EventKind.PICKUP:
+                    state = replace(state, masks=state.masks & ~(1 << y * width + x),
+                                    abilities=state.abilities | 1 << event.power.value)
+        self.state = state
+
+    def bit_state(self) -> BitState:
+        tile = self.player_tile()
+        return replace(self.state, player=tile.y * self.level.width + tile.x,
+                       current=self.player.current_ability.value)
+
+    def hint_state(self) -> tuple[str, BitState]:
+        """The current state for the solver"""
+        return self.levels[self.level_index], self.bit_state()
+
+    def check_deadlock(self, pushed: GridPos | None = None, reset: bool = False) -> None:
+        """After a push (to the tile pushed), break or pickup, or from scratch after a restart or an undo"""
+        state = self.bit_state()
+        if reset:
+            self.analyzer.reset(state)
+        index = pushed.y * self.level.width + pushed.x if pushed is not None else None
+        deadlock = self.analyzer.check(state, index)
+        if deadlock != self.deadlock:
+            self.deadlock = deadlock
+            self.full_redraw = True
+
+    def draw_deadlock(self) -> None:
+        if self.deadlock is None:
+            return
+        panel = panels.get(f"{self.deadlock.value}, undo with U or restart with R", 32, (120, 20, 20))
+        self.screen.blit(panel, panel.get_rect(midtop=(SCREEN_SIZE[0] // 2, 16)))
+
+    def update_hint(self) -> bool:
+        """Look up the hint of the current state or search for it, True if the shown hint changed"""
+        if not self.hints_on:
+            return False
+        found = self.hint_engine.poll()
+        tile = self.player_tile()
+        if self.hint_request is None or tile != self.hint_tile:
+            # the state is only built again when something happened or the player reached another tile,
+            # the engine searches only if the player left the region of the last search
+            self.hint_tile = tile
+            self.hint_request = self.hint_state()
+            self.hint_engine.request(*self.hint_request)
+        elif not found:
+            return False
+        hint = self.hint_engine.lookup(*self.hint_request)
+        if hint == self.hint:
+            return False
+        self.hint = hint
+        return True
+
+    def draw_hint(self) -> None:
+        if not self.hints_on or self.hint is None:
+            return
+        center = self.camera.apply(self.hint_tile.to_world())
+        action = self.hint.action
+        if action is None or action == Action.SWITCH:
+            text = "Press space" if action == Action.SWITCH else "No solution, undo with U"
+            panel = panels.get(text, 32, (20, 20, 20))
+            self.screen.blit(panel, panel.get_rect(midbottom=(center.x, center.y - TILE_SIZE)))
+            return
+
+        # an arrow in the direction to press, diagonal for a diagonal push
+        direction = Vector2(action.push).normalize()
+        side = Vector2(-direction.y, direction.x)
+        tip = center + direction * TILE_SIZE * 0.9
+        base = center + direction * TILE_SIZE * 0.55
+        tail = center + direction * TILE_SIZE * 0.3
+        points = [
+            tail + side * 6, base + side * 6, base + side * 16, tip,
+            base - side * 16, base - side * 6, tail - side * 6,
+        ]
+        pygame.draw.polygon(self.screen, (255, 215, 0), points)
+        pygame.draw.polygon(self.screen, (20, 20, 20), points, 2)
+
+    def play_effects(self) -> None:
+        """Sounds and animations for what happened in the last player update"""
+        for event in self.player.events:
+            match event.kind:
+                # the sounds are still loading during the first moments
+                case EventKind.PUSH:
+                    if push_sound is not None:
+                        self.effects.play(push_sound)
+                case EventKind.BREAK:
+                    if break_sound is not None:
+                        self.effects.play(break_sound)
+                    self.shatters.append(ShatterAnimation(GridPos(*event.pos)))
+                case EventKind.PICKUP:
+                    if mask_sounds is not None:
+                        self.effects.play(mask_sounds[event.power.value])
+        self.player.events.clear()
+
+    def warm_sprite_cache(self) -> None:
+        """Scale all sprites to the sizes used by the draw methods, so no frame has to."""
+        tile = (TILE_SIZE, TILE_SIZE)
+        for image in [floor_normal, floor_glow] + shatter:
+            sprites.get(image, tile)
+
+        for image in [crystal_normal, crystal_glow]:
+            sprites.get(image, tile)
+            sprites.get(image, tile, int(0.5 * 255))  # see-through while ignoring
+
+        for image in [push_mask, break_mask, ignore_mask]:
+            sprites.get(image, fit_size(image, TILE_SIZE - 30, TILE_SIZE - 30))
+            sprites.get(image, fit_size(image, 58, 58))
+            sprites.get(image, fit_size(image, 58, 58), 50)
+
+        hero_size = int(TILE_SIZE * 0.3)
+        for image in [hero_down, hero_up, hero_left, hero_right]:
+            fit_w, fit_h = fit_size(image, hero_size, hero_size)
+            sprites.get(image, (4 * fit_w, 4 * fit_h))
 
     def draw_hud(
             self,
@@ -682,12 +1787,8 @@ class Game:
     ) -> None:
         """
         Draw the HUD with 4 slots and a semi-transparent background.
-        slot_images: list of length 4 (None = empty slot)
-        highlighted_index: index of the selected slot (0–3)
+        The HUD surface is only rebuilt when the collected or the current ability changes.
         """
-        slot_images = [None, push_mask, break_mask, ignore_mask]
-        assert len(slot_images) == 4
-
         # Compute HUD rectangle
         total_width = 4 * slot_size + 3 * padding
         hud_height = slot_size
@@ -697,16 +1798,43 @@ class Game:
         hud_rect = pygame.Rect(start_x - padding, y - padding, total_width + 2 * padding, hud_height + 2 * padding)
         self.hud_area = hud_rect
 
+        hud_key = (frozenset(self.player.abilities), self.player.current_ability)
+        if self.hud is None or hud_key != self.hud_key:
+            self.hud = self.build_hud(
+                hud_rect.size, slot_size, padding, highlight_color, highlight_width, highlight_radius,
+                bg_color, bg_radius,
+            )
+            self.hud_key = hud_key
+        self.screen.blit(self.hud, hud_rect.topleft)
+
+        # draw the reset button
+        panel = panels.get("Reset Level", 40, (120, 20, 20))
+        self.reset_area = panel.get_rect(center=(100, SCREEN_SIZE[1] - 40))
+        self.screen.blit(panel, self.reset_area.topleft)
+
+    def build_hud(
+            self,
+            size: tuple[int, int],
+            slot_size: int,
+            padding: int,
+            highlight_color: tuple[int, int, int],
+            highlight_width: int,
+            highlight_radius: int,
+            bg_color: tuple[int, int, int, int],
+            bg_radius: int,
+    ) -> pygame.Surface:
+        slot_images = [None, push_mask, break_mask, ignore_mask]
+        assert len(slot_images) == 4
+
         # --- Draw semi-transparent background ---
-        bg_surf = pygame.Surface((hud_rect.width, hud_rect.height), pygame.SRCALPHA)
-        pygame.draw.rect(bg_surf, bg_color, bg_surf.get_rect(), border_radius=bg_radius)
-        self.screen.blit(bg_surf, hud_rect.topleft)
+        hud = pygame.Surface(size, pygame.SRCALPHA)
+        pygame.draw.rect(hud, bg_color, hud.get_rect(), border_radius=bg_radius)
 
         # --- Draw slots ---
         for i in range(4):
             slot_rect = pygame.Rect(
-                start_x + i * (slot_size + padding),
-                y,
+                padding + i * (slot_size + padding),
+                padding,
                 slot_size,
                 slot_size,
             )
@@ -714,7 +1842,7 @@ class Game:
             # Highlighted slot
             if i == self.player.current_ability.value:
                 pygame.draw.rect(
-                    self.screen,
+                    hud,
                     highlight_color,
                     slot_rect.inflate(6, 6),
                     highlight_width,
@@ -725,66 +1853,77 @@ class Game:
             if image is None:
                 continue
 
-            # Scale image while preserving aspect ratio
-            img_w, img_h = image.get_size()
-            scale = min((slot_size - 12) / img_w, (slot_size - 12) / img_h)
-            new_size = (int(img_w * scale), int(img_h * scale))
-            scaled = pygame.transform.smoothscale(image, new_size)
-
-            # Transparency for unavailable abilities
+            # Scale image while preserving aspect ratio,
+            # transparency for unavailable abilities
             alpha = 255 if Power(i) in self.player.abilities else 50
-            if alpha < 255:
-                scaled = scaled.copy()
-                scaled.set_alpha(alpha)
+            scaled = sprites.get(image, fit_size(image, slot_size - 12, slot_size - 12), alpha)
 
             img_rect = scaled.get_rect(center=slot_rect.center)
-            self.screen.blit(scaled, img_rect)
-
-        # draw the reset button
-        font = pygame.font.Font(None, 40)
-        text = font.render("Reset Level", True, (120, 20, 20))
-
-        # Center the text
-        rect = text.get_rect(center=(100, SCREEN_SIZE[1] - 40))
-
-        # --- Create a temporary surface for the rounded rectangle ---
-        padding = 20  # space around the text
-        radius = 16  # corner radius
-
-        bg_surf = pygame.Surface(
-            (rect.width + padding * 2, rect.height + padding * 2), pygame.SRCALPHA
-        )
-        bg_color = (150, 150, 150, 180)  # semi-transparent gray (A=180)
-        pygame.draw.rect(bg_surf, bg_color, bg_surf.get_rect(), border_radius=radius)
-
-        # --- Blit the background and then the text ---
-        bg_rect = bg_surf.get_rect(center=rect.center)
-        self.reset_area = bg_rect
-        self.screen.blit(bg_surf, bg_rect.topleft)
-        self.screen.blit(text, rect.topleft)
+            hud.blit(scaled, img_rect)
+        return hud
+
+    def draw_scene(self) -> None:
+        profiler = self.profiler
+        profiler.mark("misc")
+        self.screen.blit(background, (0, 0))
+
+        self.level.draw(self.screen, self.camera)
+        profiler.mark("level")
+        # boxes slide at most one tile away from their grid position
+        for box in self.boxes.in_tiles(self.camera.visible_tiles(margin=1)):
+            transparency = 0.5 if self.player.current_ability == Power.IGNORE else 1
+            box.draw(self.screen, transparency, box.glows, self.camera)
+        profiler.mark("box_draw")
+        for mask in self.level.visible_masks(self.camera):
+            mask.draw(self.screen, self.camera)
+        profiler.mark("mask_draw")
+        self.player.draw(self.screen, self.pulse_time, self.camera)
+        profiler.mark("player_draw")
+        for shatter in self.shatters:
+            shatter.draw(self.screen, self.camera)
+        profiler.mark("box_draw")
+        self.draw_hint()
+        self.draw_deadlock()
+        self.draw_hud()
+        if profiler.visible:
+            profiler.draw(self.screen)
+        profiler.mark("hud")
+
+    def present_dirty(self, moving: list[Box], changed_tiles: list[GridPos]) -> None:
+        """
+        Redraw and update only the parts of the screen that changed since the last frame,
+        everything when the camera scrolled.
+        """
+        view = self.camera.view_rect().topleft
+        hud_key = (frozenset(self.player.abilities), self.player.current_ability)
+        if self.full_redraw or view != self.last_view or hud_key != self.hud_key:
+            self.draw_scene()
+            pygame.display.flip()
+            self.full_redraw = False
+            self.last_view = view
+            self.previous_rects = []
+            return
 
+        world_rects = [self.player.bounds()]
+        world_rects += [box.bounds() for box in moving]
+        world_rects += [shatter.bounds() for shatter in self.shatters]
+        world_rects += [pygame.Rect(p.x * TILE_SIZE, p.y * TILE_SIZE, TILE_SIZE, TILE_SIZE) for p in changed_tiles]
+        # inflated, the camera offset is rounded differently by apply_rect and blit
+        rects = [self.camera.apply_rect(rect).inflate(4, 4) for rect in world_rects]
+        if self.profiler.visible:
+            rects.append(self.profiler.bounds())
+
+        dirty = merge_rects(self.previous_rects + rects, self.screen.get_rect())
+        for rect in dirty:
+            self.screen.set_clip(rect)
+            self.draw_scene()
+        self.screen.set_clip(None)
+        pygame.display.update(dirty)
+        self.previous_rects = rects
 
     def draw_you_won(self) -> None:
-        font = pygame.font.Font(None, 64)
-        text = font.render("Well done!", True, (20, 20, 20))
-
-        # Center the text
-        rect = text.get_rect(center=self.screen.get_rect().center)
-
-        # --- Create a temporary surface for the rounded rectangle ---
-        padding = 20  # space around the text
-        radius = 16  # corner radius
-
-        bg_surf = pygame.Surface(
-            (rect.width + padding * 2, rect.height + padding * 2), pygame.SRCALPHA
-        )
-        bg_color = (150, 150, 150, 180)  # semi-transparent gray (A=180)
-        pygame.draw.rect(bg_surf, bg_color, bg_surf.get_rect(), border_radius=radius)
-
-        # --- Blit the background and then the text ---
-        bg_rect = bg_surf.get_rect(center=rect.center)
-        self.screen.blit(bg_surf, bg_rect.topleft)
-        self.screen.blit(text, rect.topleft)
+        panel = panels.get("Well done!", 64, (20, 20, 20))
+        self.screen.blit(panel, panel.get_rect(center=self.screen.get_rect().center))
 
     def input_direction(self) -> Vector2:
         keys = pygame.key.get_pressed()
@@ -812,115 +1951,207 @@ class Game:
                     direction.y += 1
 
         # Normalize to prevent faster diagonal movement
-        if direction.length() > 0:
-            direction = direction.normalize()
+        return input_vector(direction_of(direction))
 
-        return direction
-    async def run(self) -> None:
+    async def load_assets(self) -> None:
         # DO ALL LOADING HERE INSTEAD OF __INIT__
         if not self.initialized:
             global background, floor_normal, floor_glow, crystal_normal, crystal_glow
             global hero_down, hero_up, hero_left, hero_right
             global break_mask, ignore_mask, push_mask
-            global break_sound, push_sound, move_sound, shatter, mask_sounds
-
-            background = pygame.image.load(resource_path("assets/background.png"))
-            floor_normal = pygame.image.load(resource_path("assets/floor.png"))
-            floor_glow = pygame.image.load(resource_path("assets/floor_glow.png"))
-            crystal_normal = pygame.image.load(resource_path("assets/crystal_normal.png"))
-            crystal_glow = pygame.image.load(resource_path("assets/crystal_glow.png"))
-            await asyncio.sleep(0.1)
-            break_mask = pygame.image.load(resource_path("assets/break_mask.png"))
-            ignore_mask = pygame.image.load(resource_path("assets/ignore_mask.png"))
-            push_mask = pygame.image.load(resource_path("assets/push_mask.png"))
-            await asyncio.sleep(0.1)
-            hero_down = pygame.image.load(resource_path("assets/hero_down.png"))
-            hero_up = pygame.image.load(resource_path("assets/hero_up.png"))
-            hero_left = pygame.image.load(resource_path("assets/hero_left.png"))
-            hero_right = pygame.image.load(resource_path("assets/hero_right.png"))
-            await asyncio.sleep(0.1)
-            shatter = [
-                pygame.image.load(resource_path("assets/shatter1.png")),
-                pygame.image.load(resource_path("assets/shatter2.png")),
-                pygame.image.load(resource_path("assets/shatter3.png"))
-            ]
-
-            pygame.mixer.init()
-
-            break_sound = pygame.mixer.Sound(resource_path("assets/sound/break1.ogg"))
-            push_sound = pygame.mixer.Sound(resource_path("assets/sound/push.ogg"))
-
-            mask_sounds = [
-                pygame.mixer.Sound(resource_path("assets/sound/noMask.ogg")),
-                pygame.mixer.Sound(resource_path("assets/sound/greenMask.ogg")),
-                pygame.mixer.Sound(resource_path("assets/sound/redMask.ogg")),
-                pygame.mixer.Sound(resource_path("assets/sound/greyMask.ogg"))
-            ]
-            break_sound = pygame.mixer.Sound(resource_path("assets/sound/break1.ogg"))
-            push_sound = pygame.mixer.Sound(resource_path("assets/sound/push.ogg"))
-
-            self.music = MusicManager()
+            global shatter, sprites, panels
+
+            sprites = SpriteCache()
+            panels = PanelCache()
+
+            # the images first, they are needed for the menu level, the sounds and the music follow
+            # while the menu is already playable
+            files = sprite_files(SPRITE_NAMES) + [background_file()]
+            decoded = await self.loader.load(
+                {path: partial(self.decoded.image, path) for path in files},
+                self.draw_loading,
+            )
+            background = decoded[background_file()].convert()
+            images = cut_sprites(SPRITE_NAMES, decoded)
+            floor_normal = images["floor"]
+            floor_glow = images["floor_glow"]
+            crystal_normal = images["crystal_normal"]
+            crystal_glow = images["crystal_glow"]
+            break_mask = images["break_mask"]
+            ignore_mask = images["ignore_mask"]
+            push_mask = images["push_mask"]
+            hero_down = images["hero_down"]
+            hero_up = images["hero_up"]
+            hero_left = images["hero_left"]
+            hero_right = images["hero_right"]
+            shatter = [images["shatter1"], images["shatter2"], images["shatter3"]]
+            self.warm_sprite_cache()
+
             self.camera = Camera2D(SCREEN_SIZE[0], SCREEN_SIZE[1])
             self.restart_level()
             self.initialized = True
 
+    async def run_replay(self) -> dict[str, Any]:
+        """Play the whole recording as fast as possible, without drawing, and tell where it ended"""
+        await self.load_assets()
+        started = time.perf_counter()
+        steps = 0
+        for commands, direction in self.replay:
+            for command in commands:
+                self.execute(command)
+            self.simulate(input_vector(direction))
+            self.player.events.clear()
+            steps += 1
+        elapsed = time.perf_counter() - started
+        center = self.player.rect.center
+        return {
+            "steps": steps,
+            "game_seconds": round(steps * SIMULATION_STEP, 3),
+            "seconds": round(elapsed, 3),
+            "speedup": round(steps * SIMULATION_STEP / elapsed, 1) if elapsed else None,
+            "level": self.level_index,
+            "solved": self.level.is_solved(self.boxes),
+            "player": [center[0] // TILE_SIZE, center[1] // TILE_SIZE],
+            "ability": self.player.current_ability.name,
+        }
+
+    async def run(self) -> None:
+        if not self.initialized:
+            await self.load_assets()
+            self.loading.append(asyncio.ensure_future(self.load_sounds()))
+
         running = True
         win_state = False
         previous_ability = self.player.current_ability
+        idle = idle_drawn = False
         while running:
-            dt = self.clock.tick(60) / 1000.0
+            dt = self.clock.tick(IDLE_FPS if idle else FPS) / 1000.0
+            self.profiler.begin()
+            self.check_loading()
 
-            for event in pygame.event.get():
+            events = pygame.event.get()
+            for event in events:
                 if event.type == pygame.QUIT:
                     running = False
-                elif event.type == pygame.MOUSEBUTTONDOWN:
+                elif event.type == pygame.MOUSEBUTTONDOWN and self.replay is None:
                     if event.button == 1:  # Left click
                         if self.hud_area and self.hud_area.collidepoint(event.pos):
-                            self.player.next_ability()
+                            self.execute(Command.SWITCH)
                         if self.reset_area and self.reset_area.collidepoint(event.pos):
-                            self.restart_level()
+                            self.execute(Command.RESTART)
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE:
-                        self.player.next_ability()
-                    if event.key == pygame.K_r:
-                        self.restart_level()
+                    if event.key == pygame.K_SPACE and self.replay is None:
+                        self.execute(Command.SWITCH)
+                    if event.key == pygame.K_r and self.replay is None:
+                        self.execute(Command.RESTART)
+                    if event.key in (pygame.K_u, pygame.K_BACKSPACE) and self.replay is None:
+                        self.execute(Command.UNDO)
+                    if event.key == pygame.K_h:
+                        self.hints_on = not self.hints_on
+                        self.hint = None
+                        self.hint_request = None
+                        self.full_redraw = True
+                    if event.key == pygame.K_F3:
+                        self.profiler.visible = not self.profiler.visible
+                        self.full_redraw = True
                 if event.type == WIN_EVENT:
                     self.draw_you_won()
                     pygame.display.flip()
                     #pygame.time.delay(1000)
                     await asyncio.sleep(1.0)
-                    self.level_index = (self.level_index + 1) % len(all_levels)
-                    self.restart_level()
+                    self.execute(Command.NEXT_LEVEL)
                     win_state = False
 
 
-            self.player.update(dt, self.level, self.boxes, self.input_direction())
-            self.camera.follow(self.player.position, dt)
-
-            self.screen.blit(background, (0, 0))
-
-            self.level.draw(self.screen, self.camera)
-            for box in self.boxes:
-                box.update(dt)
-                transparency = 0.5 if self.player.current_ability == Power.IGNORE else 1
-                glow = box.grid_pos in self.level.goals
-                box.draw(self.screen, transparency, glow, self.camera)
-            for mask in self.level.masks:
-                mask.draw(self.screen, self.camera)
-            self.player.draw(self.screen, pygame.time.get_ticks()/1000.0, self.camera)
-            if not win_state and self.level.is_solved(self.boxes):
+            self.profiler.mark("events")
+
+            # the player and the crystals move in fixed steps, independent of the frame rate,
+            # they are drawn in between the last two steps
+            input_dir = self.input_direction()
+            moving = list(self.boxes.sliding)
+            # the frame after an idle one waited for the input, the new input gets no more than a step
+            self.accumulator += min(dt, SIMULATION_STEP if idle else MAX_FRAME_TIME)
+            while self.accumulator >= SIMULATION_STEP:
+                if self.replay_steps is not None:
+                    step = next(self.replay_steps, None)
+                    if step is None:
+                        running = False  # the end of the recording
+                        break
+                    commands, direction = step
+                    for command in commands:
+                        self.execute(command)
+                    input_dir = input_vector(direction)
+                self.simulate(input_dir)
+                self.accumulator -= SIMULATION_STEP
+            alpha = min(1.0, self.accumulator / SIMULATION_STEP)  # the recording can end within a frame
+            self.player.interpolate(alpha)
+            self.boxes.interpolate(alpha)
+            moving += self.boxes.sliding
+
+            changed_tiles = [GridPos(*event.pos) for event in self.player.events]
+            self.play_effects()
+            self.camera.follow(self.player.render_position, dt)
+            self.shatters = [shatter for shatter in self.shatters if shatter.update(dt)]
+            self.profiler.mark("misc")
+
+            if self.replay is not None:
+                # a recording has the change to the next level and the restarts
+                win_state = self.level.is_solved(self.boxes)
+            elif not win_state and self.level.is_solved(self.boxes):
                 win_state = True
                 pygame.time.set_timer(WIN_EVENT, 1000, loops=1)
-            self.draw_hud()
             if previous_ability != self.player.current_ability:
                 previous_ability = self.player.current_ability
-                self.music.switch_to(self.player.current_ability.value)
+                if self.music is not None:
+                    self.music.switch_to(self.player.current_ability.value)
+                self.full_redraw = True  # the crystals change their transparency
+            if self.music is not None:
+                self.music.update(dt)
+            if self.update_hint():
+                self.full_redraw = True
+                idle_drawn = False  # draw the new hint even if nothing moves
+
+            # nothing moves: slow down and draw the still picture only once
+            idle = (
+                    not events and input_dir.length_squared() == 0 and not self.boxes.sliding
+                    and not self.shatters and self.camera.settled() and not win_state
+            )
+            if not idle or IDLE_PULSE:
+                self.pulse_time += dt
+            elif idle_drawn:
+                await asyncio.sleep(0)
+                continue
+            idle_drawn = idle
 
-            pygame.display.flip()
+            if self.dirty_rects:
+                self.present_dirty(moving, changed_tiles)
+            else:
+                self.draw_scene()
+                pygame.display.flip()
+            self.profiler.mark("flip")
+            self.profiler.end()
             await asyncio.sleep(0)
 
+        if self.profile_out:
+            self.profiler.dump(self.profile_out)
+        if self.recorder is not None:
+            self.recorder.save(self.record_path)
+        self.hint_engine.close()
+        self.analyses.close()
         pygame.quit()
 
 
+def option(name: str, default: str | None = None) -> str | None:
+    """The value after --name on the command line"""
+    if name in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
 if __name__ == "__main__":
-    asyncio.run(Game().run())
+    multiprocessing.freeze_support()  # the hint worker process of the windows build
+    asyncio.run(Game(
+        dirty_rects=DIRTY_RECTS or "--dirty-rects" in sys.argv,
+        profile_out=option("--profile-out", PROFILE_OUT),
+        record=option("--record"),
+    ).run())
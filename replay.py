@@ -0,0 +1,141 @@
+"""
+Input recordings of game sessions.
+
+The recorder stores the input of every simulation step of main.py (the direction of
+Game.input_direction) and the commands of the space and R keys and the mouse clicks on the HUD.
+The movement runs in fixed steps, so playing the same input from the same level gives the same
+game, on any computer and at any frame rate.
+
+The file is a header and a list of 3 byte records (tag, count). The directions are run length
+encoded: a tag 0-8 is a direction held for count steps, a tag 16 and above is a command.
+
+usage: python replay.py session.rec [--headless]
+       (record with python main.py --record session.rec)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import struct
+import sys
+from enum import Enum
+from typing import Iterator
+
+HEADER = struct.Struct("<4sBBf")  # magic, version, level index, simulation step in seconds
+RECORD = struct.Struct("<BH")  # tag, count
+MAGIC: bytes = b"MZRP"
+VERSION: int = 1
+COMMAND_TAG: int = 16
+MAX_RUN: int = 0xFFFF
+
+Direction = tuple[int, int]  # -1, 0 or 1 per axis
+
+
+class Command(Enum):
+    SWITCH = 0  # next ability, space or a click on the HUD
+    RESTART = 1  # R or a click on the reset button
+    NEXT_LEVEL = 2  # after solving a level
+    UNDO = 3  # U or backspace
+
+
+def direction_tag(direction: Direction) -> int:
+    return (direction[0] + 1) * 3 + direction[1] + 1
+
+
+def tag_direction(tag: int) -> Direction:
+    return tag // 3 - 1, tag % 3 - 1
+
+
+class InputRecorder:
+    def __init__(self, level_index: int, step: float) -> None:
+        self.level_index = level_index
+        self.step_time = step
+        self.records = bytearray()
+        self.run_tag = -1
+        self.run_length = 0
+        self.steps = 0
+
+    def _flush(self) -> None:
+        if self.run_length:
+            self.records += RECORD.pack(self.run_tag, self.run_length)
+        self.run_length = 0
+
+    def step(self, direction: Direction) -> None:
+        """The direction of one simulation step"""
+        tag = direction_tag(direction)
+        if tag != self.run_tag or self.run_length == MAX_RUN:
+            self._flush()
+            self.run_tag = tag
+        self.run_length += 1
+        self.steps += 1
+
+    def command(self, command: Command) -> None:
+        """A command before the next step"""
+        self._flush()
+        self.records += RECORD.pack(COMMAND_TAG + command.value, 1)
+
+    def to_bytes(self) -> bytes:
+        self._flush()
+        return HEADER.pack(MAGIC, VERSION, self.level_index, self.step_time) + bytes(self.records)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+class InputReplay:
+    """The steps of a recording, each with the commands that came before it"""
+
+    def __init__(self, data: bytes) -> None:
+        magic, version, self.level_index, self.step_time = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a recording of version {VERSION}")
+        self.records = [RECORD.unpack_from(data, offset) for offset in range(HEADER.size, len(data), RECORD.size)]
+        self.steps = sum(count for tag, count in self.records if tag < COMMAND_TAG)
+
+    @classmethod
+    def load(cls, path: str) -> InputReplay:
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    def __iter__(self) -> Iterator[tuple[list[Command], Direction]]:
+        commands = []
+        for tag, count in self.records:
+            if tag >= COMMAND_TAG:
+                commands.extend([Command(tag - COMMAND_TAG)] * count)
+                continue
+            direction = tag_direction(tag)
+            for _ in range(count):
+                yield commands, direction
+                commands = []
+        if commands:
+            # commands after the last step
+            yield commands, (0, 0)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Play a recorded game session")
+    parser.add_argument("recording")
+    parser.add_argument("--headless", action="store_true",
+                        help="no window and no sound, as fast as possible, prints where the session ended")
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    import asyncio
+    # the classes of the replay module main.py uses, not those of __main__
+    from main import Game, InputReplay as Replay
+
+    replay = Replay.load(args.recording)
+    game = Game(replay=replay)
+    if args.headless:
+        print(json.dumps(asyncio.run(game.run_replay()), indent=2))
+    else:
+        asyncio.run(game.run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
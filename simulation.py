@@ -0,0 +1,292 @@
+"""
+Headless game rules without pygame.
+
+The game in main.py moves the player smoothly, here the player moves a whole tile per step along
+one axis. Apart from that the rules are the same as for Player, Box and Mask:
+- walls block the player and the crystals
+- with the push mask the player pushes a crystal one tile, if the tile behind it is free
+- with the break mask the player shatters the crystal in front (and does not move)
+- with the ignore mask the player walks through crystals
+- without a mask crystals block the player
+- walking over a mask picks it up and makes it the current ability
+- space cycles through the collected abilities
+- the level is solved when every goal is covered by a crystal
+
+The player of the game also walks diagonally. Walking diagonally reaches the same tiles as steps
+along the axes, but a crystal is pushed in the direction of the input: walking down and right
+into a crystal pushes it one tile down and one to the right, past the corners of walls and other
+crystals, only the tile it ends on has to be free. The center of the player goes into the tile of
+the crystal over one of its sides, so the player stands next to it along an axis. A diagonal
+action is that step along an axis with the other direction held too: DOWN_RIGHT steps down from
+the tile above the crystal, RIGHT_DOWN steps right from the tile left of it. Without a crystal to
+push it is the same as the step along the axis.
+
+Two cases of the game are not actions here:
+- the center going exactly over the corner of its tile into the diagonal neighbour, that needs a
+  position aligned with the corner to the pixel
+- walking diagonally past the corner of two crystals, that needs the same; past a wall the rect of
+  the player touches it and is blocked
+
+This is used for automated testing, solvers and batch analysis, it is deterministic and
+does not need a display.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from enum import Enum
+
+Pos = tuple[int, int]
+
+
+class Power(Enum):
+    NONE = 0
+    PUSH = 1
+    BREAK = 2
+    IGNORE = 3
+
+
+MASK_POWERS: dict[str, Power] = {"P": Power.PUSH, "B": Power.BREAK, "I": Power.IGNORE}
+
+
+def next_ability(abilities: set[Power], current: Power) -> Power:
+    """The ability after the current one among the collected ones, wrapping around"""
+    for i in range(current.value + 1, current.value + 5):
+        if Power(i % 4) in abilities:
+            return Power(i % 4)
+    return current
+
+
+class Action(Enum):
+    # the step of the player and, for the diagonal actions, the other direction held
+    UP = (0, -1)
+    DOWN = (0, 1)
+    LEFT = (-1, 0)
+    RIGHT = (1, 0)
+    SWITCH = (0, 0)
+    UP_LEFT = (0, -1, -1)
+    UP_RIGHT = (0, -1, 1)
+    DOWN_LEFT = (0, 1, -1)
+    DOWN_RIGHT = (0, 1, 1)
+    LEFT_UP = (-1, 0, -1)
+    LEFT_DOWN = (-1, 0, 1)
+    RIGHT_UP = (1, 0, -1)
+    RIGHT_DOWN = (1, 0, 1)
+
+    @property
+    def step(self) -> Pos:
+        """Where the player goes"""
+        return self.value[0], self.value[1]
+
+    @property
+    def push(self) -> Pos:
+        """Where a crystal the player walks into goes, the direction of the input"""
+        if len(self.value) == 2:
+            return self.value
+        dx, dy, side = self.value
+        return (side, dy) if dx == 0 else (dx, side)
+
+
+MOVES: tuple[Action, ...] = (Action.UP, Action.DOWN, Action.LEFT, Action.RIGHT)
+DIAGONALS: tuple[Action, ...] = (
+    Action.UP_LEFT, Action.UP_RIGHT, Action.DOWN_LEFT, Action.DOWN_RIGHT,
+    Action.LEFT_UP, Action.LEFT_DOWN, Action.RIGHT_UP, Action.RIGHT_DOWN,
+)
+PUSHES: tuple[Action, ...] = MOVES + DIAGONALS  # every way to push a crystal
+
+
+class EventKind(Enum):
+    MOVE = 0
+    BLOCKED = 1
+    PUSH = 2
+    BREAK = 3
+    PICKUP = 4
+    SWITCH = 5
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    kind: EventKind
+    pos: Pos | None = None
+    power: Power | None = None
+    source: Pos | None = None  # the tile a pushed crystal came from
+
+
+# ============================
+# Level parsing
+# ============================
+
+@dataclass(slots=True)
+class LevelData:
+    """The content of a level string, see levels.py for the format"""
+    walls: set[Pos] = field(default_factory=set)
+    goals: set[Pos] = field(default_factory=set)
+    floors: set[Pos] = field(default_factory=set)
+    boxes: set[Pos] = field(default_factory=set)
+    masks: dict[Pos, Power] = field(default_factory=dict)
+    texts: list[tuple[Pos, str]] = field(default_factory=list)
+    player: Pos | None = None
+
+    @property
+    def width(self) -> int:
+        return max((x for x, _ in self.walls | self.floors | self.goals), default=-1) + 1
+
+    @property
+    def height(self) -> int:
+        return max((y for _, y in self.walls | self.floors | self.goals), default=-1) + 1
+
+
+def parse_level(level: str) -> LevelData:
+    data = LevelData()
+    rows = [row.rstrip("\n") for row in level.strip("\n").splitlines()]
+
+    for y, row in enumerate(rows):
+        row, text_x, text = (row.split("_", 2) + [None, None])[:3]
+        if text and text_x:
+            data.texts.append(((int(text_x), y), text))
+        for x, ch in enumerate(row):
+            pos = (x, y)
+
+            match ch:
+                case "#":  # wall
+                    data.walls.add(pos)
+
+                case ".":  # goal
+                    data.goals.add(pos)
+
+                case "$":  # box
+                    data.boxes.add(pos)
+                    data.floors.add(pos)
+
+                case "@":  # player
+                    data.player = pos
+                    data.floors.add(pos)
+
+                case "*":  # box on goal
+                    data.boxes.add(pos)
+                    data.goals.add(pos)
+
+                case "+":  # player on goal
+                    data.player = pos
+                    data.goals.add(pos)
+
+                case "P" | "B" | "I":  # masks
+                    data.floors.add(pos)
+                    data.masks[pos] = MASK_POWERS[ch]
+
+                case " ":  # floor
+                    data.floors.add(pos)
+
+    return data
+
+
+# ============================
+# Game state
+# ============================
+
+@dataclass(slots=True)
+class GameState:
+    walls: frozenset[Pos]
+    goals: frozenset[Pos]
+    boxes: set[Pos]
+    masks: dict[Pos, Power]
+    player: Pos
+    abilities: set[Power] = field(default_factory=lambda: {Power.NONE})
+    current_ability: Power = Power.NONE
+    covered_goals: int = 0
+
+    @classmethod
+    def from_level(cls, level: str | LevelData) -> GameState:
+        data = parse_level(level) if isinstance(level, str) else level
+        if data.player is None:
+            raise ValueError("level has no player")
+        return cls(
+            walls=frozenset(data.walls),
+            goals=frozenset(data.goals),
+            boxes=set(data.boxes),
+            masks=dict(data.masks),
+            player=data.player,
+            covered_goals=len(data.boxes & data.goals),
+        )
+
+    def copy(self) -> GameState:
+        return GameState(
+            self.walls, self.goals, set(self.boxes), dict(self.masks), self.player,
+            set(self.abilities), self.current_ability, self.covered_goals,
+        )
+
+    def key(self) -> tuple:
+        """Hashable summary of everything that changes during a level"""
+        return (
+            self.player,
+            frozenset(self.boxes),
+            frozenset(self.masks),
+            frozenset(self.abilities),
+            self.current_ability,
+        )
+
+    def is_solved(self) -> bool:
+        return self.covered_goals == len(self.goals)
+
+    # ----------------------------
+
+    def move_box(self, box: Pos, target: Pos) -> None:
+        self.remove_box(box)
+        self.boxes.add(target)
+        self.covered_goals += target in self.goals
+
+    def remove_box(self, box: Pos) -> None:
+        self.boxes.remove(box)
+        self.covered_goals -= box in self.goals
+
+    def pickup_mask(self, pos: Pos) -> Power:
+        power = self.masks.pop(pos)
+        self.abilities.add(power)
+        self.current_ability = power
+        return power
+
+    def switch_ability(self) -> None:
+        self.current_ability = next_ability(self.abilities, self.current_ability)
+
+    def step(self, action: Action) -> list[Event]:
+        """Apply one action and return what happened, e.g. to play sounds"""
+        if action == Action.SWITCH:
+            self.switch_ability()
+            return [Event(EventKind.SWITCH, self.player, self.current_ability)]
+
+        dx, dy = action.step
+        px, py = self.player
+        target = (px + dx, py + dy)
+
+        if target in self.walls:
+            return [Event(EventKind.BLOCKED, target)]
+
+        events = []
+        if self.current_ability != Power.IGNORE:
+            # like Player.update, a crystal under the player (left there by ignoring it) is hit first
+            box = self.player if self.player in self.boxes else target if target in self.boxes else None
+            if box is not None:
+                if self.current_ability == Power.BREAK:
+                    self.remove_box(box)
+                    return [Event(EventKind.BREAK, box)]
+                if self.current_ability != Power.PUSH:
+                    return [Event(EventKind.BLOCKED, box)]
+                push_x, push_y = action.push
+                box_target = (box[0] + push_x, box[1] + push_y)
+                if box_target in self.walls or box_target in self.boxes:
+                    return [Event(EventKind.BLOCKED, box)]
+                self.move_box(box, box_target)
+                events.append(Event(EventKind.PUSH, box_target, source=box))
+                if box == self.player:
+                    return events
+
+        self.player = target
+        events.append(Event(EventKind.MOVE, target))
+        if target in self.masks:
+            events.append(Event(EventKind.PICKUP, target, self.pickup_mask(target)))
+        return events
+
+    def run(self, actions: list[Action]) -> list[Event]:
+        events = []
+        for action in actions:
+            events.extend(self.step(action))
+        return events
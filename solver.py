@@ -0,0 +1,471 @@
+"""
+Solver for the level format of levels.py, including the PUSH, BREAK and IGNORE masks.
+
+A* search over "macro moves": the player switches the ability, walks (ignoring the crystals if
+that mask was collected), switches again and then pushes a crystal (along an axis or diagonally,
+see simulation.py), breaks a crystal or picks up a mask. A search state is the set of crystals,
+the player region, the remaining masks and the collected abilities, the current ability only
+decides how many switches the next macro move needs. Crystals and masks are bitboards (see
+bitboard.py), states are identified by a Zobrist hash and the transposition table is bounded by
+a memory limit.
+
+The number of actions (pushes, breaks, pickups and switches) is minimised first and the walking
+distance second. By default the heuristic is weighted so every level is solved in a few seconds,
+--weight 1 gives the shortest solutions. Solutions are returned as the single tile actions of
+simulation.py, written as letters (see ACTION_LETTERS).
+
+usage: python solver.py [level index ...]
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import random
+import re
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from bitboard import BitState, Board, indices
+from simulation import MOVES, PUSHES, Action, GameState, LevelData, Power, next_ability
+
+# actions and walking steps are packed into one integer cost, actions first
+ACTION_COST: int = 1 << 20
+
+# approximate size of a search node with its transposition table entry, used for the memory limit
+NODE_BYTES: int = 300
+
+DIRECTIONS: tuple[tuple[Action, int, int], ...] = tuple((a, a.step[0], a.step[1]) for a in MOVES)
+# a diagonal push is the letter of the step and the other direction in upper case
+ACTION_LETTERS: dict[Action, str] = {
+    Action.UP: "u", Action.DOWN: "d", Action.LEFT: "l", Action.RIGHT: "r", Action.SWITCH: "s",
+    Action.UP_LEFT: "uL", Action.UP_RIGHT: "uR", Action.DOWN_LEFT: "dL", Action.DOWN_RIGHT: "dR",
+    Action.LEFT_UP: "lU", Action.LEFT_DOWN: "lD", Action.RIGHT_UP: "rU", Action.RIGHT_DOWN: "rD",
+}
+
+PUSH = Power.PUSH.value
+BREAK = Power.BREAK.value
+IGNORE = Power.IGNORE.value
+
+
+def _switch_counts() -> list[list[list[int]]]:
+    """[abilities bit set][current][target] -> presses of space, -1 if the target was not collected"""
+    table = []
+    for abilities in range(16):
+        powers = {Power(v) for v in range(4) if abilities >> v & 1}
+        rows = []
+        for current in range(4):
+            row = [-1] * 4
+            power, presses = Power(current), 0
+            while presses < 4 and row[power.value] < 0:
+                if power in powers:
+                    row[power.value] = presses
+                power = next_ability(powers | {Power(current)}, power)
+                presses += 1
+            rows.append(row)
+        table.append(rows)
+    return table
+
+
+SWITCHES = _switch_counts()
+
+
+def format_moves(moves: list[Action]) -> str:
+    return "".join(ACTION_LETTERS[m] for m in moves)
+
+
+def parse_moves(text: str) -> list[Action]:
+    letters = {letter: action for action, letter in ACTION_LETTERS.items()}
+    return [letters[letter] for letter in re.findall(r"[udlrs][UDLR]?", text)]
+
+
+@dataclass(slots=True)
+class SolveResult:
+    solved: bool
+    moves: list[Action] = field(default_factory=list)
+    pushes: int = 0
+    expanded: int = 0
+    elapsed: float = 0.0
+    # "solved", "unsolvable", "memory limit" or "time limit"
+    status: str = "solved"
+
+    @property
+    def solution(self) -> str:
+        return format_moves(self.moves)
+
+
+@dataclass(slots=True)
+class Node:
+    boxes: int  # bitboard
+    masks: int  # bitboard
+    abilities: int  # bit set of Power values
+    current: int  # Power value
+    player: int
+    g: int
+    box_hash: int
+    parent: Node | None = None
+    # how this node was reached from the parent:
+    # switches, walk (ignoring crystals or not) to a tile, switches, then one step in a direction
+    via: tuple[int, bool, int, int, Action] | None = None
+
+
+class Solver:
+    def __init__(
+            self,
+            level: str | LevelData,
+            memory_limit_mb: float = 256.0,
+            time_limit: float = 60.0,
+            weight: float = 5.0,
+            seed: int = 0,
+            start: BitState | None = None,
+    ) -> None:
+        """
+        weight > 1 makes the search greedier: faster, but the solutions may be longer than necessary,
+        start is a state of the level to solve from instead of its start, e.g. for hints
+        """
+        self.board, self.start = Board.from_level(level)
+        if start is not None:
+            self.start = start
+        self.width = self.board.width
+        self.height = self.board.height
+        size = self.width * self.height
+        self.goals = self.board.goals
+        self.mask_powers = {i: power.value for i, power in self.board.mask_powers.items()}
+        self.free_pushes = self.board.free_pushes
+        self.max_states = int(memory_limit_mb * 1024 * 1024 / NODE_BYTES)
+        self.time_limit = time_limit
+        self.weight = weight
+
+        # for every tile: (action, neighbour) of the neighbours that are not walls
+        self.neighbours: list[tuple[tuple[Action, int], ...]] = []
+        for i in range(size):
+            x, y = i % self.width, i // self.width
+            self.neighbours.append(tuple(
+                (action, self.index(x + dx, y + dy))
+                for action, dx, dy in DIRECTIONS if not self.is_wall(x + dx, y + dy)
+            ))
+
+        # for every tile: (action, neighbour, tile the crystal there goes to or -1, tile a crystal
+        # on the tile itself goes to or -1) of the pushes with the step to a neighbour that is not a wall
+        self.pushes: list[tuple[tuple[Action, int, int, int], ...]] = []
+        for i in range(size):
+            x, y = i % self.width, i // self.width
+            self.pushes.append(tuple(
+                (action, self.index(x + dx, y + dy), self.tile(x + dx + px, y + dy + py), self.tile(x + px, y + py))
+                for action, (dx, dy), (px, py) in ((a, a.step, a.push) for a in PUSHES)
+                if not self.is_wall(x + dx, y + dy)
+            ))
+
+        # minimal number of pushes to get a crystal from a tile to a goal, ignoring the other crystals
+        self.push_distance = {g: self.pull_distances(g) for g in indices(self.goals)}
+        # crystals on the other tiles can never reach a goal, the same tiles as in the deadlock warnings
+        self.live = self.board.live_squares()
+
+        # Zobrist keys
+        rng = random.Random(seed)
+        self.z_box = [rng.getrandbits(64) for _ in range(size)]
+        self.z_mask = [rng.getrandbits(64) for _ in range(size)]
+        self.z_player = [rng.getrandbits(64) for _ in range(size)]
+        self.z_ability = [rng.getrandbits(64) for _ in range(16)]
+
+    def index(self, x: int, y: int) -> int:
+        return y * self.width + x
+
+    def is_wall(self, x: int, y: int) -> bool:
+        return not (0 <= x < self.width and 0 <= y < self.height) or bool(self.board.walls >> self.index(x, y) & 1)
+
+    def tile(self, x: int, y: int) -> int:
+        """The index of a tile, -1 for walls and outside"""
+        return -1 if self.is_wall(x, y) else self.index(x, y)
+
+    def pull_distances(self, goal: int) -> dict[int, int]:
+        """Pull a crystal backwards from the goal, the player needs room behind it unless it can stand on it"""
+        distances = {goal: 0}
+        queue = deque([goal])
+        while queue:
+            i = queue.popleft()
+            x, y = i % self.width, i // self.width
+            for action in PUSHES:
+                # the crystal came from x - push, the player stood a step before that
+                (dx, dy), (px, py) = action.step, action.push
+                if self.is_wall(x - px, y - py) or (
+                        not self.free_pushes and self.is_wall(x - px - dx, y - py - dy)):
+                    continue
+                j = self.index(x - px, y - py)
+                if j not in distances:
+                    distances[j] = distances[i] + 1
+                    queue.append(j)
+        return distances
+
+    # ----------------------------
+
+    def start_node(self) -> Node:
+        start = self.start
+        box_hash = 0
+        for b in indices(start.boxes):
+            box_hash ^= self.z_box[b]
+        for m in indices(start.masks):
+            box_hash ^= self.z_mask[m]
+        return Node(start.boxes, start.masks, start.abilities, start.current, start.player, 0, box_hash)
+
+    def region(self, node: Node, ignore: bool) -> dict[int, int]:
+        """
+        Walking distance to every tile the player reaches without anything happening,
+        in the order of the distance
+        """
+        boxes, masks = node.boxes, node.masks
+        dist = {node.player: 0}
+        queue = deque([node.player])
+        while queue:
+            i = queue.popleft()
+            d = dist[i] + 1
+            for _, j in self.neighbours[i]:
+                if j not in dist and not masks >> j & 1 and (ignore or not boxes >> j & 1):
+                    dist[j] = d
+                    queue.append(j)
+        return dist
+
+    def path(self, node: Node, target: int, ignore: bool) -> list[Action]:
+        """Walking actions from the player position of node to target"""
+        parents: dict[int, tuple[int, Action] | None] = {node.player: None}
+        queue = deque([node.player])
+        while queue:
+            i = queue.popleft()
+            if i == target:
+                break
+            for action, j in self.neighbours[i]:
+                if j not in parents and not node.masks >> j & 1 and (ignore or not node.boxes >> j & 1):
+                    parents[j] = (i, action)
+                    queue.append(j)
+        actions = []
+        while parents[target] is not None:
+            target, action = parents[target]
+            actions.append(action)
+        actions.reverse()
+        return actions
+
+    def state_hash(self, node: Node) -> int:
+        # with the ignore mask the player can walk everywhere, otherwise the crystals separate regions
+        region = self.board.reachable(BitState(node.boxes, node.masks, node.player),
+                                      ignore=bool(node.abilities >> IGNORE & 1))
+        return node.box_hash ^ self.z_player[(region & -region).bit_length() - 1] ^ self.z_ability[node.abilities]
+
+    def heuristic(self, boxes: int) -> int:
+        """Each uncovered goal needs at least as many pushes as the closest crystal is away from it"""
+        h = 0
+        crystals = indices(boxes & self.live)
+        for g, distances in self.push_distance.items():
+            if not boxes >> g & 1:
+                h += min((distances[b] for b in crystals if b in distances), default=0)
+        return h
+
+    def is_dead(self, node: Node) -> bool:
+        """Not enough crystals left that can still reach a goal"""
+        return (node.boxes & self.live).bit_count() < self.goals.bit_count()
+
+    # ----------------------------
+
+    def successors(self, node: Node) -> list[Node]:
+        abilities, current = node.abilities, node.current
+        switches = SWITCHES[abilities][current]
+        walk = self.region(node, ignore=False)
+        walk_ignoring = self.region(node, ignore=True) if abilities >> IGNORE & 1 else {}
+        to_ignore = switches[IGNORE]
+        from_ignore = SWITCHES[abilities][IGNORE]
+
+        # cheapest way to stand on a tile with an ability (None: any ability will do)
+        # returns (cost, switches before, ignoring, switches after)
+        def approach(q: int, power: int | None) -> tuple[int, int, bool, int] | None:
+            best = None
+            if q in walk:
+                presses = 0 if power is None else switches[power]
+                best = (ACTION_COST * presses + walk[q], presses, False, 0)
+            # after switching on top of a crystal the player would hit that one first
+            if q in walk_ignoring and (power is None or not node.boxes >> q & 1):
+                after = 0 if power is None else from_ignore[power]
+                cost = ACTION_COST * (to_ignore + after) + walk_ignoring[q]
+                if best is None or cost < best[0]:
+                    best = (cost, to_ignore, True, after)
+            return best
+
+        # one child per distinct result, reached the cheapest way
+        children: dict[tuple[int, int], Node] = {}
+
+        def add(key: tuple[int, int], child: Node) -> None:
+            if key not in children or child.g < children[key].g:
+                children[key] = child
+
+        for q in walk_ignoring or walk:
+            if node.boxes >> q & 1:
+                # the player stands on a crystal: after switching, the crystal underneath is hit first
+                for power in (PUSH, BREAK):
+                    if not abilities >> power & 1 or not self.pushes[q]:
+                        continue
+                    cost = ACTION_COST * (to_ignore + from_ignore[power] + 1) + walk_ignoring[q]
+                    if power == BREAK:
+                        via = (to_ignore, True, q, from_ignore[power], self.pushes[q][0][0])
+                        add((q, -1), Node(
+                            node.boxes & ~(1 << q), node.masks, abilities, BREAK, q,
+                            node.g + cost, node.box_hash ^ self.z_box[q], node, via))
+                        continue
+                    for action, _, _, own in self.pushes[q]:
+                        if own >= 0 and not node.boxes >> own & 1:
+                            via = (to_ignore, True, q, from_ignore[power], action)
+                            add((q, own), Node(
+                                node.boxes & ~(1 << q) | 1 << own, node.masks, abilities, PUSH, q,
+                                node.g + cost, node.box_hash ^ self.z_box[q] ^ self.z_box[own], node, via))
+
+            for action, t in self.neighbours[q]:
+                if node.masks >> t & 1:
+                    if node.boxes >> t & 1:
+                        continue
+                    # walk onto the mask, with whatever ability
+                    way = approach(q, None)
+                    if way is None:
+                        continue
+                    cost, before, ignoring, after = way
+                    power = self.mask_powers[t]
+                    add((t, -1), Node(
+                        node.boxes, node.masks & ~(1 << t), abilities | (1 << power), power, t,
+                        node.g + cost + ACTION_COST, node.box_hash ^ self.z_mask[t], node,
+                        (before, ignoring, q, after, action)))
+                    continue
+
+                if node.boxes >> t & 1 and abilities >> BREAK & 1:
+                    way = approach(q, BREAK)
+                    if way is not None:
+                        cost, before, ignoring, after = way
+                        add((t, -1), Node(
+                            node.boxes & ~(1 << t), node.masks, abilities, BREAK, q,
+                            node.g + cost + ACTION_COST, node.box_hash ^ self.z_box[t], node,
+                            (before, ignoring, q, after, action)))
+
+            if not abilities >> PUSH & 1:
+                continue
+            for action, t, behind, _ in self.pushes[q]:
+                if not node.boxes >> t & 1 or behind < 0 or node.boxes >> behind & 1:
+                    continue
+                way = approach(q, PUSH)
+                if way is None:
+                    continue
+                cost, before, ignoring, after = way
+                box_hash = node.box_hash ^ self.z_box[t] ^ self.z_box[behind]
+                masks, new_abilities, new_current = node.masks, abilities, PUSH
+                if masks >> t & 1:
+                    # the crystal was standing on a mask, the player picks it up
+                    new_current = self.mask_powers[t]
+                    masks = masks & ~(1 << t)
+                    new_abilities |= 1 << new_current
+                    box_hash ^= self.z_mask[t]
+                add((t, behind), Node(
+                    node.boxes & ~(1 << t) | 1 << behind, masks, new_abilities, new_current, t,
+                    node.g + cost + ACTION_COST, box_hash, node,
+                    (before, ignoring, q, after, action)))
+
+        return list(children.values())
+
+    def solve(self) -> SolveResult:
+        return next(result for result in self.search() if result is not None)
+
+    def search(self, pause_every: int = 0) -> Iterator[SolveResult | None]:
+        """
+        The search of solve(), it yields None after every pause_every expanded nodes so it can run
+        in slices, and the result at the end
+        """
+        started = time.perf_counter()
+        start = self.start_node()
+        best: dict[int, int] = {self.state_hash(start): 0}
+        counter = 0
+        heap = [(self.weight * ACTION_COST * self.heuristic(start.boxes), 0, counter, start)]
+        expanded = 0
+
+        while heap:
+            _, neg_g, _, node = heapq.heappop(heap)
+            if best.get(self.state_hash(node), -neg_g) < -neg_g:
+                continue  # a shorter way to this state was found meanwhile
+            if self.goals & ~node.boxes == 0:
+                yield self.result(node, expanded, started)
+                return
+
+            expanded += 1
+            if expanded % 256 == 0 and time.perf_counter() - started > self.time_limit:
+                yield SolveResult(False, expanded=expanded, elapsed=time.perf_counter() - started,
+                                  status="time limit")
+                return
+            if pause_every and expanded % pause_every == 0:
+                yield None
+
+            for child in self.successors(node):
+                if self.is_dead(child):
+                    continue
+                key = self.state_hash(child)
+                if best.get(key, child.g + 1) <= child.g:
+                    continue
+                if len(best) >= self.max_states:
+                    yield SolveResult(False, expanded=expanded, elapsed=time.perf_counter() - started,
+                                      status="memory limit")
+                    return
+                best[key] = child.g
+                counter += 1
+                f = child.g + self.weight * ACTION_COST * self.heuristic(child.boxes)
+                # among equally promising nodes prefer the deeper ones
+                heapq.heappush(heap, (f, -child.g, counter, child))
+
+        yield SolveResult(False, expanded=expanded, elapsed=time.perf_counter() - started, status="unsolvable")
+
+    def result(self, node: Node, expanded: int, started: float) -> SolveResult:
+        chain = []
+        while node.parent is not None:
+            chain.append(node)
+            node = node.parent
+        moves: list[Action] = []
+        pushes = 0
+        for child in reversed(chain):
+            before, ignoring, q, after, action = child.via
+            moves.extend([Action.SWITCH] * before)
+            moves.extend(self.path(child.parent, q, ignoring))
+            moves.extend([Action.SWITCH] * after)
+            moves.append(action)
+            pushes += child.boxes.bit_count() == child.parent.boxes.bit_count() and child.boxes != child.parent.boxes
+        return SolveResult(True, moves, pushes, expanded, time.perf_counter() - started)
+
+
+def solve(level: str | LevelData, **limits) -> SolveResult:
+    return Solver(level, **limits).solve()
+
+
+def verify(level: str | LevelData, moves: list[Action]) -> bool:
+    """Replay moves in the simulation and check that they solve the level"""
+    state = GameState.from_level(level)
+    state.run(moves)
+    return state.is_solved()
+
+
+def main(argv: list[str] | None = None) -> int:
+    from levels import all_levels
+
+    parser = argparse.ArgumentParser(description="Solve the levels of levels.py")
+    parser.add_argument("levels", nargs="*", type=int, help="indices into all_levels (default: all)")
+    parser.add_argument("--memory", type=float, default=256.0, help="memory limit in MB")
+    parser.add_argument("--time", type=float, default=60.0, help="time limit per level in seconds")
+    parser.add_argument("--weight", type=float, default=5.0,
+                        help="heuristic weight, 1 finds the shortest solutions but is slow")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for i in args.levels or range(len(all_levels)):
+        result = solve(all_levels[i], memory_limit_mb=args.memory, time_limit=args.time, weight=args.weight)
+        print(f"level {i}: {result.status} in {result.elapsed:.2f}s, {result.expanded} states expanded")
+        if result.solved and verify(all_levels[i], result.moves):
+            print(f"  {len(result.moves)} moves, {result.pushes} pushes: {result.solution}")
+        else:
+            if result.solved:
+                print("  the solution does not replay in the simulation")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
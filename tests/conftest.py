@@ -0,0 +1,21 @@
+"""The modules of the game are in the folder above, run the tests from there with python -m pytest"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from levels import all_levels  # noqa: E402
+from solver import solve  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def solutions():
+    """The solution of every shipped level, solved once for all the tests"""
+    result = []
+    for level in all_levels:
+        solved = solve(level, time_limit=60.0)
+        assert solved.solved, solved.status
+        result.append(solved.moves)
+    return result
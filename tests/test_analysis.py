@@ -0,0 +1,108 @@
+import os
+
+import analysis
+from analysis import DATA_MAGIC, HEADER, Analysis, AnalysisCache, analyze
+from levels import all_levels
+
+LEVEL = all_levels[1]
+
+
+def test_put_and_get(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    assert cache.get(LEVEL) is None
+    entry = analyze(LEVEL)
+    assert entry.solved
+    cache.put(LEVEL, entry)
+    assert cache.get(LEVEL) == entry
+    cache.close()
+
+    # the files are mapped when the cache opens
+    again = AnalysisCache(str(tmp_path))
+    assert len(again) == 1
+    assert again.get(LEVEL) == entry
+    # the line endings and the empty lines around a level do not change it
+    assert again.get("\r\n" + LEVEL.strip("\n").replace("\n", "\r\n") + "\r\n\r\n") == entry
+    again.close()
+
+
+def test_changed_level_is_not_found(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put(LEVEL, analyze(LEVEL))
+    assert cache.get(LEVEL.replace("$", " ", 1)) is None
+    cache.close()
+
+
+def test_new_analysis_version_is_not_found(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put(LEVEL, analyze(LEVEL))
+    cache.close()
+    monkeypatch.setattr(analysis, "ANALYSIS_VERSION", analysis.ANALYSIS_VERSION + 1)
+    assert AnalysisCache(str(tmp_path)).get(LEVEL) is None
+
+
+def test_limits_are_not_cached(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put(LEVEL, Analysis(status="time limit"))
+    assert cache.get(LEVEL) is None
+    assert not os.path.exists(tmp_path / "analysis.dat")
+
+
+def test_record_cut_short_is_left_out(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put(LEVEL, analyze(LEVEL))
+    cache.put(all_levels[2], analyze(all_levels[2]))
+    cache.close()
+    with open(tmp_path / "analysis.idx", "r+b") as index:
+        index.truncate(os.path.getsize(tmp_path / "analysis.idx") - 1)
+    again = AnalysisCache(str(tmp_path))
+    assert again.get(LEVEL) is not None
+    assert again.get(all_levels[2]) is None
+    again.close()
+
+
+def write_stale(directory) -> None:
+    """Files of another format"""
+    cache = AnalysisCache(str(directory))
+    cache.put(LEVEL, analyze(LEVEL))
+    cache.close()
+    with open(directory / "analysis.dat", "r+b") as data:
+        data.write(HEADER.pack(DATA_MAGIC, 999))
+
+
+def test_stale_files_are_started_over(tmp_path):
+    write_stale(tmp_path)
+    cache = AnalysisCache(str(tmp_path))
+    assert cache.get(LEVEL) is None
+    assert not os.listdir(tmp_path)
+    entry = analyze(LEVEL)
+    cache.put(LEVEL, entry)
+    cache.close()
+    assert AnalysisCache(str(tmp_path)).get(LEVEL) == entry
+
+
+def test_read_only_leaves_files_alone(tmp_path):
+    write_stale(tmp_path)
+    before = {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)}
+    cache = AnalysisCache(str(tmp_path), read_only=True)
+    assert cache.get(LEVEL) is None
+    cache.put(LEVEL, analyze(LEVEL))
+    assert {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)} == before
+
+
+def test_no_directory():
+    cache = AnalysisCache(None)
+    cache.put(LEVEL, analyze(LEVEL))
+    assert cache.get(LEVEL) is None
+
+
+def test_weight_is_part_of_the_key(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    weighted = analyze(LEVEL)
+    optimal = analyze(LEVEL, weight=1.0)
+    assert optimal.weight == 1.0 and optimal.moves <= weighted.moves
+    cache.put(LEVEL, optimal)
+    assert cache.get(LEVEL) is None
+    assert cache.get(LEVEL, weight=1.0) == optimal
+    cache.put(LEVEL, weighted)
+    assert cache.get(LEVEL) == weighted
+    cache.close()
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from bitboard import BitState, Board, indices
+from levels import all_levels
+from simulation import Action, EventKind, GameState
+
+
+def bit_state(board: Board, state: GameState) -> BitState:
+    """The BitState of a GameState"""
+    return BitState(
+        boxes=sum(1 << board.index(x, y) for x, y in state.boxes),
+        masks=sum(1 << board.index(x, y) for x, y in state.masks),
+        player=board.index(*state.player),
+        abilities=sum(1 << power.value for power in state.abilities),
+        current=state.current_ability.value,
+    )
+
+
+def main_event(events) -> EventKind:
+    """The event Board.step returns for the events of GameState.step"""
+    kinds = [event.kind for event in events]
+    return EventKind.PICKUP if kinds[0] == EventKind.MOVE and EventKind.PICKUP in kinds else kinds[0]
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_board_steps_like_game_state(index):
+    level = all_levels[index]
+    board, state = Board.from_level(level)
+    game = GameState.from_level(level)
+    assert bit_state(board, game) == state
+    actions = list(Action)
+    rng = random.Random(index)
+    for _ in range(3000):
+        action = rng.choice(actions)
+        state, kind = board.step(state, action)
+        assert main_event(game.step(action)) == kind
+        assert bit_state(board, game) == state
+        assert board.is_solved(state) == game.is_solved()
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_board_string_round_trip(index):
+    level = all_levels[index]
+    board, state = Board.from_level(level)
+    text = board.to_string(state)
+    assert Board.from_level(text) == (board, state)
+    assert board.to_string(state) == text
+
+
+def test_round_trip_after_moves():
+    board, state = Board.from_level(all_levels[1])
+    rng = random.Random(1)
+    for _ in range(200):
+        state = board.step(state, rng.choice(list(Action)))[0]
+    again, moved = Board.from_level(board.to_string(state))
+    # the masks picked up are gone from the level, everything else is the same
+    assert (again.walls, again.goals, again.floors) == (board.walls, board.goals, board.floors)
+    assert (moved.boxes, moved.masks, moved.player) == (state.boxes, state.masks, state.player)
+
+
+def test_around_and_push_sources():
+    board, state = Board.from_level("#####\n#   #\n# $ #\n#@ .#\n#####")
+    middle = 1 << board.index(2, 2)
+    assert indices(board.around(middle)) == sorted(
+        board.index(x, y) for x in range(1, 4) for y in range(1, 4) if (x, y) != (2, 2))
+    goal = 1 << board.index(3, 3)
+    # pushed down, right or down right onto the goal from the player standing behind the crystal
+    assert indices(board.push_sources(goal, board.everything & ~board.walls) & ~board.walls) == sorted(
+        [board.index(3, 2), board.index(2, 3), board.index(2, 2)])
+    # pushed from the tile of the crystal
+    assert board.push_sources(goal) & middle
+
+
+def test_live_squares_include_diagonal_pushes():
+    board, _ = Board.from_level("#####\n#$  #\n#   #\n#  .#\n#@  #\n#####")
+    live = board.live_squares()
+    assert live >> board.index(1, 2) & 1  # along the wall, pushed off it over a corner
+    assert not live >> board.index(1, 1) & 1  # in a corner
@@ -0,0 +1,139 @@
+from collections import Counter, deque
+from dataclasses import replace
+
+import pytest
+
+from bitboard import Board, indices
+from deadlock import Deadlock, DeadlockAnalyzer
+from levels import all_levels
+from simulation import PUSHES, Action, EventKind, Power
+
+
+def moved_crystal(before, after) -> int:
+    """The tile a push moved a crystal to"""
+    return (after.boxes & ~before.boxes).bit_length() - 1
+
+
+def check_incrementally(analyzer, before, after, kind):
+    """Like Game.check_deadlock: the tile of a push, nothing for a break or a pickup"""
+    if kind == EventKind.PUSH:
+        return analyzer.check(after, moved_crystal(before, after))
+    return analyzer.check(after)
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_no_deadlock_along_solution(index, solutions):
+    board, state = Board.from_level(all_levels[index])
+    analyzer = DeadlockAnalyzer(board)
+    analyzer.reset(state)
+    assert analyzer.check(state) is None
+    for action in solutions[index]:
+        before = state
+        state, kind = board.step(state, action)
+        if kind in (EventKind.PUSH, EventKind.BREAK, EventKind.PICKUP):
+            assert check_incrementally(analyzer, before, state, kind) is None
+            fresh = DeadlockAnalyzer(board)
+            fresh.reset(state)
+            assert fresh.check(state) is None
+
+
+def pushes(board, state):
+    """Every push, break and pickup the player can walk to, with the states before and after"""
+    region = board.reachable(state, ignore=state.current == Power.IGNORE.value)
+    for tile in indices(region):
+        before = replace(state, player=tile)
+        for action in PUSHES:
+            after, kind = board.step(before, action)
+            if kind in (EventKind.PUSH, EventKind.BREAK, EventKind.PICKUP):
+                yield before, after, kind
+
+
+def assert_incremental_matches_reset(board, starts, limit=2000):
+    """
+    Explores the states of the pushes, breaks and pickups from the starts breadth first and checks
+    each of them both incrementally and from scratch. The deadlocks found, by reason.
+    """
+    dead = DeadlockAnalyzer(board).dead
+    found = Counter()
+    queue = deque(starts)
+    seen = set(queue)
+    while queue and len(seen) < limit:
+        state = queue.popleft()
+        for before, after, kind in pushes(board, state):
+            if board.is_solved(after):
+                continue  # check stops at a solved state, the game goes on with the next level
+            analyzer = DeadlockAnalyzer(board, dead)
+            analyzer.reset(before)
+            incremental = check_incrementally(analyzer, before, after, kind)
+            fresh = DeadlockAnalyzer(board, dead)
+            fresh.reset(after)
+            assert incremental == fresh.check(after)
+            assert analyzer.frozen == fresh.frozen
+            # a corral stays locked when the player gets to the open one around it, from scratch
+            # it is part of that one
+            assert fresh.locked & ~analyzer.locked == 0
+            found[incremental] += 1
+            if incremental is None and after not in seen:
+                seen.add(after)
+                queue.append(after)
+    return found
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_incremental_matches_reset(index, solutions):
+    board, state = Board.from_level(all_levels[index])
+    along = [state]
+    for action in solutions[index]:
+        along.append(board.step(along[-1], action)[0])
+    assert_incremental_matches_reset(board, along)
+
+
+def test_incremental_matches_reset_on_sokoban():
+    # a plain Sokoban level with the push mask in reach: crystals freeze and corrals close
+    level = """
+  #####
+###   #
+#.@P$ #
+### $.#
+#.##$ #
+# # . ##
+#$ *$$.#
+#   .  #
+########
+"""
+    board, state = Board.from_level(level)
+    found = assert_incremental_matches_reset(board, [state])
+    assert found[Deadlock.DEAD_CRYSTALS] and found[Deadlock.CORRAL]
+
+
+def test_crystal_in_corner():
+    level = """
+#####
+#$ @#
+#   #
+#  .#
+#P  #
+#####
+"""
+    board, state = Board.from_level(level)
+    analyzer = DeadlockAnalyzer(board)
+    analyzer.reset(state)
+    assert analyzer.check(state) == Deadlock.DEAD_CRYSTALS
+
+
+def test_crystal_along_wall_is_pushed_off_diagonally():
+    level = """
+#####
+#@$ #
+#   #
+#  .#
+#P  #
+#####
+"""
+    board, state = Board.from_level(level)
+    analyzer = DeadlockAnalyzer(board)
+    analyzer.reset(state)
+    assert analyzer.check(state) is None
+    state = replace(state, abilities=0b11, current=Power.PUSH.value)
+    state, kind = board.step(state, Action.RIGHT_DOWN)
+    assert kind == EventKind.PUSH and state.boxes == 1 << board.index(3, 2)
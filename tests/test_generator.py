@@ -0,0 +1,29 @@
+import random
+
+from generator import Settings, carve_room, generate
+from simulation import GameState, parse_level
+from solver import parse_moves
+
+
+def test_room_too_small_is_skipped():
+    # 4 inner tiles for 3 crystals, a mask and the player
+    settings = Settings(width=4, height=4, crystals=3, goals=3, masks="P")
+    for seed in range(20):
+        assert generate(seed, settings) is None
+
+
+def test_small_room_is_all_floor():
+    room = carve_room(random.Random(0), Settings(width=5, height=4))
+    assert len(room.floors) == 6
+
+
+def test_candidates_are_solved():
+    settings = Settings(crystals=2, goals=2)
+    candidates = [c for c in (generate(seed, settings) for seed in range(30)) if c is not None]
+    assert candidates
+    for candidate in candidates:
+        data = parse_level(candidate.level)
+        assert len(data.boxes) == 2 and len(data.goals) == 2
+        state = GameState.from_level(candidate.level)
+        state.run(parse_moves(candidate.moves))
+        assert state.is_solved()
@@ -0,0 +1,58 @@
+import asyncio
+
+from bitboard import Board
+from hints import HINT_RETRIES, HintEngine
+from levels import all_levels
+
+LEVEL = all_levels[1]
+
+
+def failing_engine(monkeypatch, failures: int) -> tuple[HintEngine, list]:
+    """An engine searching in asyncio tasks, the first searches raise an error"""
+    engine = HintEngine(processes=False)
+    calls = []
+    solve_sliced = engine.solve_sliced
+
+    async def search(level, state):
+        calls.append(state)
+        if len(calls) <= failures:
+            raise RuntimeError("the search failed")
+        return await solve_sliced(level, state)
+
+    monkeypatch.setattr(engine, "solve_sliced", search)
+    return engine, calls
+
+
+async def wait(engine: HintEngine) -> bool:
+    """Poll like the frame loop until the engine has nothing running"""
+    while engine.running is not None:
+        if engine.poll():
+            return True
+        await asyncio.sleep(0)
+    return False
+
+
+def test_failed_search_is_searched_again(monkeypatch):
+    engine, calls = failing_engine(monkeypatch, 1)
+    state = Board.from_level(LEVEL)[1]
+
+    async def run():
+        engine.request(LEVEL, state)
+        return await wait(engine)
+
+    assert asyncio.run(run())
+    assert len(calls) == 2
+    assert engine.lookup(LEVEL, state).action is not None
+
+
+def test_failed_search_is_not_cached(monkeypatch):
+    engine, calls = failing_engine(monkeypatch, HINT_RETRIES + 1)
+    state = Board.from_level(LEVEL)[1]
+
+    async def run():
+        engine.request(LEVEL, state)
+        return await wait(engine)
+
+    assert not asyncio.run(run())
+    assert len(calls) == HINT_RETRIES + 1
+    assert engine.lookup(LEVEL, state) is None
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import random
+import wave
+
+import pytest
+
+pygame = pytest.importorskip("pygame")
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def game(tmp_path_factory):
+    """A game with the assets loaded, with the SDL dummy drivers and the caches in a folder of the test"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("SDL_VIDEODRIVER", "dummy")
+        patch.setenv("SDL_AUDIODRIVER", "dummy")
+        cache = str(tmp_path_factory.mktemp("cache"))
+        patch.setattr(main, "ANALYSIS_CACHE_DIR", cache)
+        patch.setattr(main, "DECODED_CACHE_DIR", cache)
+        game = main.Game()
+        asyncio.run(game.load_assets())
+        yield game
+
+
+def test_sprite_cache_keys(game):
+    cache = main.SpriteCache(max_entries=4)
+    image = pygame.Surface((40, 20), pygame.SRCALPHA)
+    sprite = cache.get(image, (20, 10))
+    assert sprite.get_size() == (20, 10)
+    assert cache.get(image, (20, 10)) is sprite
+    # another size, alpha or image is another sprite
+    assert cache.get(image, (10, 5)) is not sprite
+    assert cache.get(image, (20, 10), 128).get_alpha() == 128
+    assert cache.get(pygame.Surface((40, 20)), (20, 10)) is not sprite
+    assert len(cache) == 4
+    # the least recently used goes first
+    cache.get(image, (20, 10))
+    cache.get(image, (30, 15))
+    assert len(cache) == 4
+    assert cache.get(image, (20, 10)) is sprite
+
+
+def test_frames_scale_nothing(game, monkeypatch):
+    game.draw_scene()
+
+    def smoothscale(*args):
+        raise AssertionError("a frame scaled a sprite")
+
+    monkeypatch.setattr(pygame.transform, "smoothscale", smoothscale)
+    for _ in range(3):
+        game.draw_scene()
+
+
+def test_box_store_counts_covered_goals(game):
+    level = main.Level("#######\n#@$ . #\n# *   #\n#######")
+    boxes = main.BoxStore(level)
+    assert len(boxes) == 2 and boxes.covered_goals == 1
+    assert not boxes.is_solved()
+    box = boxes.at(main.GridPos(2, 1))
+    boxes.move(box, main.GridPos(4, 1))
+    assert boxes.at(main.GridPos(4, 1)) is box and box.glows
+    assert main.GridPos(2, 1) not in boxes
+    assert boxes.covered_goals == 2 and boxes.is_solved()
+    boxes.remove(boxes.at(main.GridPos(2, 2)))
+    assert boxes.covered_goals == 1 and not boxes.is_solved()
+    boxes.add(main.GridPos(2, 2))
+    assert boxes.covered_goals == 2
+    assert {box.grid_pos for box in boxes.in_tiles(pygame.Rect(0, 0, 7, 2))} == {main.GridPos(4, 1)}
+
+
+def test_panel_cache_keys(game):
+    cache = main.PanelCache(max_entries=3)
+    panel = cache.get("Reset Level", 40, (120, 20, 20))
+    assert cache.get("Reset Level", 40, (120, 20, 20)) is panel
+    # every argument is part of the key
+    assert cache.get("Reset Level", 40, (20, 20, 20)) is not panel
+    assert cache.get("Reset Level", 32, (120, 20, 20)).get_height() < panel.get_height()
+    assert len(cache) == 3
+    cache.get("Reset Level", 40, (120, 20, 20), antialias=False)
+    assert len(cache) == 3
+    assert cache.get("Reset Level", 40, (120, 20, 20)) is not panel  # dropped as the least recently used
+
+
+def test_merge_rects():
+    bounds = pygame.Rect(0, 0, 100, 100)
+    merged = main.merge_rects([
+        pygame.Rect(10, 10, 10, 10),
+        pygame.Rect(50, 50, 10, 10),
+        pygame.Rect(15, 15, 10, 10),  # overlaps the first
+        pygame.Rect(95, 0, 20, 5),  # cut at the edge
+        pygame.Rect(200, 200, 5, 5),  # outside
+    ], bounds)
+    assert sorted(merged) == [pygame.Rect(10, 10, 15, 15), pygame.Rect(50, 50, 10, 10), pygame.Rect(95, 0, 5, 5)]
+
+
+def test_merge_rects_joins_what_a_union_makes_overlap():
+    bounds = pygame.Rect(0, 0, 100, 100)
+    # the last one overlaps the union of the first and the third, which then overlaps the second
+    merged = main.merge_rects([
+        pygame.Rect(0, 0, 10, 10),
+        pygame.Rect(30, 0, 10, 10),
+        pygame.Rect(5, 0, 10, 10),
+        pygame.Rect(12, 0, 20, 10),
+    ], bounds)
+    assert merged == [pygame.Rect(0, 0, 40, 10)]
+
+
+def save_image(path, color) -> None:
+    image = pygame.Surface((3, 2), pygame.SRCALPHA)
+    image.fill(color)
+    pygame.image.save(image, str(path))
+
+
+def test_decoded_cache_images(game, tmp_path, monkeypatch):
+    source = tmp_path / "image.png"
+    save_image(source, (10, 20, 30, 40))
+    cache = main.DecodedCache(str(tmp_path / "cache"))
+    first = cache.image(str(source))
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pygame.image, "load", None)  # the entry is mapped, nothing is decoded
+        again = cache.image(str(source))
+    assert again.get_size() == (3, 2)
+    assert pygame.image.tobytes(again, "RGBA") == pygame.image.tobytes(first, "RGBA")
+
+    # a changed file is a new entry
+    save_image(source, (50, 60, 70, 80))
+    assert tuple(cache.image(str(source)).get_at((0, 0))) == (50, 60, 70, 80)
+    assert len(os.listdir(tmp_path / "cache")) == 2
+    # without a directory the file is decoded every time
+    assert tuple(main.DecodedCache(None).image(str(source)).get_at((1, 1))) == (50, 60, 70, 80)
+
+
+def test_decoded_cache_sounds(game, tmp_path):
+    source = tmp_path / "sound.wav"
+    with wave.open(str(source), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(22050)
+        f.writeframes(bytes(range(256)) * 40)
+    cache = main.DecodedCache(str(tmp_path / "cache"))
+    samples = bytes(cache.samples(str(source)))
+    assert os.listdir(tmp_path / "cache")
+    assert bytes(cache.samples(str(source))) == samples
+    assert cache.sound(str(source)).get_raw() == samples
+    assert len(os.listdir(tmp_path / "cache")) == 1  # the same entry for samples and sounds
+
+
+def test_music_stays_in_the_budget(game):
+    stem = 1_000_000
+    requested = []
+    music = main.MusicManager(4, requested.append, {0: memoryview(bytearray(stem))})
+    # the segments on the channels and two stems
+    music.budget = 2 * len(music.channels) * music.segment_bytes + 2 * stem
+    music.preload()
+    assert requested == [1]
+    music.add(1, memoryview(bytearray(stem)))
+    assert music.memory() <= music.budget
+
+    # the stem that was not played last makes room for the next one
+    music.switch_to(2)
+    assert requested == [1, 2] and list(music.stems) == [0]
+    assert music.memory() <= music.budget
+    music.add(2, memoryview(bytearray(stem)))
+    assert music.current == 2 and music.memory() <= music.budget
+
+    # while crossfading both stems play, none is dropped
+    music.switch_to(3)
+    assert requested == [1, 2]
+    music.update(1.0)
+    music.switch_to(3)
+    assert requested == [1, 2, 3] and list(music.stems) == [2]
+    assert music.memory() <= music.budget
+
+
+def test_missing_music_is_quiet(game, monkeypatch, capsys):
+    monkeypatch.setattr(main, "MUSIC_FILES", ["assets/music/missing.ogg"])
+    asyncio.run(game.load_sounds())
+    assert game.music is None
+    assert capsys.readouterr() == ("", "")
+
+
+def scene(game) -> tuple:
+    """Everything an undo restores"""
+    return (
+        sorted((box.grid_pos.x, box.grid_pos.y) for box in game.boxes),
+        sorted((mask.pos.x, mask.pos.y, mask.power) for mask in game.level.masks),
+        bytes(game.level.grid),
+        tuple(game.player.position),
+        game.player.abilities.copy(),
+        game.player.current_ability,
+        game.boxes.covered_goals,
+        game.state,
+    )
+
+
+# seeds of random input that pushes, breaks and picks up masks in the level
+@pytest.mark.parametrize("level_index, seed", [(3, 19), (8, 11)])
+def test_undo_restores_the_scene(game, level_index, seed, monkeypatch):
+    game.level_index = level_index
+    game.execute(main.Command.RESTART)
+    start = scene(game)
+    rng = random.Random(seed)
+    directions = [(x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)]
+    scenes = []
+    for _ in range(150):
+        if rng.random() < 0.1:
+            game.execute(main.Command.SWITCH)
+        direction = rng.choice(directions)
+        for _ in range(rng.randrange(1, 40)):
+            before = scene(game)
+            game.simulate(main.input_vector(direction))
+            if len(game.history) > len(scenes):
+                scenes.append(before)
+    kinds = {event.kind for snapshot in game.history for event in snapshot.events}
+    assert kinds == {main.EventKind.PUSH, main.EventKind.BREAK, main.EventKind.PICKUP}
+
+    # every undo gives the scene before the step, the state is the one built from scratch
+    while scenes:
+        game.execute(main.Command.UNDO)
+        assert scene(game) == scenes.pop()
+        assert game.state == game.build_state()
+    game.execute(main.Command.UNDO)  # nothing left to undo
+    assert not game.history
+
+    # a restart gives the scene of the start again, from a clone of the parsed level
+    monkeypatch.setattr(main, "Level", None)
+    game.execute(main.Command.RESTART)
+    assert scene(game) == start
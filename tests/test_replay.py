@@ -0,0 +1,81 @@
+import asyncio
+import random
+
+import pytest
+
+from replay import Command, InputRecorder, InputReplay, direction_tag, tag_direction
+
+DIRECTIONS = [(x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)]
+
+
+def recording(level_index: int, step: float, seed: int, steps: int = 3000) -> bytes:
+    """Random input: directions held for a while, now and then a command and a restart half way"""
+    rng = random.Random(seed)
+    recorder = InputRecorder(level_index, step)
+    while recorder.steps < steps:
+        if recorder.steps > steps // 2 > recorder.steps - 40:
+            recorder.command(Command.RESTART)
+        if rng.random() < 0.1:
+            recorder.command(rng.choice([Command.SWITCH, Command.SWITCH, Command.UNDO]))
+        direction = rng.choice(DIRECTIONS)
+        for _ in range(rng.randrange(1, 40)):
+            recorder.step(direction)
+    return recorder.to_bytes()
+
+
+def test_direction_tags():
+    for direction in DIRECTIONS:
+        assert tag_direction(direction_tag(direction)) == direction
+
+
+def test_recording_round_trip():
+    recorder = InputRecorder(3, 0.01)
+    expected = []
+    commands = []
+    for i in range(70000):  # longer than one record holds
+        if i % 1000 == 0:
+            recorder.command(Command.SWITCH)
+            commands.append(Command.SWITCH)
+        direction = DIRECTIONS[i // 300 % len(DIRECTIONS)]
+        recorder.step(direction)
+        expected.append((commands, direction))
+        commands = []
+    recorder.command(Command.RESTART)
+    expected.append(([Command.RESTART], (0, 0)))
+
+    replay = InputReplay(recorder.to_bytes())
+    assert (replay.level_index, replay.steps) == (3, 70000)
+    assert replay.step_time == pytest.approx(0.01)
+    assert list(replay) == expected
+
+
+def test_other_files_are_refused():
+    with pytest.raises(ValueError):
+        InputReplay(b"RIFF" + bytes(20))
+
+
+def play(data: bytes) -> tuple:
+    """Where the recording ends: the summary of run_replay without the times, the state and the undo history"""
+    from main import Game
+    game = Game(replay=InputReplay(data))
+    result = asyncio.run(game.run_replay())
+    del result["seconds"], result["speedup"]
+    return result, game.bit_state(), game.history
+
+
+# seeds of recordings that push or break crystals in the level
+@pytest.mark.parametrize("level_index, seed", [(1, 2), (5, 3)])
+def test_replay_is_deterministic(level_index, seed, monkeypatch, tmp_path):
+    pytest.importorskip("pygame")
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setenv("SDL_AUDIODRIVER", "dummy")
+    import main
+    # the caches of the game go to a folder of the test, not to the one of the player
+    monkeypatch.setattr(main, "ANALYSIS_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "DECODED_CACHE_DIR", str(tmp_path / "decoded"))
+    data = recording(level_index, main.SIMULATION_STEP, seed)
+    first = play(data)
+    assert first[0]["steps"] == InputReplay(data).steps
+    assert first[2]
+    assert play(data) == first
+    assert any((tmp_path / "decoded").iterdir())
@@ -0,0 +1,125 @@
+import pytest
+
+from simulation import Action, EventKind, GameState, Power, parse_level
+
+LEVEL = """
+#######
+#P I B#
+#@$   #
+#  $  #
+#    .#
+#   * #
+#######
+"""
+
+
+def game(**changes) -> GameState:
+    state = GameState.from_level(LEVEL)
+    for name, value in changes.items():
+        setattr(state, name, value)
+    return state
+
+
+def kinds(events) -> list[EventKind]:
+    return [event.kind for event in events]
+
+
+def test_parse_level():
+    data = parse_level(LEVEL)
+    assert (data.width, data.height) == (7, 7)
+    assert data.player == (1, 2)
+    assert data.boxes == {(2, 2), (3, 3), (4, 5)}
+    assert data.goals == {(5, 4), (4, 5)}
+    assert data.masks == {(1, 1): Power.PUSH, (3, 1): Power.IGNORE, (5, 1): Power.BREAK}
+
+
+def test_walls_and_crystals_block():
+    state = game()
+    assert kinds(state.step(Action.LEFT)) == [EventKind.BLOCKED]
+    assert kinds(state.step(Action.RIGHT)) == [EventKind.BLOCKED]  # no push mask yet
+    assert state.player == (1, 2)
+
+
+def test_pickup_and_switch():
+    state = game()
+    assert kinds(state.step(Action.UP)) == [EventKind.MOVE, EventKind.PICKUP]
+    assert state.current_ability == Power.PUSH and (1, 1) not in state.masks
+    state.abilities.add(Power.BREAK)
+    state.step(Action.SWITCH)
+    assert state.current_ability == Power.BREAK
+    state.step(Action.SWITCH)
+    assert state.current_ability == Power.NONE
+
+
+def test_push_along_an_axis():
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH)
+    events = state.step(Action.RIGHT)
+    assert kinds(events) == [EventKind.PUSH, EventKind.MOVE]
+    assert events[0].pos == (3, 2) and events[0].source == (2, 2)
+    assert state.player == (2, 2) and (3, 2) in state.boxes
+
+
+@pytest.mark.parametrize("action, crystal", [
+    (Action.RIGHT_DOWN, (3, 3)),
+    (Action.RIGHT_UP, (3, 1)),
+])
+def test_push_diagonally(action, crystal):
+    # like the game: the player steps into the tile of the crystal, it goes in the direction of the input
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH)
+    state.boxes.discard((3, 3))
+    events = state.step(action)
+    assert kinds(events) == [EventKind.PUSH, EventKind.MOVE]
+    assert events[0].source == (2, 2) and events[0].pos == crystal
+    assert state.player == (2, 2) and crystal in state.boxes
+
+
+def test_diagonal_push_needs_room_where_the_crystal_goes():
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH)
+    assert kinds(state.step(Action.RIGHT_DOWN)) == [EventKind.BLOCKED]  # the crystal at 3, 3
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH, player=(2, 1))
+    state.masks.clear()
+    assert kinds(state.step(Action.DOWN_RIGHT)) == [EventKind.BLOCKED]  # a crystal at 3, 3
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH, player=(4, 4))
+    assert kinds(state.step(Action.DOWN_RIGHT)) == [EventKind.BLOCKED]  # a wall at 5, 6
+    assert kinds(state.step(Action.DOWN_LEFT)) == [EventKind.BLOCKED]
+
+
+def test_diagonal_action_without_crystal_is_a_step():
+    state = game()
+    assert kinds(state.step(Action.DOWN_RIGHT)) == [EventKind.MOVE]
+    assert state.player == (1, 3)
+
+
+def test_push_the_crystal_underneath():
+    # after walking onto a crystal with the ignore mask and switching to push
+    state = game(abilities={Power.NONE, Power.PUSH, Power.IGNORE}, current_ability=Power.IGNORE)
+    state.step(Action.RIGHT)
+    assert state.player == (2, 2)
+    while state.current_ability != Power.PUSH:
+        state.step(Action.SWITCH)
+    events = state.step(Action.UP_LEFT)
+    assert kinds(events) == [EventKind.PUSH]
+    assert events[0].pos == (1, 1) and state.player == (2, 2)
+
+
+def test_break():
+    state = game(abilities={Power.NONE, Power.BREAK}, current_ability=Power.BREAK)
+    assert kinds(state.step(Action.RIGHT_DOWN)) == [EventKind.BREAK]
+    assert (2, 2) not in state.boxes and state.player == (1, 2)
+
+
+def test_solved():
+    state = game(abilities={Power.NONE, Power.PUSH}, current_ability=Power.PUSH, player=(3, 4))
+    assert not state.is_solved()
+    state.boxes = {(4, 4), (4, 5)}
+    state.covered_goals = 1
+    state.step(Action.RIGHT)
+    assert state.is_solved() and state.covered_goals == 2
+
+
+def test_key_changes_with_the_state():
+    state = game()
+    key = state.key()
+    assert state.copy().key() == key
+    state.step(Action.DOWN)
+    assert state.key() != key
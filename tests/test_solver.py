@@ -0,0 +1,44 @@
+import pytest
+
+from bitboard import Board
+from levels import all_levels
+from simulation import Action, EventKind, GameState
+from solver import Solver, format_moves, parse_moves, verify
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_solution_solves_game_state(index, solutions):
+    moves = solutions[index]
+    assert verify(all_levels[index], moves)
+    state = GameState.from_level(all_levels[index])
+    events = state.run(moves)
+    assert state.is_solved()
+    # the solver never walks into a wall or a crystal it can not push
+    assert not any(event.kind == EventKind.BLOCKED for event in events)
+
+
+@pytest.mark.parametrize("index", range(len(all_levels)))
+def test_solution_solves_board(index, solutions):
+    board, state = Board.from_level(all_levels[index])
+    for action in solutions[index]:
+        state = board.step(state, action)[0]
+    assert board.is_solved(state)
+
+
+def test_search_from_a_later_state(solutions):
+    level = all_levels[4]
+    board, state = Board.from_level(level)
+    moves = solutions[4]
+    for action in moves[:len(moves) // 2]:
+        state = board.step(state, action)[0]
+    result = Solver(level, start=state).solve()
+    assert result.solved
+    for action in result.moves:
+        state = board.step(state, action)[0]
+    assert board.is_solved(state)
+
+
+def test_moves_round_trip():
+    moves = list(Action)
+    assert parse_moves(format_moves(moves)) == moves
+    assert parse_moves("r rD s\nuL") == [Action.RIGHT, Action.RIGHT_DOWN, Action.SWITCH, Action.UP_LEFT]
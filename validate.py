@@ -0,0 +1,235 @@
+"""
+Checks a level pack: by default levels.all_levels, or an external pack, either a .py file with
+an all_levels list or a text file with the levels separated by empty lines.
+
+For every level:
+- the annotations (row_x_text) parse
+- there is exactly one player (@ or +) and no unknown characters
+- the floor is surrounded by walls
+- there are enough crystals for the goals, with a break mask crystals can get lost
+- the solver finds a solution within the time limit, with the rules of simulation.py; they push
+  crystals like the game, along the axes and diagonally, so a level the solver can not finish can
+  not be finished in the game either (short of the moves that need a position exact to the pixel,
+  see simulation.py)
+
+The levels are checked in a multiprocessing pool and the report is printed as JSON. The analysis
+of every level is cached (see analysis.py), levels that did not change since an earlier run are not
+solved again. In CI keep the cache directory between runs with --cache. The solver is weighted for
+speed, --weight 1 gives the shortest solutions and the moves and pushes of those.
+
+usage: python validate.py [--pack levels.txt] [--time 30] [--weight 5] [--out report.json] [--cache dir | --no-cache]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from analysis import CACHE_DIR, SOLVER_WEIGHT, Analysis, AnalysisCache, analyze
+from simulation import Power, parse_level
+
+LEVEL_CHARACTERS: str = "#.$@*+PBI "
+
+
+@dataclass(slots=True)
+class LevelReport:
+    index: int
+    name: str
+    errors: list[str] = field(default_factory=list)
+    warnings: list[str] = field(default_factory=list)
+    goals: int = 0
+    crystals: int = 0
+    break_masks: int = 0
+    # solver result, status is "skipped" when the level has errors
+    status: str = "skipped"
+    seconds: float = 0.0
+    moves: int = 0
+    pushes: int = 0
+    solution: str = ""
+    dead_squares: int = 0
+    cached: bool = False  # the solver result comes from the analysis cache
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+# ============================
+# Checks
+# ============================
+
+def check_rows(level: str, report: LevelReport) -> None:
+    """Annotations, characters and the number of players"""
+    players = 0
+    for y, line in enumerate(level.strip("\n").splitlines()):
+        row, *annotation = line.rstrip("\n").split("_", 2)
+        if annotation:
+            if len(annotation) < 2 or not annotation[1]:
+                report.errors.append(f"row {y}: annotation without text: {line!r}")
+            else:
+                try:
+                    int(annotation[0])
+                except ValueError:
+                    report.errors.append(f"row {y}: annotation position {annotation[0]!r} is not a number")
+        for x, ch in enumerate(row):
+            if ch not in LEVEL_CHARACTERS:
+                report.errors.append(f"row {y}: unknown character {ch!r} at x={x}")
+            players += ch in "@+"
+    if players != 1:
+        report.errors.append(f"{players} players, there must be exactly one @ or +")
+
+
+def check_walls(level: str, report: LevelReport) -> None:
+    """Walking from any floor tile must never leave the level"""
+    data = parse_level(level)
+    inside = data.floors | data.goals
+    queue = deque(inside)
+    seen = set(inside)
+    while queue:
+        x, y = queue.popleft()
+        for pos in ((x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)):
+            if pos in seen or pos in data.walls:
+                continue
+            if pos not in inside:
+                report.errors.append(f"not surrounded by walls, the player can leave the level at {pos}")
+                return
+            seen.add(pos)
+            queue.append(pos)
+
+
+def check_counts(level: str, report: LevelReport) -> None:
+    data = parse_level(level)
+    report.goals = len(data.goals)
+    report.crystals = len(data.boxes)
+    report.break_masks = sum(power == Power.BREAK for power in data.masks.values())
+    if not data.goals:
+        report.errors.append("no goals")
+    if report.crystals < report.goals:
+        report.errors.append(f"{report.crystals} crystals for {report.goals} goals")
+    elif report.break_masks and report.crystals == report.goals:
+        report.warnings.append("as many crystals as goals, breaking any crystal makes the level unsolvable")
+
+
+def check_level(
+        index: int,
+        name: str,
+        level: str,
+        time_limit: float,
+        memory_limit_mb: float,
+        weight: float = SOLVER_WEIGHT,
+        analysis: Analysis | None = None,
+) -> tuple[LevelReport, Analysis | None]:
+    """The report and the analysis of the level, the solver only runs without a cached analysis"""
+    report = LevelReport(index, name, cached=analysis is not None)
+    check_rows(level, report)
+    if report.errors:
+        return report, None
+    check_walls(level, report)
+    check_counts(level, report)
+    if report.errors:
+        return report, None
+
+    if analysis is None:
+        analysis = analyze(level, time_limit, memory_limit_mb, weight)
+    report.status = analysis.status
+    report.seconds = analysis.seconds
+    report.dead_squares = analysis.dead_squares
+    if analysis.status == "invalid solution":
+        report.errors.append("the solution found does not replay in the simulation")
+    elif not analysis.solved:
+        report.errors.append(f"no solution found: {analysis.status}")
+    else:
+        report.moves = analysis.moves
+        report.pushes = analysis.pushes
+        report.solution = analysis.solution
+    return report, analysis
+
+
+def _check_level(args: tuple[int, str, str, float, float, float]) -> tuple[LevelReport, Analysis | None]:
+    return check_level(*args)
+
+
+# ============================
+# Level packs
+# ============================
+
+def load_pack(path: str | None) -> list[tuple[str, str]]:
+    """(name, level string) of every level in the pack"""
+    if path is None:
+        import levels
+        namespace = vars(levels)
+    elif path.endswith(".py"):
+        namespace = runpy.run_path(path)
+    else:
+        with open(path) as f:
+            blocks = [block for block in f.read().split("\n\n") if block.strip()]
+        return [(f"{path}:{i}", "\n" + block + "\n") for i, block in enumerate(blocks)]
+
+    names = {value: key for key, value in reversed(list(namespace.items())) if isinstance(value, str)}
+    pack = namespace.get("all_levels")
+    if pack is None:
+        pack = [value for key, value in namespace.items() if key.startswith("level_str") and isinstance(value, str)]
+    return [(names.get(level, str(i)), level) for i, level in enumerate(pack)]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check every level of a level pack")
+    parser.add_argument("--pack", default=None, help=".py file with all_levels or text file (default: levels.py)")
+    parser.add_argument("--time", type=float, default=30.0, help="solver time limit per level in seconds")
+    parser.add_argument("--memory", type=float, default=256.0, help="solver memory limit per level in MB")
+    parser.add_argument("--weight", type=float, default=SOLVER_WEIGHT,
+                        help="heuristic weight of the solver, 1 finds the shortest solutions but is slow")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default=None, help="write the report to this file instead of printing it")
+    parser.add_argument("--cache", default=CACHE_DIR, help="directory of the analysis cache")
+    parser.add_argument("--no-cache", action="store_true", help="solve every level again")
+    args = parser.parse_args(argv)
+
+    pack = load_pack(args.pack)
+    started = time.perf_counter()
+    cache = AnalysisCache(None if args.no_cache else args.cache)
+    reports: list[LevelReport | None] = [None] * len(pack)
+    jobs = []
+    for i, (name, level) in enumerate(pack):
+        analysis = cache.get(level, args.weight)
+        if analysis is None:
+            jobs.append((i, name, level, args.time, args.memory, args.weight))
+        else:
+            reports[i] = check_level(i, name, level, args.time, args.memory, args.weight, analysis)[0]
+    if jobs:
+        # no pool at all when every level is cached, starting it costs more than the lookups
+        with multiprocessing.Pool(min(args.workers or os.cpu_count() or 1, len(jobs))) as pool:
+            for report, analysis in pool.map(_check_level, jobs, chunksize=1):
+                reports[report.index] = report
+                if analysis is not None:
+                    cache.put(pack[report.index][1], analysis)
+    cache.close()
+
+    failed = [r for r in reports if not r.ok]
+    summary = {
+        "pack": args.pack or "levels.py",
+        "levels": len(reports),
+        "failed": len(failed),
+        "cached": sum(r.cached for r in reports),
+        "seconds": round(time.perf_counter() - started, 3),
+        "reports": [asdict(r) | {"ok": r.ok} for r in reports],
+    }
+    text = json.dumps(summary, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for r in failed:
+        print(f"level {r.index} ({r.name}): {'; '.join(r.errors)}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())